@@ -0,0 +1,23 @@
+"""Add upload content hash
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-16 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('uploads', sa.Column('content_sha256', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('uploads', 'content_sha256')
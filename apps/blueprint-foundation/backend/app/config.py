@@ -30,6 +30,7 @@ class Settings(BaseSettings):
 
     # Upload limits
     max_upload_size: int = 100 * 1024 * 1024  # 100MB
+    upload_part_size: int = 8 * 1024 * 1024  # Multipart part size for streamed uploads
     allowed_mime_types: List[str] = [
         "application/pdf",
         "image/png",
@@ -46,6 +47,22 @@ class Settings(BaseSettings):
     thumbnail_max_size: int = 400  # Max dimension for thumbnail
     blur_threshold: float = 100.0  # Laplacian variance threshold
     low_res_threshold: int = 1800  # Minimum pixel dimension
+    page_output_profile: str = "balanced"  # fast | balanced | small | palette | bilevel | webp_lossless
+
+    # Cost-aware routing to processing lanes (see app/queue.py)
+    cost_base_seconds: float = 1.0
+    cost_seconds_per_mb: float = 0.02
+    cost_seconds_per_megapixel: float = 0.15  # Render and enhance time per page megapixel
+    cost_pdf_bytes_per_page: int = 300 * 1024  # Assumed size of one PDF page when the count is not found
+    lane_small_max_seconds: float = 10.0  # Estimates up to this go to the small lane
+    lane_large_min_seconds: float = 120.0  # Estimates from this go to the large lane
+
+    # Worker
+    worker_mode: str = "fork"  # fork (one work horse per job) | preloaded (long-lived children)
+    worker_processes: int = 1  # Preloaded children per worker container
+    worker_max_jobs: int = 100  # Jobs before a preloaded child is replaced (0 = never)
+    worker_max_rss_mb: int = 2048  # RSS after which a preloaded child is replaced (0 = no limit)
+    worker_queues: List[str] = []  # Queues to work on, highest priority first (empty = all lanes)
 
     # Signed URL expiry (seconds)
     signed_url_expiry: int = 3600  # 1 hour
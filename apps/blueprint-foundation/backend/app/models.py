@@ -66,6 +66,7 @@ class Upload(Base):
     mime_type = Column(String(100), nullable=False)
     size_bytes = Column(BigInteger, nullable=False)
     storage_key_original = Column(String(1000), nullable=False)
+    content_sha256 = Column(String(64), nullable=True)  # Hex digest of the original file
     status = Column(Enum(UploadStatus), nullable=False, default=UploadStatus.UPLOADED)
     error_message = Column(Text, nullable=True)
     warnings = Column(JSON, nullable=True)  # List of warning strings
@@ -91,6 +92,7 @@ class Page(Base):
     storage_key_page_thumb = Column(String(1000), nullable=True)
     status = Column(Enum(PageStatus), nullable=False, default=PageStatus.READY)
     warnings = Column(JSON, nullable=True)  # List of warning strings
+    metrics = Column(JSON, nullable=True)  # Structured per-page metrics (encoding, ...)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
 
     # Relationships
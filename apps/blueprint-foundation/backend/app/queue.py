@@ -1,7 +1,11 @@
 """Redis Queue (RQ) configuration."""
+import re
+from typing import Optional, Tuple
+from PIL import ImageFile
 from redis import Redis
 from rq import Queue
 from app.config import settings
+from app.storage import storage_client
 
 
 # Parse Redis URL
@@ -10,6 +14,26 @@ redis_conn = Redis.from_url(settings.redis_url)
 # Create queue
 task_queue = Queue("blueprints", connection=redis_conn)
 
+# Processing lanes in worker priority order: (lane, queue name). "blueprints"
+# stays the standard lane so jobs enqueued before lanes existed still run.
+LANES = [
+    ("small", "blueprints_small"),
+    ("standard", "blueprints"),
+    ("large", "blueprints_large"),
+]
+# Never below RQ's default job timeout; otherwise a few times the estimate
+MIN_JOB_TIMEOUT_SECONDS = 180
+JOB_TIMEOUT_FACTOR = 4
+# Bytes read from each end of the original to find page count and size
+PROBE_BYTES = 64 * 1024
+# Used when the probe finds nothing: an ARCH D sheet and a phone photo
+DEFAULT_PDF_PAGE_POINTS = (36 * 72, 24 * 72)
+DEFAULT_IMAGE_PIXELS = 12_000_000
+
+_LINEARIZED_PAGES = re.compile(rb"/Linearized\b.{0,200}?/N\s+(\d+)", re.S)
+_PAGE_TREE_COUNT = re.compile(rb"/Type\s*/Pages\b[^>]{0,200}?/Count\s+(\d+)|/Count\s+(\d+)[^>]{0,200}?/Type\s*/Pages\b", re.S)
+_MEDIA_BOX = re.compile(rb"/MediaBox\s*\[\s*(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s*\]")
+
 
 def enqueue_task(func, *args, **kwargs):
     """Enqueue a task for background processing.
@@ -24,3 +48,136 @@ def enqueue_task(func, *args, **kwargs):
     """
     job = task_queue.enqueue(func, *args, **kwargs)
     return job
+
+
+def _probe_pdf(storage_key: str) -> Tuple[Optional[int], Optional[Tuple[float, float]]]:
+    """Find the page count and first page size of a stored PDF.
+
+    Linearized PDFs state the page count up front; otherwise the page tree
+    root is often near either end. Compressed object streams hide both.
+
+    Args:
+        storage_key: Object key of the original
+
+    Returns:
+        Tuple of page count and (width, height) in points, either None if not found
+    """
+    head = storage_client.read_range(storage_key, 0, PROBE_BYTES) or b""
+    tail = storage_client.read_range(storage_key, -PROBE_BYTES, PROBE_BYTES) or b""
+    count = None
+    match = _LINEARIZED_PAGES.search(head[:2048])
+    if match:
+        count = int(match.group(1))
+    else:
+        counts = [int(a or b) for a, b in _PAGE_TREE_COUNT.findall(head + tail)]
+        count = max(counts) if counts else None
+    size = None
+    box = _MEDIA_BOX.search(head) or _MEDIA_BOX.search(tail)
+    if box:
+        x0, y0, x1, y1 = (float(value) for value in box.groups())
+        size = (abs(x1 - x0), abs(y1 - y0))
+    return count, size
+
+
+def _probe_image(storage_key: str) -> Optional[Tuple[int, int]]:
+    """Read the pixel size of a stored image from its header.
+
+    Args:
+        storage_key: Object key of the original
+
+    Returns:
+        (width, height) in pixels or None if the header was not understood
+    """
+    parser = ImageFile.Parser()
+    try:
+        parser.feed(storage_client.read_range(storage_key, 0, PROBE_BYTES) or b"")
+    except Exception:
+        return None
+    return parser.image.size if parser.image is not None else None
+
+
+def estimate_cost(mime_type: str, size_bytes: int, storage_key: Optional[str] = None) -> dict:
+    """Estimate the worker time of processing an upload.
+
+    The estimate is a fixed overhead, fetching the original, and rendering
+    and enhancing every page, which scales with its pixel count. With a
+    storage_key the page count and page size are probed from ranged reads
+    at each end of the original; otherwise, or when the probe finds nothing,
+    PDFs are counted as settings.cost_pdf_bytes_per_page bytes per ARCH D
+    page and images as DEFAULT_IMAGE_PIXELS.
+
+    Args:
+        mime_type: MIME type of the original
+        size_bytes: Size of the original in bytes
+        storage_key: Object key of the original, to probe
+
+    Returns:
+        Dict with lane, queue, estimated_seconds, pages, megapixels and probed
+    """
+    pages, page_pixels, probed = None, None, False
+    if storage_key:
+        try:
+            if mime_type == "application/pdf":
+                pages, points = _probe_pdf(storage_key)
+                if points:
+                    dpi = settings.image_target_dpi
+                    page_pixels = int(points[0] / 72 * dpi * points[1] / 72 * dpi)
+                probed = pages is not None or points is not None
+            else:
+                size = _probe_image(storage_key)
+                page_pixels = size[0] * size[1] if size else None
+                probed = size is not None
+        except Exception:
+            pages, page_pixels, probed = None, None, False
+    if mime_type == "application/pdf":
+        if pages is None:
+            pages = max(1, size_bytes // settings.cost_pdf_bytes_per_page)
+        if page_pixels is None:
+            width, height = DEFAULT_PDF_PAGE_POINTS
+            page_pixels = int(width / 72 * settings.image_target_dpi * height / 72 * settings.image_target_dpi)
+    else:
+        pages = 1
+        page_pixels = page_pixels or DEFAULT_IMAGE_PIXELS
+    megapixels = pages * page_pixels / 1_000_000
+    seconds = (
+        settings.cost_base_seconds
+        + size_bytes / (1024 * 1024) * settings.cost_seconds_per_mb
+        + megapixels * settings.cost_seconds_per_megapixel
+    )
+    if seconds <= settings.lane_small_max_seconds:
+        lane, queue_name = LANES[0]
+    elif seconds >= settings.lane_large_min_seconds:
+        lane, queue_name = LANES[2]
+    else:
+        lane, queue_name = LANES[1]
+    return {
+        "lane": lane,
+        "queue": queue_name,
+        "estimated_seconds": round(seconds, 1),
+        "pages": pages,
+        "megapixels": round(megapixels, 1),
+        "probed": probed,
+    }
+
+
+def enqueue_upload_task(func, upload_id: str, mime_type: str, size_bytes: int, storage_key: Optional[str] = None):
+    """Enqueue an upload processing job on the lane matching its estimated cost.
+
+    The estimate is stored in job.meta["cost"]; the worker adds the measured
+    run time as job.meta["run_ms"].
+
+    Args:
+        func: Function to execute
+        upload_id: Upload UUID string
+        mime_type: MIME type of the original
+        size_bytes: Size of the original in bytes
+        storage_key: Object key of the original, probed for page count and size
+
+    Returns:
+        Tuple of the RQ Job instance and the cost estimate
+    """
+    cost = estimate_cost(mime_type, size_bytes, storage_key)
+    lane_queue = Queue(cost["queue"], connection=redis_conn)
+    timeout = max(MIN_JOB_TIMEOUT_SECONDS, int(cost["estimated_seconds"] * JOB_TIMEOUT_FACTOR))
+    job = lane_queue.enqueue(func, upload_id, job_timeout=timeout, meta={"cost": cost})
+    return job, cost
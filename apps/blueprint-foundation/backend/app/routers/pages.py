@@ -8,6 +8,7 @@ from app.schemas import SignedUrlResponse, CalibrationCreate, CalibrationRespons
 from app.dependencies import get_page
 from app.storage import storage_client
 from app.config import settings
+from processor.encoding import content_type_for
 from datetime import datetime, timedelta
 import math
 
@@ -38,7 +39,7 @@ def get_page_image(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Image file not found in storage"
             )
-        return Response(content=image_data, media_type="image/png")
+        return Response(content=image_data, media_type=content_type_for(page.storage_key_page_png, "image/png"))
     else:
         # Signed URL mode
         signed_url = storage_client.get_signed_url(
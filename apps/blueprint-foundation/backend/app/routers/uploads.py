@@ -1,16 +1,16 @@
 """Uploads API router."""
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.orm import Session
 from app.database import get_db
 from app.models import Upload, UploadStatus
-from app.schemas import UploadResponse, UploadWithPages, SelectPagesRequest
+from app.schemas import UploadCreateResponse, UploadResponse, UploadWithPages, SelectPagesRequest
 from app.dependencies import get_project, get_upload
-from app.storage import storage_client
 from app.config import settings
-from app.queue import enqueue_task
+from app.queue import enqueue_upload_task
+from app.services.upload_stream import UploadRejected, receive_file
 import re
 import os
-from uuid import UUID
+from uuid import UUID, uuid4
 
 router = APIRouter(prefix="/projects/{project_id}/uploads", tags=["uploads"])
 
@@ -35,76 +35,62 @@ def sanitize_filename(filename: str) -> str:
     return filename
 
 
-@router.post("", response_model=UploadResponse, status_code=status.HTTP_201_CREATED)
+@router.post("", response_model=UploadCreateResponse, status_code=status.HTTP_201_CREATED)
 async def create_upload(
     project_id: str,
-    file: UploadFile = File(...),
+    request: Request,
     project = Depends(get_project),
     db: Session = Depends(get_db)
 ):
     """Upload a blueprint file.
 
+    The multipart body is streamed into object storage as it arrives rather
+    than read into memory; the file is expected in the "file" form field.
+
     Args:
         project_id: Project UUID
-        file: Uploaded file
+        request: Request with a multipart/form-data body
         project: Project instance
         db: Database session
 
     Returns:
-        Upload record with job status
+        Upload record with job status and the processing cost estimate
     """
-    # Validate file size
-    content = await file.read()
-    if len(content) > settings.max_upload_size:
-        raise HTTPException(
-            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-            detail=f"File size exceeds maximum of {settings.max_upload_size} bytes"
-        )
-
-    # Validate MIME type
-    mime_type = file.content_type or "application/octet-stream"
-    if mime_type not in settings.allowed_mime_types:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"File type {mime_type} not allowed. Allowed types: {', '.join(settings.allowed_mime_types)}"
+    upload_id = uuid4()
+    try:
+        received = await receive_file(
+            request,
+            "file",
+            settings.allowed_mime_types,
+            lambda filename: (
+                f"projects/{project.id}/uploads/{upload_id}/original/{sanitize_filename(filename or 'upload')}"
+            ),
         )
-
-    # Sanitize filename
-    safe_filename = sanitize_filename(file.filename or "upload")
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
 
     # Create upload record
     upload = Upload(
+        id=upload_id,
         project_id=project.id,
-        original_filename=safe_filename,
-        mime_type=mime_type,
-        size_bytes=len(content),
-        storage_key_original="",  # Will be set below
+        original_filename=sanitize_filename(received.filename or "upload"),
+        mime_type=received.mime_type,
+        size_bytes=received.size_bytes,
+        storage_key_original=received.storage_key,
+        content_sha256=received.content_sha256,
         status=UploadStatus.UPLOADED,
     )
     db.add(upload)
-    db.flush()  # Get upload ID
-
-    # Generate storage key
-    storage_key = f"projects/{project.id}/uploads/{upload.id}/original/{safe_filename}"
-    upload.storage_key_original = storage_key
-
-    # Upload to object storage
-    success = storage_client.upload_file(storage_key, content, mime_type)
-    if not success:
-        db.rollback()
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Failed to upload file to storage"
-        )
-
     db.commit()
     db.refresh(upload)
 
-    # Enqueue background processing job
+    # Enqueue background processing job on the lane for its estimated cost
     from worker.tasks import process_upload
-    enqueue_task(process_upload, str(upload.id))
+    _, cost = enqueue_upload_task(
+        process_upload, str(upload.id), upload.mime_type, upload.size_bytes, upload.storage_key_original
+    )
 
-    return upload
+    return UploadCreateResponse(**UploadResponse.model_validate(upload).model_dump(), cost=cost)
 
 
 @router.get("", response_model=list[UploadResponse])
@@ -39,6 +39,7 @@ class UploadResponse(BaseModel):
     mime_type: str
     size_bytes: int
     storage_key_original: str
+    content_sha256: Optional[str] = None
     status: UploadStatus
     error_message: Optional[str]
     warnings: Optional[List[str]]
@@ -49,6 +50,21 @@ class UploadResponse(BaseModel):
         from_attributes = True
 
 
+class CostEstimateResponse(BaseModel):
+    """Processing cost estimate schema (see app/queue.py)."""
+    lane: str
+    queue: str
+    estimated_seconds: float
+    pages: int
+    megapixels: float
+    probed: bool
+
+
+class UploadCreateResponse(UploadResponse):
+    """Upload creation response with the estimate its job was routed by."""
+    cost: CostEstimateResponse
+
+
 class UploadWithPages(UploadResponse):
     """Upload with pages response."""
     pages: List["PageResponse"]
@@ -72,6 +88,7 @@ class PageResponse(BaseModel):
     storage_key_page_thumb: Optional[str]
     status: PageStatus
     warnings: Optional[List[str]]
+    metrics: Optional[dict] = None
     created_at: datetime
 
     class Config:
@@ -0,0 +1,252 @@
+"""Streaming ingestion of multipart upload bodies into object storage."""
+import asyncio
+import hashlib
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import Request, status
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+from app.config import settings
+from app.storage import storage_client
+
+# Room for boundaries, part headers and small form fields in a declared Content-Length
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+# Body chunks buffered between the request and the storage thread
+QUEUED_CHUNKS = 8
+
+
+class UploadRejected(Exception):
+    """Raised when an upload body is refused before or while it is streamed."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+@dataclass
+class ReceivedFile:
+    """A file part that has been written to storage."""
+    storage_key: str
+    filename: str
+    mime_type: str
+    size_bytes: int
+    content_sha256: str
+
+
+class ChunkReader:
+    """File-like object fed with chunks from the request, read by a storage thread.
+
+    The queue is bounded, so the request is only read as fast as storage
+    accepts the data and at most a few chunks are held in memory.
+    """
+
+    def __init__(self, max_chunks: int = QUEUED_CHUNKS):
+        self._queue: "queue.Queue[Optional[bytes]]" = queue.Queue(maxsize=max_chunks)
+        self._buffer = bytearray()
+        self._eof = False
+        self._aborted = False
+        self._consumer_done = threading.Event()
+
+    def feed(self, chunk: Optional[bytes]) -> None:
+        """Queue a chunk (None marks the end), blocking while the queue is full.
+
+        Args:
+            chunk: Data to hand to the reader, or None for end of stream
+        """
+        while not self._consumer_done.is_set():
+            try:
+                self._queue.put(chunk, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def abort(self) -> None:
+        """Make the next read fail so the storage upload is abandoned."""
+        self._aborted = True
+        self.feed(None)
+
+    def consumer_done(self) -> None:
+        """Signal that the storage thread stopped reading."""
+        self._consumer_done.set()
+
+    def read(self, size: int = -1) -> bytes:
+        """Read up to size bytes, blocking until they arrive or the stream ends.
+
+        Args:
+            size: Maximum number of bytes, or -1 for everything
+
+        Returns:
+            Bytes read; empty at end of stream
+
+        Raises:
+            IOError: If the upload was aborted
+        """
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            chunk = self._queue.get()
+            if chunk is None:
+                self._eof = True
+            else:
+                self._buffer += chunk
+        if self._aborted:
+            raise IOError("Upload aborted")
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+def _parse_events(boundary: bytes) -> Tuple[MultipartParser, List[Tuple[str, object]]]:
+    """Create a multipart parser whose callbacks record events in a list.
+
+    Args:
+        boundary: Multipart boundary from the Content-Type header
+
+    Returns:
+        Parser and the list it appends ("headers" | "data" | "end", payload) events to
+    """
+    events: List[Tuple[str, object]] = []
+    headers: Dict[bytes, bytes] = {}
+    field = bytearray()
+    value = bytearray()
+
+    def on_part_begin():
+        headers.clear()
+
+    def on_header_field(data: bytes, start: int, end: int):
+        field.extend(data[start:end])
+
+    def on_header_value(data: bytes, start: int, end: int):
+        value.extend(data[start:end])
+
+    def on_header_end():
+        headers[bytes(field).lower()] = bytes(value)
+        field.clear()
+        value.clear()
+
+    def on_headers_finished():
+        events.append(("headers", dict(headers)))
+
+    def on_part_data(data: bytes, start: int, end: int):
+        events.append(("data", data[start:end]))
+
+    def on_part_end():
+        events.append(("end", None))
+
+    callbacks = {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    }
+    return MultipartParser(boundary, callbacks), events
+
+
+def _store(storage_key: str, reader: ChunkReader, mime_type: str) -> bool:
+    """Upload from the reader and release the feeding side when done."""
+    try:
+        return storage_client.upload_stream(storage_key, reader, mime_type, settings.upload_part_size)
+    finally:
+        reader.consumer_done()
+
+
+async def receive_file(
+    request: Request,
+    field_name: str,
+    allowed_mime_types: Iterable[str],
+    key_for: Callable[[str], str],
+) -> ReceivedFile:
+    """Stream the file part of a multipart request into object storage.
+
+    The body is parsed as it arrives; the file part is hashed and handed to a
+    multipart storage upload in the same pass. The request is rejected before
+    anything is stored when the declared Content-Length or the part's MIME
+    type is not acceptable, and the storage upload is aborted as soon as the
+    file grows past max_upload_size.
+
+    Args:
+        request: Incoming request with a multipart/form-data body
+        field_name: Form field holding the file
+        allowed_mime_types: Accepted MIME types for the file part
+        key_for: Builds the storage key from the client's filename
+
+    Returns:
+        The stored file with its size and SHA-256
+
+    Raises:
+        UploadRejected: If the body is malformed, too large or of a disallowed type
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadRejected(status.HTTP_400_BAD_REQUEST, "Expected a multipart/form-data body")
+    too_large = UploadRejected(
+        status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        f"File size exceeds maximum of {settings.max_upload_size} bytes",
+    )
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > settings.max_upload_size + MULTIPART_OVERHEAD_BYTES:
+        raise too_large
+
+    allowed = set(allowed_mime_types)
+    parser, events = _parse_events(params[b"boundary"])
+    digest = hashlib.sha256()
+    reader: Optional[ChunkReader] = None
+    store_task: Optional[asyncio.Future] = None
+    received: Optional[ReceivedFile] = None
+    in_file = False
+    try:
+        async for chunk in request.stream():
+            try:
+                parser.write(chunk)
+            except MultipartParseError:
+                raise UploadRejected(status.HTTP_400_BAD_REQUEST, "Malformed multipart body")
+            for kind, payload in events:
+                if kind == "headers":
+                    _, options = parse_options_header(payload.get(b"content-disposition", b""))
+                    name = options.get(b"name", b"").decode("latin-1")
+                    in_file = received is None and name == field_name and b"filename" in options
+                    if not in_file:
+                        continue
+                    filename = options[b"filename"].decode("utf-8", "replace")
+                    mime_type = payload.get(b"content-type", b"application/octet-stream").decode("latin-1")
+                    mime_type = mime_type.split(";")[0].strip()
+                    if mime_type not in allowed:
+                        raise UploadRejected(
+                            status.HTTP_400_BAD_REQUEST,
+                            f"File type {mime_type} not allowed. Allowed types: {', '.join(allowed_mime_types)}",
+                        )
+                    storage_key = key_for(filename)
+                    received = ReceivedFile(storage_key, filename, mime_type, 0, "")
+                    reader = ChunkReader()
+                    store_task = asyncio.ensure_future(run_in_threadpool(_store, storage_key, reader, mime_type))
+                elif kind == "data" and in_file:
+                    received.size_bytes += len(payload)
+                    if received.size_bytes > settings.max_upload_size:
+                        raise too_large
+                    digest.update(payload)
+                    await run_in_threadpool(reader.feed, payload)
+                elif kind == "end":
+                    in_file = False
+            events.clear()
+        if received is None:
+            raise UploadRejected(status.HTTP_400_BAD_REQUEST, f"Missing file field '{field_name}'")
+        await run_in_threadpool(reader.feed, None)
+        stored = await store_task
+    except Exception:
+        if store_task is not None:
+            await run_in_threadpool(reader.abort)
+            await asyncio.gather(store_task, return_exceptions=True)
+        raise
+    if not stored:
+        raise UploadRejected(status.HTTP_500_INTERNAL_SERVER_ERROR, "Failed to upload file to storage")
+    received.content_sha256 = digest.hexdigest()
+    return received
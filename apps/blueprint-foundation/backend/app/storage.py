@@ -3,7 +3,7 @@ from minio import Minio
 from minio.error import S3Error
 from app.config import settings
 import io
-from typing import Optional
+from typing import BinaryIO, Optional
 from datetime import timedelta
 
 
@@ -54,6 +54,36 @@ class StorageClient:
             print(f"Error uploading file {object_name}: {e}")
             return False
 
+    def upload_stream(self, object_name: str, stream: BinaryIO, content_type: str, part_size: int) -> bool:
+        """Upload a stream of unknown length to storage.
+
+        The stream is read and sent as a multipart upload one part at a time,
+        so memory use is bounded by part_size. Objects smaller than one part
+        are sent in a single request.
+
+        Args:
+            object_name: Object key/path
+            stream: File-like object to read from
+            content_type: MIME type
+            part_size: Multipart part size in bytes (at least 5 MiB)
+
+        Returns:
+            Success status
+        """
+        try:
+            self.client.put_object(
+                self.bucket,
+                object_name,
+                stream,
+                length=-1,
+                part_size=part_size,
+                content_type=content_type,
+            )
+            return True
+        except S3Error as e:
+            print(f"Error uploading stream {object_name}: {e}")
+            return False
+
     def download_file(self, object_name: str) -> Optional[bytes]:
         """Download file from storage.
 
@@ -73,6 +103,30 @@ class StorageClient:
             print(f"Error downloading file {object_name}: {e}")
             return None
 
+    def read_range(self, object_name: str, offset: int, length: int) -> Optional[bytes]:
+        """Read part of an object from storage.
+
+        Args:
+            object_name: Object key/path
+            offset: First byte to read; negative counts from the end of the object
+            length: Number of bytes to read
+
+        Returns:
+            The bytes read (fewer at the end of the object) or None if error
+        """
+        try:
+            if offset < 0:
+                size = self.client.stat_object(self.bucket, object_name).size
+                offset = max(0, size + offset)
+            response = self.client.get_object(self.bucket, object_name, offset=offset, length=length)
+            data = response.read()
+            response.close()
+            response.release_conn()
+            return data
+        except S3Error as e:
+            print(f"Error reading range of {object_name}: {e}")
+            return None
+
     def get_signed_url(self, object_name: str, expires: int = 3600) -> Optional[str]:
         """Get presigned URL for object.
 
@@ -0,0 +1,117 @@
+"""Page output encoding profiles."""
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict
+import cv2
+import numpy as np
+from PIL import Image
+
+
+# WebP cannot encode images with a side longer than this; such pages fall back to PNG
+WEBP_MAX_SIDE = 16383
+
+CONTENT_TYPES = {
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".jpg": "image/jpeg",
+}
+
+
+@dataclass(frozen=True)
+class OutputProfile:
+    """Speed-vs-size settings for encoding a processed page."""
+    name: str
+    codec: str  # png | png_palette | png_bilevel | webp_lossless
+    png_compression: int = 6
+    palette_colors: int = 16
+
+
+OUTPUT_PROFILES: Dict[str, OutputProfile] = {
+    "fast": OutputProfile("fast", "png", png_compression=1),
+    "balanced": OutputProfile("balanced", "png", png_compression=6),
+    "small": OutputProfile("small", "png", png_compression=9),
+    "palette": OutputProfile("palette", "png_palette", png_compression=9, palette_colors=16),
+    "bilevel": OutputProfile("bilevel", "png_bilevel", png_compression=9),
+    "webp_lossless": OutputProfile("webp_lossless", "webp_lossless"),
+}
+
+
+def get_profile(name: str) -> OutputProfile:
+    """Look up an output profile by name.
+
+    Args:
+        name: Profile name (key of OUTPUT_PROFILES)
+
+    Returns:
+        Output profile
+
+    Raises:
+        ValueError: If the profile is unknown
+    """
+    if name not in OUTPUT_PROFILES:
+        raise ValueError(f"Unknown output profile {name!r}; expected one of {sorted(OUTPUT_PROFILES)}")
+    return OUTPUT_PROFILES[name]
+
+
+def content_type_for(path: str, default: str = "application/octet-stream") -> str:
+    """Get the MIME type for a page file or storage key from its extension.
+
+    Args:
+        path: File path or object key
+        default: Fallback MIME type
+
+    Returns:
+        MIME type
+    """
+    return CONTENT_TYPES.get(os.path.splitext(path)[1].lower(), default)
+
+
+def encode_page(img: np.ndarray, path_stem: str, profile: OutputProfile) -> Dict:
+    """Encode a processed page according to an output profile.
+
+    Args:
+        img: BGR or grayscale image
+        path_stem: Output path without extension
+        profile: Output profile
+
+    Returns:
+        Dict with path, content_type, codec, size_bytes and encode_ms
+    """
+    codec = profile.codec
+    if codec == "webp_lossless" and max(img.shape[:2]) > WEBP_MAX_SIDE:
+        codec = "png"
+
+    extension = ".webp" if codec == "webp_lossless" else ".png"
+    path = path_stem + extension
+    started = time.perf_counter()
+
+    if codec == "png_palette":
+        # FASTOCTREE is only implemented for RGB input; MEDIANCUT handles grayscale
+        rgb = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        method = Image.Quantize.FASTOCTREE if img.ndim == 3 else Image.Quantize.MEDIANCUT
+        colors = max(2, min(256, profile.palette_colors))
+        bits = next(b for b in (1, 2, 4, 8) if colors <= 2 ** b)
+        quantized = Image.fromarray(rgb).quantize(colors=colors, method=method)
+        quantized.save(path, format="PNG", compress_level=profile.png_compression, bits=bits)
+    elif codec == "png_bilevel":
+        gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
+        height, width = binary.shape
+        packed = np.packbits(binary > 0, axis=1)
+        Image.frombytes("1", (width, height), packed.tobytes()).save(
+            path, format="PNG", compress_level=profile.png_compression
+        )
+    elif codec == "webp_lossless":
+        # Quality above 100 selects lossless mode in OpenCV's WebP encoder
+        cv2.imwrite(path, img, [cv2.IMWRITE_WEBP_QUALITY, 101])
+    else:
+        cv2.imwrite(path, img, [cv2.IMWRITE_PNG_COMPRESSION, profile.png_compression])
+
+    return {
+        "path": path,
+        "content_type": CONTENT_TYPES[extension],
+        "codec": codec,
+        "size_bytes": os.path.getsize(path),
+        "encode_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
@@ -1,25 +1,42 @@
 """Image processing module using OpenCV."""
 import cv2
 import numpy as np
-from typing import Tuple, Dict, List, Optional
+from typing import Dict, List, Optional
 import tempfile
+import math
 import os
+from processor.encoding import encode_page, get_profile
+from processor.quality import analyze_page
 
 
 class ImageProcessor:
     """Image processor for blueprint normalization."""
 
-    def __init__(self, target_dpi: int = 300, blur_threshold: float = 100.0, low_res_threshold: int = 1800):
+    # Monochrome detection: sample budget, per-pixel channel spread still
+    # considered gray, and share of colored samples tolerated.
+    MONO_SAMPLE_PIXELS = 2_000_000
+    MONO_CHANNEL_TOLERANCE = 24
+    MONO_COLOR_FRACTION = 0.001
+
+    def __init__(
+        self,
+        target_dpi: int = 300,
+        blur_threshold: float = 100.0,
+        low_res_threshold: int = 1800,
+        output_profile: str = "balanced",
+    ):
         """Initialize processor.
 
         Args:
             target_dpi: Target DPI for output
             blur_threshold: Laplacian variance threshold for blur detection
             low_res_threshold: Minimum pixel dimension threshold
+            output_profile: Page encoding profile (see processor.encoding.OUTPUT_PROFILES)
         """
         self.target_dpi = target_dpi
         self.blur_threshold = blur_threshold
         self.low_res_threshold = low_res_threshold
+        self.output_profile = get_profile(output_profile)
 
     def process_image(self, image_data: bytes, output_dir: str, page_number: int = 1) -> Dict:
         """Process a single image.
@@ -51,17 +68,23 @@ class ImageProcessor:
         if min_dimension < self.low_res_threshold:
             warnings.append(f"Low resolution: {width}x{height}px (shortest side < {self.low_res_threshold}px)")
 
-        # 2. Detect blur
+        # Compute grayscale once; monochrome sheets drop the color planes and
+        # run the rest of the pipeline single channel
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        blur_score = self._calculate_blur_score(gray)
+        if self._is_monochrome(img):
+            img = gray
+
+        # 2. Measure quality (blur, contrast, ink coverage, noise, effective resolution)
+        dpi_estimated = self._estimate_dpi(width, height)
+        quality = analyze_page(gray, dpi_estimated)
+        blur_score = quality["blur_score"]
         if blur_score < self.blur_threshold:
             warnings.append(f"Image may be blurry (score: {blur_score:.1f})")
 
-        # 3. Deskew
-        deskewed, angle = self._deskew_image(gray, img)
-
-        # 4. Auto-rotate to nearest 90-degree angle
-        rotated = self._auto_rotate(deskewed)
+        # 3-4. Deskew and auto-rotate to nearest 90-degree angle in one resample
+        angle = self._detect_skew_angle(gray)
+        del gray
+        rotated = self._orient_image(img, angle)
 
         # 5. Apply CLAHE contrast enhancement
         enhanced = self._apply_clahe(rotated)
@@ -70,21 +93,15 @@ class ImageProcessor:
         thumbnail = self._generate_thumbnail(enhanced, max_size=400)
 
         # Save processed files
-        page_filename = f"page_{page_number:02d}.png"
-        thumb_filename = f"page_{page_number:02d}.jpg"
-
-        page_path = os.path.join(output_dir, page_filename)
-        thumb_path = os.path.join(output_dir, thumb_filename)
+        page_stem = os.path.join(output_dir, f"page_{page_number:02d}")
+        thumb_path = os.path.join(output_dir, f"page_{page_number:02d}.jpg")
 
-        cv2.imwrite(page_path, enhanced, [cv2.IMWRITE_PNG_COMPRESSION, 6])
+        encoded = encode_page(enhanced, page_stem, self.output_profile)
         cv2.imwrite(thumb_path, thumbnail, [cv2.IMWRITE_JPEG_QUALITY, 85])
 
         # Get final dimensions
         final_height, final_width = enhanced.shape[:2]
 
-        # Estimate DPI (rough approximation)
-        dpi_estimated = self._estimate_dpi(final_width, final_height)
-
         return {
             "success": True,
             "page_number": page_number,
@@ -92,32 +109,43 @@ class ImageProcessor:
             "height_px": final_height,
             "dpi_estimated": dpi_estimated,
             "warnings": warnings,
-            "page_path": page_path,
+            "page_path": encoded["path"],
+            "page_content_type": encoded["content_type"],
             "thumb_path": thumb_path,
             "rotation_applied": angle,
+            "metrics": {
+                "encoding": {
+                    "codec": encoded["codec"],
+                    "size_bytes": encoded["size_bytes"],
+                    "encode_ms": encoded["encode_ms"],
+                },
+                "quality": quality,
+            },
         }
 
-    def _calculate_blur_score(self, gray: np.ndarray) -> float:
-        """Calculate blur score using Laplacian variance.
+    def _is_monochrome(self, img: np.ndarray) -> bool:
+        """Check whether a BGR image is effectively grayscale.
 
         Args:
-            gray: Grayscale image
+            img: BGR image
 
         Returns:
-            Blur score (higher = sharper)
+            True if fewer than MONO_COLOR_FRACTION of sampled pixels carry color
         """
-        laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-        return laplacian.var()
+        height, width = img.shape[:2]
+        step = max(1, math.ceil(math.sqrt(height * width / self.MONO_SAMPLE_PIXELS)))
+        sample = img[::step, ::step]
+        spread = sample.max(axis=2) - sample.min(axis=2)
+        return np.count_nonzero(spread > self.MONO_CHANNEL_TOLERANCE) <= spread.size * self.MONO_COLOR_FRACTION
 
-    def _deskew_image(self, gray: np.ndarray, color: np.ndarray) -> Tuple[np.ndarray, float]:
-        """Deskew image using Hough line detection.
+    def _detect_skew_angle(self, gray: np.ndarray) -> float:
+        """Detect skew angle using Hough line detection.
 
         Args:
             gray: Grayscale image
-            color: Color image
 
         Returns:
-            Deskewed image and rotation angle
+            Rotation angle in degrees (0.0 if insignificant)
         """
         # Detect edges
         edges = cv2.Canny(gray, 50, 150, apertureSize=3)
@@ -126,7 +154,7 @@ class ImageProcessor:
         lines = cv2.HoughLines(edges, 1, np.pi / 180, 200)
 
         if lines is None or len(lines) == 0:
-            return color, 0.0
+            return 0.0
 
         # Calculate dominant angle
         angles = []
@@ -140,54 +168,78 @@ class ImageProcessor:
             angles.append(angle)
 
         # Get median angle
-        median_angle = np.median(angles)
+        median_angle = float(np.median(angles))
 
         # Only rotate if angle is significant (> 0.5 degrees)
         if abs(median_angle) < 0.5:
-            return color, 0.0
+            return 0.0
+
+        return median_angle
+
+    def _needs_quarter_turn(self, width: int, height: int) -> bool:
+        """Check whether the page should be turned 90 degrees based on aspect ratio.
+
+        Args:
+            width: Image width
+            height: Image height
 
-        # Rotate image
-        height, width = color.shape[:2]
-        center = (width // 2, height // 2)
-        matrix = cv2.getRotationMatrix2D(center, median_angle, 1.0)
-        rotated = cv2.warpAffine(color, matrix, (width, height), flags=cv2.INTER_LINEAR, borderValue=(255, 255, 255))
+        Returns:
+            True if the image should be rotated clockwise
+        """
+        # If height > width significantly, might need rotation
+        # This is a simple heuristic; real blueprints are typically landscape
+        return height > width * 1.2
 
-        return rotated, median_angle
+    def _orient_image(self, img: np.ndarray, angle: float) -> np.ndarray:
+        """Deskew and auto-rotate an image with a single affine resample.
 
-    def _auto_rotate(self, img: np.ndarray) -> np.ndarray:
-        """Auto-rotate image to nearest 90-degree angle based on aspect ratio.
+        The skew correction and the 90-degree turn are composed into one
+        matrix, so the page is interpolated and reallocated at most once.
 
         Args:
             img: Input image
+            angle: Skew angle from _detect_skew_angle
 
         Returns:
-            Rotated image
+            Oriented image
         """
         height, width = img.shape[:2]
+        quarter_turn = self._needs_quarter_turn(width, height)
 
-        # If height > width significantly, might need rotation
-        # This is a simple heuristic; real blueprints are typically landscape
-        if height > width * 1.2:
-            # Try rotating 90 degrees
-            img = cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+        if angle == 0.0:
+            return cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE) if quarter_turn else img
 
-        return img
+        skew = np.vstack([cv2.getRotationMatrix2D((width // 2, height // 2), angle, 1.0), [0, 0, 1]])
+        size = (width, height)
+        if quarter_turn:
+            # Same mapping as cv2.ROTATE_90_CLOCKWISE: (x, y) -> (h - 1 - y, x)
+            turn = np.array([[0, -1, height - 1], [1, 0, 0], [0, 0, 1]], dtype=np.float64)
+            skew = turn @ skew
+            size = (height, width)
+
+        border = (255,) * img.shape[2] if img.ndim == 3 else 255
+        return cv2.warpAffine(img, skew[:2], size, flags=cv2.INTER_LINEAR, borderValue=border)
 
     def _apply_clahe(self, img: np.ndarray) -> np.ndarray:
         """Apply CLAHE (Contrast Limited Adaptive Histogram Equalization).
 
         Args:
-            img: Input image
+            img: Input image (BGR or single-channel grayscale)
 
         Returns:
             Enhanced image
         """
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+
+        # Grayscale: equalize directly, no LAB round trip
+        if img.ndim == 2:
+            return clahe.apply(img)
+
         # Convert to LAB color space
         lab = cv2.cvtColor(img, cv2.COLOR_BGR2LAB)
         l, a, b = cv2.split(lab)
 
         # Apply CLAHE to L channel
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
         l_enhanced = clahe.apply(l)
 
         # Merge channels
@@ -10,6 +10,7 @@ from app.config import settings
 from processor.image_processor import ImageProcessor
 from processor.pdf_processor import PDFProcessor
 from uuid import UUID
+import json
 import tempfile
 import shutil
 
@@ -71,7 +72,6 @@ def process_upload(upload_id: str):
                     for p in upload.progress:
                         if "Pages selected:" in p:
                             # Parse "[1, 2, 3]" from string
-                            import json
                             try:
                                 page_str = p.split("Pages selected:")[1].strip()
                                 selected_pages = json.loads(page_str)
@@ -102,6 +102,7 @@ def process_upload(upload_id: str):
                 target_dpi=settings.image_target_dpi,
                 blur_threshold=settings.blur_threshold,
                 low_res_threshold=settings.low_res_threshold,
+                output_profile=settings.page_output_profile,
             )
 
             processed_pages = []
@@ -141,11 +142,12 @@ def process_upload(upload_id: str):
                     thumb_data = f.read()
 
                 # Generate storage keys
-                page_key = f"projects/{upload.project_id}/uploads/{upload.id}/pages/page_{page_num:02d}.png"
+                page_ext = os.path.splitext(page_result["page_path"])[1]
+                page_key = f"projects/{upload.project_id}/uploads/{upload.id}/pages/page_{page_num:02d}{page_ext}"
                 thumb_key = f"projects/{upload.project_id}/uploads/{upload.id}/thumbs/page_{page_num:02d}.jpg"
 
                 # Upload to storage
-                storage_client.upload_file(page_key, page_data, "image/png")
+                storage_client.upload_file(page_key, page_data, page_result["page_content_type"])
                 storage_client.upload_file(thumb_key, thumb_data, "image/jpeg")
 
                 # Store for database insertion
@@ -167,6 +169,7 @@ def process_upload(upload_id: str):
                     storage_key_page_thumb=page_result["storage_key_page_thumb"],
                     status=PageStatus.READY,
                     warnings=page_result["warnings"] if page_result["warnings"] else None,
+                    metrics=page_result["metrics"],
                 )
                 db.add(page)
 
@@ -5,11 +5,183 @@ import os
 # Add parent directory to path
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from rq import Worker
-from app.queue import redis_conn
+import importlib
+import multiprocessing
+import resource
+import signal
+import time
+
+from redis import Redis
+from rq import SimpleWorker, Worker
+from rq.job import Job
+from rq.worker import StopRequested
+
+from app.config import settings
+from app.queue import LANES, redis_conn
+
+# Lanes from small to large, unless this worker is dedicated to some of them
+QUEUES = settings.worker_queues or [name for _, name in LANES]
+
+# Imported once per worker process instead of once per job
+PRELOAD_MODULES = [
+    "numpy",
+    "cv2",
+    "PIL.Image",
+    "pdf2image",
+    "sqlalchemy.orm",
+    "app.database",
+    "app.storage",
+    "worker.tasks",
+]
+
+
+def preload() -> float:
+    """Import the processing stack so jobs find it already loaded.
+
+    Returns:
+        Time spent importing, in milliseconds
+    """
+    started = time.perf_counter()
+    for name in PRELOAD_MODULES:
+        importlib.import_module(name)
+    return (time.perf_counter() - started) * 1000
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process.
+
+    Returns:
+        RSS in bytes (peak RSS where /proc is not available)
+    """
+    try:
+        with open("/proc/self/statm") as handle:
+            return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class TimedJob(Job):
+    """Job that records how long its function ran in job.meta["run_ms"]."""
+
+    def _execute(self):
+        started = time.perf_counter()
+        try:
+            return super()._execute()
+        finally:
+            self.meta["run_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            self.save_meta()
+
+
+class SetupTimingMixin:
+    """Record per-job setup overhead in job.meta["setup_ms"].
+
+    Setup overhead is the time spent around the job function: forking,
+    imports, deserialization and bookkeeping.
+    """
+
+    def execute_job(self, job, queue):
+        started = time.perf_counter()
+        super().execute_job(job, queue)
+        total_ms = (time.perf_counter() - started) * 1000
+        run_ms = job.get_meta(refresh=True).get("run_ms")
+        if run_ms is not None:
+            job.meta["setup_ms"] = round(total_ms - run_ms, 1)
+            job.save_meta()
+            print(f"Job {job.id}: {total_ms:.1f} ms total, {job.meta['setup_ms']:.1f} ms setup")
+
+
+class TimedWorker(SetupTimingMixin, Worker):
+    """Forking worker that reports setup overhead."""
+
+
+class PreloadedWorker(SetupTimingMixin, SimpleWorker):
+    """Worker that runs jobs in its own, preloaded process.
+
+    It stops once its RSS grows past max_rss_bytes so the pool can replace it.
+    """
+
+    max_rss_bytes = 0
+
+    def execute_job(self, job, queue):
+        super().execute_job(job, queue)
+        rss = rss_bytes()
+        if self.max_rss_bytes and rss > self.max_rss_bytes:
+            print(f"Worker {self.name}: RSS {rss // (1024 * 1024)} MiB over ceiling, recycling")
+            raise StopRequested()
+
+
+def run_child(max_jobs: int, max_rss_bytes: int) -> None:
+    """Run a PreloadedWorker until it has handled max_jobs jobs or is too large.
+
+    Args:
+        max_jobs: Jobs before the child exits (0 = no limit)
+        max_rss_bytes: RSS ceiling in bytes (0 = no limit)
+    """
+    from app.database import engine
+
+    # Connections must not be shared with the parent across fork()
+    engine.dispose(close=False)
+    connection = Redis.from_url(settings.redis_url)
+    worker = PreloadedWorker(QUEUES, connection=connection, job_class=TimedJob)
+    worker.max_rss_bytes = max_rss_bytes
+    worker.work(max_jobs=max_jobs or None)
+
+
+def run_pool(processes: int, max_jobs: int, max_rss_bytes: int) -> None:
+    """Keep a number of preloaded worker children running.
+
+    Modules are imported here before forking, so every child starts with them
+    loaded. A child that exits is replaced until SIGTERM or SIGINT, which are
+    forwarded to the children.
+
+    Args:
+        processes: Number of children
+        max_jobs: Jobs before a child is replaced (0 = never)
+        max_rss_bytes: RSS after which a child is replaced (0 = no limit)
+    """
+    print(f"Preloaded worker modules in {preload():.0f} ms")
+    context = multiprocessing.get_context("fork")
+    children = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for child in children.values():
+            if child.is_alive():
+                os.kill(child.pid, signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while True:
+        for slot in range(processes):
+            child = children.get(slot)
+            if child is not None and child.is_alive():
+                continue
+            if child is not None:
+                child.join()
+            if stopping:
+                children.pop(slot, None)
+                continue
+            child = context.Process(target=run_child, args=(max_jobs, max_rss_bytes), name=f"rq-preloaded-{slot}")
+            child.start()
+            children[slot] = child
+        if stopping and not children:
+            return
+        time.sleep(0.5)
+
 
 if __name__ == '__main__':
-    # Start worker
-    worker = Worker(['blueprints'], connection=redis_conn)
-    print("Starting RQ worker for queue: blueprints")
-    worker.work()
+    if settings.worker_mode == "preloaded":
+        print(f"Starting {settings.worker_processes} preloaded RQ worker(s) for queues: {', '.join(QUEUES)}")
+        run_pool(
+            max(1, settings.worker_processes),
+            settings.worker_max_jobs,
+            settings.worker_max_rss_mb * 1024 * 1024,
+        )
+    else:
+        # Import the processing stack once so each work horse inherits it
+        preload()
+        worker = TimedWorker(QUEUES, connection=redis_conn, job_class=TimedJob)
+        print(f"Starting RQ worker for queues: {', '.join(QUEUES)}")
+        worker.work()
@@ -1,3 +1,4 @@
+from typing import List, Optional
 from pydantic_settings import BaseSettings
 from pydantic import AnyUrl, Field
 
@@ -15,11 +16,94 @@ class Settings(BaseSettings):
     s3_bucket: str = Field(..., alias="S3_BUCKET")
     s3_region: str = Field("us-east-1", alias="S3_REGION")
     s3_secure: bool = Field(False, alias="S3_SECURE")
+    s3_public_endpoint: Optional[str] = Field(None, alias="S3_PUBLIC_ENDPOINT")
+    s3_transfer_threads: int = Field(16, alias="S3_TRANSFER_THREADS")
+    s3_max_concurrency: int = Field(4, alias="S3_MAX_CONCURRENCY")
+    s3_multipart_threshold_mb: int = Field(16, alias="S3_MULTIPART_THRESHOLD_MB")
+    s3_multipart_chunk_mb: int = Field(8, alias="S3_MULTIPART_CHUNK_MB")
 
     upload_max_bytes: int = Field(200 * 1024 * 1024, alias="UPLOAD_MAX_BYTES")
+    upload_part_size_mb: int = Field(8, alias="UPLOAD_PART_SIZE_MB")
+    upload_presign_expiry_seconds: int = Field(3600, alias="UPLOAD_PRESIGN_EXPIRY_SECONDS")
+    upload_presign_multipart_mb: int = Field(64, alias="UPLOAD_PRESIGN_MULTIPART_MB")
+    upload_session_ttl_seconds: int = Field(24 * 3600, alias="UPLOAD_SESSION_TTL_SECONDS")
+    # Renewed with every stored part, so a dropped PATCH blocks its resume
+    # for at most this long.
+    upload_session_lock_seconds: int = Field(60, alias="UPLOAD_SESSION_LOCK_SECONDS")
+    upload_session_gc_interval_seconds: int = Field(600, alias="UPLOAD_SESSION_GC_INTERVAL_SECONDS")
     upload_rate_limit: int = Field(10, alias="UPLOAD_RATE_LIMIT")
     upload_rate_window_seconds: int = Field(60, alias="UPLOAD_RATE_WINDOW_SECONDS")
 
+    progress_event_ttl_seconds: int = Field(24 * 3600, alias="PROGRESS_EVENT_TTL_SECONDS")
+    progress_keepalive_seconds: int = Field(15, alias="PROGRESS_KEEPALIVE_SECONDS")
+
+    # "fork": one work horse per job (RQ default); "preloaded": long-lived
+    # worker processes that keep the pipeline imported between jobs.
+    worker_mode: str = Field("fork", alias="WORKER_MODE")
+    worker_processes: int = Field(1, alias="WORKER_PROCESSES")
+    worker_max_jobs: int = Field(100, alias="WORKER_MAX_JOBS")
+    worker_max_rss_mb: int = Field(2048, alias="WORKER_MAX_RSS_MB")
+    # Queues a worker takes jobs from, highest priority first; empty means all
+    # lanes. Dedicated pools list only their lane, e.g. ["uploads_small"].
+    worker_queues: List[str] = Field([], alias="WORKER_QUEUES")
+
+    # Fair-share scheduling of processing jobs across projects (fairshare.py).
+    # Each RQ queue is kept fairshare_queue_depth jobs deep; a project has at
+    # most fairshare_project_max_running jobs queued or running (0 = no cap);
+    # waiting earns fairshare_aging_per_second seconds of credit per second.
+    fairshare_enabled: bool = Field(True, alias="FAIRSHARE_ENABLED")
+    fairshare_queue_depth: int = Field(2, alias="FAIRSHARE_QUEUE_DEPTH")
+    fairshare_project_max_running: int = Field(4, alias="FAIRSHARE_PROJECT_MAX_RUNNING")
+    fairshare_aging_per_second: float = Field(1.0, alias="FAIRSHARE_AGING_PER_SECOND")
+    fairshare_scan_projects: int = Field(100, alias="FAIRSHARE_SCAN_PROJECTS")
+    fairshare_poll_seconds: int = Field(5, alias="FAIRSHARE_POLL_SECONDS")
+
+    process_workers: int = Field(1, alias="PROCESS_WORKERS")
+    process_cv_threads: int = Field(0, alias="PROCESS_CV_THREADS")
+    page_output_profile: str = Field("fast", alias="PAGE_OUTPUT_PROFILE")
+    page_memory_limit_mb: int = Field(0, alias="PAGE_MEMORY_LIMIT_MB")
+    page_scratch_dir: Optional[str] = Field(None, alias="PAGE_SCRATCH_DIR")
+    page_scratch_memmap: bool = Field(True, alias="PAGE_SCRATCH_MEMMAP")
+    thumbnail_sizes: List[int] = Field([512, 256], alias="THUMBNAIL_SIZES")
+    # DeepZoom tile pyramid per page (0 = off). Every tile is one stored
+    # object: a 350 DPI E-size sheet (15400x11900) at 256 px writes about
+    # 3,900 of them, so enable it only where a deep-zoom viewer uses them.
+    page_tile_size: int = Field(0, alias="PAGE_TILE_SIZE")
+    page_tile_format: str = Field("jpg", alias="PAGE_TILE_FORMAT")
+    page_pipeline_depth: int = Field(2, alias="PAGE_PIPELINE_DEPTH")
+    # Runs with more pages to enhance than this are split into jobs of this
+    # many pages on the "pages" queue, spread over all workers (0 = off).
+    page_fanout_batch: int = Field(0, alias="PAGE_FANOUT_BATCH")
+    page_job_timeout_seconds: int = Field(600, alias="PAGE_JOB_TIMEOUT_SECONDS")
+    # Crash recovery (recovery.py): a run holds a per-upload lock that its
+    # heartbeat renews; once it lapses, the reaper queues the upload again and
+    # the new run resumes at its first unfinished page. A fanned-out run holds
+    # the lock for upload_fanout_lock_seconds while its page jobs wait.
+    upload_lock_ttl_seconds: int = Field(60, alias="UPLOAD_LOCK_TTL_SECONDS")
+    upload_fanout_lock_seconds: int = Field(3600, alias="UPLOAD_FANOUT_LOCK_SECONDS")
+    upload_lock_retry_seconds: int = Field(30, alias="UPLOAD_LOCK_RETRY_SECONDS")
+    upload_reaper_interval_seconds: int = Field(60, alias="UPLOAD_REAPER_INTERVAL_SECONDS")
+    upload_max_resumes: int = Field(3, alias="UPLOAD_MAX_RESUMES")
+    # Memory admission (memory.py): jobs on one node (NODE_NAME, default the
+    # hostname) only start pages whose estimated peak fits in the budget left
+    # (0 = no budget). Pages estimated above the isolation threshold run in a
+    # child process limited to PAGE_ISOLATION_LIMIT_MB of address space.
+    node_name: str = Field("", alias="NODE_NAME")
+    node_memory_budget_mb: int = Field(0, alias="NODE_MEMORY_BUDGET_MB")
+    memory_admission_wait_seconds: int = Field(300, alias="MEMORY_ADMISSION_WAIT_SECONDS")
+    memory_reservation_ttl_seconds: int = Field(3600, alias="MEMORY_RESERVATION_TTL_SECONDS")
+    page_isolation_threshold_mb: int = Field(4096, alias="PAGE_ISOLATION_THRESHOLD_MB")
+    page_isolation_limit_mb: int = Field(8192, alias="PAGE_ISOLATION_LIMIT_MB")
+    # Cost model for routing jobs to lanes (see routing.py); progress["cost"]
+    # shows estimated and actual seconds side by side for tuning.
+    cost_base_seconds: float = Field(1.0, alias="COST_BASE_SECONDS")
+    cost_seconds_per_mb: float = Field(0.02, alias="COST_SECONDS_PER_MB")
+    cost_seconds_per_megapixel: float = Field(0.15, alias="COST_SECONDS_PER_MEGAPIXEL")
+    lane_small_max_seconds: float = Field(10.0, alias="LANE_SMALL_MAX_SECONDS")
+    lane_large_min_seconds: float = Field(120.0, alias="LANE_LARGE_MIN_SECONDS")
+    page_reuse_enabled: bool = Field(True, alias="PAGE_REUSE_ENABLED")
+    page_reuse_max_distance: int = Field(0, alias="PAGE_REUSE_MAX_DISTANCE")
+
     class Config:
         env_file = ".env"
         extra = "ignore"
@@ -1,3 +1,4 @@
+import os
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, DeclarativeBase
 from .config import settings
@@ -11,6 +12,16 @@ engine = create_engine(settings.database_url, pool_pre_ping=True)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
 
+def _forget_pool_after_fork() -> None:
+    # Pooled connections must not be shared with the parent across fork()
+    # (RQ work horses, preloaded worker children): the child starts with an
+    # empty pool and leaves the parent's sockets open for the parent.
+    engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_forget_pool_after_fork)
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -0,0 +1,166 @@
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+import cv2
+import numpy as np
+from PIL import Image
+
+
+# WebP cannot encode images with a side longer than this; such pages fall back to PNG.
+WEBP_MAX_SIDE = 16383
+# A page is treated as monochrome when fewer than MONO_COLOR_FRACTION of the
+# sampled pixels have a channel spread above MONO_CHANNEL_TOLERANCE.
+MONO_SAMPLE_PIXELS = 2_000_000
+MONO_CHANNEL_TOLERANCE = 24
+MONO_COLOR_FRACTION = 0.001
+
+CONTENT_TYPES = {
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".jpg": "image/jpeg",
+}
+
+
+@dataclass(frozen=True)
+class OutputProfile:
+    name: str
+    # png | png_palette | png_bilevel | webp_lossless
+    codec: str
+    png_compression: int = 1
+    palette_colors: int = 16
+
+
+@dataclass
+class EncodedImage:
+    path: str
+    content_type: str
+    codec: str
+    size_bytes: int
+    encode_ms: float
+    # Set when the profile's codec did not suit the page: (codec, reason).
+    fallback: Optional[Tuple[str, str]] = None
+
+    def as_metrics(self) -> Dict:
+        metrics = {
+            "codec": self.codec,
+            "contentType": self.content_type,
+            "sizeBytes": self.size_bytes,
+            "encodeMs": round(self.encode_ms, 1),
+        }
+        if self.fallback:
+            metrics["fallbackFrom"], metrics["fallbackReason"] = self.fallback
+        return metrics
+
+
+OUTPUT_PROFILES: Dict[str, OutputProfile] = {
+    # "fast" matches the cv2.imwrite defaults the pipeline has always used.
+    "fast": OutputProfile("fast", "png", png_compression=1),
+    "balanced": OutputProfile("balanced", "png", png_compression=6),
+    "small": OutputProfile("small", "png", png_compression=9),
+    "palette": OutputProfile("palette", "png_palette", png_compression=9, palette_colors=16),
+    "bilevel": OutputProfile("bilevel", "png_bilevel", png_compression=9),
+    "webp_lossless": OutputProfile("webp_lossless", "webp_lossless"),
+}
+
+
+def get_profile(name: str) -> OutputProfile:
+    try:
+        return OUTPUT_PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown output profile {name!r}; expected one of {sorted(OUTPUT_PROFILES)}") from None
+
+
+def content_type_for(path: str, default: str = "application/octet-stream") -> str:
+    return CONTENT_TYPES.get(os.path.splitext(path)[1].lower(), default)
+
+
+def sample_is_monochrome(sample: np.ndarray) -> bool:
+    spread = sample.max(axis=2) - sample.min(axis=2)
+    return np.count_nonzero(spread > MONO_CHANNEL_TOLERANCE) <= spread.size * MONO_COLOR_FRACTION
+
+
+def _unsuitable(image: np.ndarray, profile: OutputProfile) -> Optional[str]:
+    # Why the profile's codec would lose content on this page, if it would.
+    # Bilevel keeps black and white only, so it takes monochrome pages; the
+    # palette also takes colour pages with no more colours than it holds.
+    # Judged on a strided copy of about MONO_SAMPLE_PIXELS.
+    if profile.codec == "webp_lossless" and max(image.shape[:2]) > WEBP_MAX_SIDE:
+        return "too_large"
+    if profile.codec not in ("png_palette", "png_bilevel") or image.ndim == 2:
+        return None
+    height, width = image.shape[:2]
+    step = max(1, math.ceil(math.sqrt(height * width / MONO_SAMPLE_PIXELS)))
+    sample = image[::step, ::step]
+    if sample_is_monochrome(sample):
+        return None
+    if profile.codec == "png_palette":
+        packed = sample[..., 0].astype(np.uint32) << 16 | sample[..., 1].astype(np.uint32) << 8 | sample[..., 2]
+        if len(np.unique(packed)) <= profile.palette_colors:
+            return None
+        return "too_many_colors"
+    return "color_page"
+
+
+def _to_rgb(image: np.ndarray) -> np.ndarray:
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def _write_png(image: np.ndarray, path: str, profile: OutputProfile) -> None:
+    cv2.imwrite(path, image, [cv2.IMWRITE_PNG_COMPRESSION, profile.png_compression])
+
+
+def _write_palette(image: np.ndarray, path: str, profile: OutputProfile) -> None:
+    colors = max(2, min(256, profile.palette_colors))
+    # FASTOCTREE is only implemented for RGB input; MEDIANCUT handles single channel pages.
+    method = Image.Quantize.FASTOCTREE if image.ndim == 3 else Image.Quantize.MEDIANCUT
+    quantized = Image.fromarray(_to_rgb(image)).quantize(colors=colors, method=method)
+    bits = next(b for b in (1, 2, 4, 8) if colors <= 2 ** b)
+    quantized.save(path, format="PNG", compress_level=profile.png_compression, bits=bits)
+
+
+def _write_bilevel(image: np.ndarray, path: str, profile: OutputProfile) -> None:
+    gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
+    height, width = binary.shape
+    packed = np.packbits(binary > 0, axis=1)
+    Image.frombytes("1", (width, height), packed.tobytes()).save(
+        path, format="PNG", compress_level=profile.png_compression
+    )
+
+
+def _write_webp_lossless(image: np.ndarray, path: str, profile: OutputProfile) -> None:
+    # Quality above 100 selects lossless mode in OpenCV's WebP encoder.
+    cv2.imwrite(path, image, [cv2.IMWRITE_WEBP_QUALITY, 101])
+
+
+_WRITERS = {
+    "png": (".png", _write_png),
+    "png_palette": (".png", _write_palette),
+    "png_bilevel": (".png", _write_bilevel),
+    "webp_lossless": (".webp", _write_webp_lossless),
+}
+
+
+def encode_page(image: np.ndarray, path_stem: str, profile: OutputProfile) -> EncodedImage:
+    # Pages the profile's codec does not suit are written as plain PNG.
+    codec = profile.codec
+    reason = _unsuitable(image, profile)
+    if reason:
+        codec = "png"
+    extension, writer = _WRITERS[codec]
+    path = path_stem + extension
+    started = time.perf_counter()
+    writer(image, path, profile)
+    encode_ms = (time.perf_counter() - started) * 1000
+    return EncodedImage(
+        path=path,
+        content_type=CONTENT_TYPES[extension],
+        codec=codec,
+        size_bytes=os.path.getsize(path),
+        encode_ms=encode_ms,
+        fallback=(profile.codec, reason) if reason else None,
+    )
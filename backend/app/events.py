@@ -0,0 +1,130 @@
+import json
+import time
+from typing import AsyncIterator, Dict, List, Optional
+import redis
+import redis.asyncio
+from .config import settings
+
+# Each upload has a Redis stream of job events (replayable with Last-Event-ID)
+# and a snapshot of its current progress for GET /api/uploads/{id}. Both only
+# cover the latest job run; Postgres keeps the state as of the last terminal
+# status.
+STREAM_KEY = "upload_events:{}"
+SNAPSHOT_KEY = "upload_progress:{}"
+# Pages finished in the current run, shared by the jobs of a fanned-out upload.
+PAGES_READY_KEY = "upload_pages_ready:{}"
+STREAM_MAXLEN = 1000
+TERMINAL_STATUSES = {"READY", "FAILED"}
+
+redis_conn = redis.Redis.from_url(settings.redis_url, decode_responses=True)
+_async_conn: Optional[redis.asyncio.Redis] = None
+
+
+def async_conn() -> redis.asyncio.Redis:
+    global _async_conn
+    if _async_conn is None:
+        _async_conn = redis.asyncio.Redis.from_url(settings.redis_url, decode_responses=True)
+    return _async_conn
+
+
+def publish(upload_id: str, event_type: str, data: Dict, snapshot: Optional[Dict] = None) -> None:
+    stream = STREAM_KEY.format(upload_id)
+    pipe = redis_conn.pipeline()
+    pipe.xadd(stream, {"type": event_type, "data": json.dumps(data)}, maxlen=STREAM_MAXLEN, approximate=True)
+    pipe.expire(stream, settings.progress_event_ttl_seconds)
+    if snapshot is not None:
+        pipe.set(SNAPSHOT_KEY.format(upload_id), json.dumps(snapshot), ex=settings.progress_event_ttl_seconds)
+    pipe.execute()
+
+
+def snapshot(upload_id: str) -> Optional[Dict]:
+    raw = redis_conn.get(SNAPSHOT_KEY.format(upload_id))
+    return json.loads(raw) if raw else None
+
+
+class ProgressReporter:
+    # Job-side view of one run: steps, per-step timings and page counts go to
+    # Redis as they happen. progress only holds keys owned by the job; it is
+    # merged into Upload.progress when the terminal state is written.
+    def __init__(self, upload_id: str, steps: List[str], progress: Optional[Dict] = None) -> None:
+        self.upload_id = str(upload_id)
+        if progress is None:
+            progress = {"steps": steps, "current": None, "timings": {}}
+            redis_conn.delete(STREAM_KEY.format(self.upload_id), PAGES_READY_KEY.format(self.upload_id))
+        self.progress: Dict = progress
+
+    @classmethod
+    def resume(cls, upload_id: str, steps: List[str]) -> "ProgressReporter":
+        # Continues a run started by another job (page jobs and the finalizer
+        # of a fanned-out upload) from its snapshot, keeping the event stream.
+        progress = snapshot(str(upload_id)) or {"steps": steps, "current": None, "timings": {}}
+        return cls(upload_id, steps, progress)
+
+    def step(self, name: str) -> None:
+        # Wall-clock start of the current step, so a later job can time it.
+        now = time.time()
+        previous = self.progress["current"]
+        if previous is not None:
+            elapsed = round((now - self.progress.get("stepStartedAt", now)) * 1000, 1)
+            self.progress["timings"][previous] = elapsed
+            publish(self.upload_id, "timing", {"step": previous, "ms": elapsed})
+        self.progress["stepStartedAt"] = now
+        self.progress["current"] = name
+        publish(self.upload_id, "progress", {"current": name, "steps": self.progress["steps"]}, self.progress)
+
+    def update(self, **fields) -> None:
+        self.progress.update(fields)
+
+    def pages_total(self, total: int) -> None:
+        self.progress.update(pagesTotal=total, pagesReady=0)
+
+    def page(self, page_number: int, page_id: str, status: str) -> None:
+        if status == "READY":
+            key = PAGES_READY_KEY.format(self.upload_id)
+            pipe = redis_conn.pipeline()
+            pipe.incr(key)
+            pipe.expire(key, settings.progress_event_ttl_seconds)
+            self.progress["pagesReady"] = pipe.execute()[0]
+        data = {
+            "pageNumber": page_number,
+            "pageId": str(page_id),
+            "status": status,
+            "pagesReady": self.progress.get("pagesReady", 0),
+            "pagesTotal": self.progress.get("pagesTotal"),
+        }
+        publish(self.upload_id, "page", data, self.progress)
+
+    def finish(self, status: str, error: Optional[str] = None) -> None:
+        # Called once the terminal state is committed; ends SSE streams.
+        data = {"status": status}
+        if error:
+            data["error"] = error
+        publish(self.upload_id, "status", data, self.progress)
+
+
+def _sse(event_type: str, data: str, event_id: Optional[str] = None) -> str:
+    lines = [f"id: {event_id}"] if event_id else []
+    lines += [f"event: {event_type}", f"data: {data}"]
+    return "\n".join(lines) + "\n\n"
+
+
+async def follow(upload_id: str, status: str, last_id: str, is_disconnected) -> AsyncIterator[str]:
+    # Server-Sent Events for one upload: replays the stream after last_id,
+    # then blocks on new entries until a terminal status event or the client
+    # goes away. Comment lines keep idle connections open through proxies.
+    conn = async_conn()
+    stream = STREAM_KEY.format(upload_id)
+    if status in TERMINAL_STATUSES and not await conn.exists(stream):
+        yield _sse("status", json.dumps({"status": status}))
+        return
+    while not await is_disconnected():
+        batches = await conn.xread({stream: last_id}, count=100, block=settings.progress_keepalive_seconds * 1000)
+        if not batches:
+            yield ": keepalive\n\n"
+            continue
+        for _, entries in batches:
+            for entry_id, fields in entries:
+                last_id = entry_id
+                yield _sse(fields["type"], fields["data"], entry_id)
+                if fields["type"] == "status" and json.loads(fields["data"])["status"] in TERMINAL_STATUSES:
+                    return
@@ -0,0 +1,165 @@
+import time
+from datetime import timedelta
+from typing import Dict, Iterable, Optional
+from rq import Queue
+from rq.job import Job, JobStatus
+from rq.utils import utcformat, utcnow
+from .config import settings
+
+# Jobs submitted here wait in per-project lists and are moved onto their RQ
+# queue by dispatch(), which keeps each queue only a few jobs deep. Every API
+# and worker node may dispatch; the choice and the move happen in one Lua
+# script, so nodes never hand out the same job or exceed a project's cap.
+#
+#   fairshare:{queue}:projects        zset  project -> virtual start (seconds of work)
+#   fairshare:{queue}:pending:{proj}  list  "job_id|cost|seconds until the slot is reclaimed"
+#   fairshare:{queue}:since           hash  project -> time it last got a job (or joined)
+#   fairshare:{queue}:vclock          virtual time of the last dispatch
+#   fairshare:{queue}:delayed         zset  "project|entry" -> time it may join pending
+#   fairshare:running:{proj}          zset  job_id -> deadline, over all queues
+#   fairshare:weights                 hash  project -> weight (default 1), set by operators
+PREFIX = "fairshare:{}"
+RUNNING_KEY = "fairshare:running:{}"
+WEIGHTS_KEY = "fairshare:weights"
+# Slack on top of the job timeout before a slot whose worker died is reclaimed.
+RUNNING_GRACE_SECONDS = 300
+
+_JOIN = """
+local function join(prefix, project, entry, now)
+  redis.call('RPUSH', prefix .. ':pending:' .. project, entry)
+  if not redis.call('ZSCORE', prefix .. ':projects', project) then
+    -- A project that (re)joins starts at the current virtual time: no credit
+    -- for having been idle, no debt from earlier bursts.
+    local vclock = tonumber(redis.call('GET', prefix .. ':vclock') or '0')
+    redis.call('ZADD', prefix .. ':projects', vclock, project)
+    redis.call('HSET', prefix .. ':since', project, now)
+  end
+end
+"""
+
+_SUBMIT = _JOIN + """
+join(ARGV[1], ARGV[2], ARGV[3], tonumber(ARGV[4]))
+"""
+
+_DISPATCH = _JOIN + """
+local prefix, queue_key, queues_key, job_prefix = ARGV[1], ARGV[2], ARGV[3], ARGV[4]
+local now, enqueued_at = tonumber(ARGV[5]), ARGV[6]
+local depth, cap, scan, aging = tonumber(ARGV[7]), tonumber(ARGV[8]), tonumber(ARGV[9]), tonumber(ARGV[10])
+local running_prefix, weights_key = ARGV[11], ARGV[12]
+local projects_key, since_key, vclock_key = prefix .. ':projects', prefix .. ':since', prefix .. ':vclock'
+local delayed_key = prefix .. ':delayed'
+for _, member in ipairs(redis.call('ZRANGEBYSCORE', delayed_key, '-inf', now)) do
+  local project, entry = string.match(member, '^([^|]+)|(.+)$')
+  join(prefix, project, entry, now)
+  redis.call('ZREM', delayed_key, member)
+end
+local dispatched = 0
+while redis.call('LLEN', queue_key) < depth do
+  -- Lowest virtual start wins, less credit for time spent waiting (aging);
+  -- projects at their concurrency cap are skipped.
+  local candidates = redis.call('ZRANGE', projects_key, 0, scan - 1, 'WITHSCORES')
+  local best, best_score
+  for i = 1, #candidates, 2 do
+    local project = candidates[i]
+    local running_key = running_prefix .. project
+    redis.call('ZREMRANGEBYSCORE', running_key, '-inf', now)
+    if cap <= 0 or redis.call('ZCARD', running_key) < cap then
+      local since = tonumber(redis.call('HGET', since_key, project) or now)
+      local score = tonumber(candidates[i + 1]) - aging * (now - since)
+      if best == nil or score < best_score then
+        best, best_score = project, score
+      end
+    end
+  end
+  if best == nil then
+    break
+  end
+  local pending_key = prefix .. ':pending:' .. best
+  local entry = redis.call('LPOP', pending_key)
+  local start = tonumber(redis.call('ZSCORE', projects_key, best))
+  if entry then
+    local job_id, cost, timeout = string.match(entry, '^([^|]+)|([^|]+)|([^|]+)$')
+    redis.call('ZADD', running_prefix .. best, now + tonumber(timeout), job_id)
+    redis.call('HSET', job_prefix .. job_id, 'status', 'queued', 'enqueued_at', enqueued_at)
+    redis.call('RPUSH', queue_key, job_id)
+    redis.call('SADD', queues_key, queue_key)
+    local weight = tonumber(redis.call('HGET', weights_key, best) or '1')
+    start = start + tonumber(cost) / weight
+    dispatched = dispatched + 1
+  end
+  local vclock = tonumber(redis.call('GET', vclock_key) or '0')
+  if start > vclock then
+    redis.call('SET', vclock_key, start)
+  end
+  if redis.call('LLEN', pending_key) == 0 then
+    redis.call('ZREM', projects_key, best)
+    redis.call('HDEL', since_key, best)
+  else
+    redis.call('ZADD', projects_key, start, best)
+    redis.call('HSET', since_key, best, now)
+  end
+end
+return dispatched
+"""
+
+
+def submit(
+    connection,
+    queue_name: str,
+    project_id: str,
+    cost_seconds: float,
+    func,
+    *args,
+    job_timeout: int,
+    meta: Optional[Dict] = None,
+    delay_seconds: float = 0,
+) -> Job:
+    # Creates the job as deferred and queues it behind the project's earlier
+    # jobs; cost_seconds is what the project is charged when it runs. With
+    # delay_seconds the job only joins the project's queue once that has
+    # passed (the next dispatch() after it moves it over).
+    queue = Queue(queue_name, connection=connection)
+    if not settings.fairshare_enabled:
+        if delay_seconds > 0:
+            return queue.enqueue_in(timedelta(seconds=delay_seconds), func, *args, job_timeout=job_timeout, meta=meta)
+        return queue.enqueue(func, *args, job_timeout=job_timeout, meta=meta)
+    meta = {**(meta or {}), "fairshare": {"project": str(project_id)}}
+    job = queue.create_job(func, args=args, timeout=job_timeout, meta=meta, status=JobStatus.DEFERRED)
+    job.save()
+    entry = f"{job.id}|{max(cost_seconds, 0.001)}|{job_timeout + RUNNING_GRACE_SECONDS}"
+    if delay_seconds > 0:
+        connection.zadd(PREFIX.format(queue_name) + ":delayed", {f"{project_id}|{entry}": time.time() + delay_seconds})
+        return job
+    connection.register_script(_SUBMIT)(args=[PREFIX.format(queue_name), str(project_id), entry, time.time()])
+    dispatch(connection, [queue_name])
+    return job
+
+
+def dispatch(connection, queue_names: Iterable[str]) -> int:
+    script = connection.register_script(_DISPATCH)
+    moved = 0
+    for name in queue_names:
+        moved += script(
+            args=[
+                PREFIX.format(name),
+                Queue.redis_queue_namespace_prefix + name,
+                Queue.redis_queues_keys,
+                Job.redis_job_namespace_prefix,
+                time.time(),
+                utcformat(utcnow()),
+                settings.fairshare_queue_depth,
+                settings.fairshare_project_max_running,
+                settings.fairshare_scan_projects,
+                settings.fairshare_aging_per_second,
+                RUNNING_KEY.format(""),
+                WEIGHTS_KEY,
+            ]
+        )
+    return moved
+
+
+def release(connection, job: Job) -> None:
+    # Frees the job's slot under its project's cap once it has ended.
+    owner = (job.meta or {}).get("fairshare")
+    if owner:
+        connection.zrem(RUNNING_KEY.format(owner["project"]), job.id)
@@ -0,0 +1,132 @@
+import hashlib
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from .storage import MultipartWriter, storage_client
+
+# Boundaries, part headers and small form fields on top of the file itself.
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+
+class UploadRejected(Exception):
+    def __init__(self, status_code: int, detail: str) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+@dataclass
+class ReceivedFile:
+    key: str
+    filename: str
+    content_type: str
+    size_bytes: int
+    sha256: str
+
+
+def _part_events(boundary: bytes) -> Tuple[MultipartParser, List[Tuple[str, object]]]:
+    # The parser reports through callbacks; they only record events, which
+    # receive_file() then handles (and awaits storage for) between body chunks.
+    events: List[Tuple[str, object]] = []
+    headers: Dict[bytes, bytes] = {}
+    field = bytearray()
+    value = bytearray()
+
+    def on_part_begin() -> None:
+        headers.clear()
+
+    def on_header_field(data: bytes, start: int, end: int) -> None:
+        field.extend(data[start:end])
+
+    def on_header_value(data: bytes, start: int, end: int) -> None:
+        value.extend(data[start:end])
+
+    def on_header_end() -> None:
+        headers[bytes(field).lower()] = bytes(value)
+        field.clear()
+        value.clear()
+
+    def on_headers_finished() -> None:
+        events.append(("headers", dict(headers)))
+
+    def on_part_data(data: bytes, start: int, end: int) -> None:
+        events.append(("data", data[start:end]))
+
+    def on_part_end() -> None:
+        events.append(("end", None))
+
+    callbacks = {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    }
+    return MultipartParser(boundary, callbacks), events
+
+
+async def receive_file(
+    request: Request,
+    field_name: str,
+    max_bytes: int,
+    allowed_types: Set[str],
+    key_for: Callable[[str], str],
+) -> ReceivedFile:
+    # Streams the multipart body: the file part is hashed and written to S3 in
+    # parts as it arrives, and the upload is aborted as soon as it is too large
+    # or of the wrong type. Other form fields are ignored.
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadRejected(400, "Expected multipart/form-data")
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_bytes + MULTIPART_OVERHEAD_BYTES:
+        raise UploadRejected(400, "File too large")
+
+    parser, events = _part_events(params[b"boundary"])
+    digest = hashlib.sha256()
+    writer: Optional[MultipartWriter] = None
+    received: Optional[ReceivedFile] = None
+    in_file = False
+    try:
+        async for chunk in request.stream():
+            try:
+                parser.write(chunk)
+            except MultipartParseError:
+                raise UploadRejected(400, "Malformed multipart body")
+            for kind, payload in events:
+                if kind == "headers":
+                    _, options = parse_options_header(payload.get(b"content-disposition", b""))
+                    name = options.get(b"name", b"").decode("latin-1")
+                    in_file = received is None and name == field_name and b"filename" in options
+                    if not in_file:
+                        continue
+                    filename = options[b"filename"].decode("utf-8", "replace")
+                    part_type = payload.get(b"content-type", b"").decode("latin-1").split(";")[0].strip()
+                    if part_type not in allowed_types:
+                        raise UploadRejected(400, "Unsupported file type")
+                    key = key_for(filename)
+                    received = ReceivedFile(key=key, filename=filename, content_type=part_type, size_bytes=0, sha256="")
+                    writer = storage_client.open_multipart(key, part_type)
+                elif kind == "data" and in_file:
+                    received.size_bytes += len(payload)
+                    if received.size_bytes > max_bytes:
+                        raise UploadRejected(400, "File too large")
+                    digest.update(payload)
+                    await run_in_threadpool(writer.write, payload)
+                elif kind == "end":
+                    in_file = False
+            events.clear()
+        if received is None:
+            raise UploadRejected(400, "Missing file")
+        await run_in_threadpool(writer.complete)
+    except Exception:
+        if writer is not None:
+            await run_in_threadpool(writer.abort)
+        raise
+    received.sha256 = digest.hexdigest()
+    return received
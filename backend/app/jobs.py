@@ -1,97 +1,792 @@
+import hashlib
 import json
 import os
+import queue
+import shutil
 import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+from rq import Queue, get_current_job
+from rq.job import Dependency
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
+from . import fairshare, recovery, routing
+from .config import settings
 from .db import SessionLocal
+from .events import ProgressReporter, publish
+from .memory import MemoryAdmissionTimeout, reserve
 from .models import Upload, UploadStatus, Page, PageStatus
-from .processor import process_file
-from .storage import storage_client
+from .processor import (
+    ProcessedPage,
+    ProcessOptions,
+    document_page_numbers,
+    fingerprint_distance,
+    fingerprint_pages,
+    iter_process_file,
+    page_footprint_bytes,
+    page_sizes,
+    pipeline_fingerprint,
+    process_page_isolated,
+)
+from .routing import actual_cost, estimate
+from .storage import TransferResult, storage_client
+from .tiles import TILE_FORMATS, TilePyramid, iter_tile_files
 
 
-def _update_progress(db: Session, upload: Upload, status_list, current_step):
-    progress = {
-        "steps": status_list,
-        "current": current_step,
+# Pages are uploaded while later ones are enhanced, so "enhancing" covers both.
+STEPS = ["queued", "fetching", "converting", "enhancing", "writing_db", "done"]
+# Page jobs and finalizers of fanned-out uploads.
+PAGES_QUEUE = "pages"
+
+
+def build_process_options() -> ProcessOptions:
+    return ProcessOptions(
+        workers=settings.process_workers,
+        cv_threads=settings.process_cv_threads,
+        output_profile=settings.page_output_profile,
+        page_memory_limit_bytes=settings.page_memory_limit_mb * 1024 * 1024,
+        scratch_dir=settings.page_scratch_dir,
+        scratch_memmap=settings.page_scratch_memmap,
+        thumbnail_sizes=tuple(settings.thumbnail_sizes) or (512,),
+        tile_size=settings.page_tile_size,
+        tile_format=settings.page_tile_format,
+    )
+
+
+def _tile_transfers(pyramid: TilePyramid, key_base: str) -> Tuple[List[Tuple[str, str, str]], Dict]:
+    # DeepZoom layout next to the page image: {key_base}.dzi and {key_base}_files/{level}/{col}_{row}.{format}.
+    content_type = TILE_FORMATS[pyramid.format]
+    items = [(f"{key_base}_files/{suffix}", path, content_type) for suffix, path in iter_tile_files(pyramid)]
+    key_dzi = f"{key_base}.dzi"
+    items.append((key_dzi, pyramid.dzi_path, "application/xml"))
+    return items, {**pyramid.as_metrics(), "dziKey": key_dzi}
+
+
+def _transfer_summary(results: List[TransferResult], seconds: float) -> Dict:
+    size_bytes = sum(result.size_bytes for result in results)
+    slowest = max(results, key=lambda result: result.seconds, default=None)
+    return {
+        "objects": len(results),
+        "bytes": size_bytes,
+        "seconds": round(seconds, 3),
+        "mbPerSecond": round(size_bytes / (1024 * 1024) / seconds, 2) if seconds > 0 else None,
+        "slowestKey": slowest.key if slowest else None,
+        "slowestSeconds": round(slowest.seconds, 3) if slowest else None,
+    }
+
+
+def _page_transfers(upload: Upload, page: ProcessedPage) -> Tuple[List[Tuple[str, str, str]], str, str, Dict]:
+    # The page image, its thumbnails and tiles as (key, path, content type) items.
+    prefix = f"projects/{upload.project_id}/uploads/{upload.id}"
+    extension = os.path.splitext(page.png_path)[1]
+    key_png = f"{prefix}/pages/page_{page.page_number:02d}{extension}"
+    key_thumb = f"{prefix}/thumbs/page_{page.page_number:02d}.jpg"
+    items = [(key_png, page.png_path, page.content_type)]
+    thumb_keys = {}
+    for size, thumb_path in page.thumb_paths.items():
+        # The largest size keeps the original thumbnail key.
+        key = key_thumb
+        if thumb_path != page.thumb_path:
+            key = f"{prefix}/thumbs/page_{page.page_number:02d}_{size}.jpg"
+        items.append((key, thumb_path, "image/jpeg"))
+        thumb_keys[str(size)] = key
+    metrics = {**page.metrics, "thumbnails": thumb_keys}
+    if page.tiles:
+        tile_items, metrics["tiles"] = _tile_transfers(page.tiles, os.path.splitext(key_png)[0])
+        items.extend(tile_items)
+    return items, key_png, key_thumb, metrics
+
+
+def _discard_page_files(page: ProcessedPage) -> None:
+    # Stored pages are not needed locally any more; keeps scratch space flat on long jobs.
+    for path in {page.png_path, page.thumb_path, *page.thumb_paths.values()}:
+        if path and os.path.exists(path):
+            os.remove(path)
+    if page.tiles:
+        shutil.rmtree(page.tiles.files_dir, ignore_errors=True)
+        if os.path.exists(page.tiles.dzi_path):
+            os.remove(page.tiles.dzi_path)
+
+
+_PRODUCER_DONE = object()
+
+
+def _hand_over(handoff: queue.Queue, item, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            handoff.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _produce(pages: Iterator[ProcessedPage], handoff: queue.Queue, stop: threading.Event) -> None:
+    item = _PRODUCER_DONE
+    try:
+        for page in pages:
+            if not _hand_over(handoff, page, stop):
+                break
+    except BaseException as exc:  # noqa: BLE001
+        item = exc
+    finally:
+        pages.close()
+    _hand_over(handoff, item, stop)
+
+
+def _pipelined(pages: Iterator[ProcessedPage], depth: int) -> Iterator[ProcessedPage]:
+    # Runs the page generator on its own thread, at most `depth` finished
+    # pages ahead of the consumer. OpenCV and the process pool release the
+    # GIL, so enhancement overlaps with uploads and commits here.
+    handoff: queue.Queue = queue.Queue(maxsize=max(1, depth))
+    stop = threading.Event()
+    producer = threading.Thread(target=_produce, args=(pages, handoff, stop), name="page-producer", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = handoff.get()
+            if item is _PRODUCER_DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+
+def _commit_pages(
+    db: Session,
+    reporter: ProgressReporter,
+    claimed: Dict[int, Page],
+    claimed_ids: Dict[int, uuid.UUID],
+    page_numbers: List[int],
+) -> Set[int]:
+    # Commits finished pages and announces them. A page deselected while this
+    # job ran has been deleted; it is dropped instead of written back.
+    ids = [claimed_ids[number] for number in page_numbers]
+    alive = {page_id for (page_id,) in db.query(Page.id).filter(Page.id.in_(ids))}
+    committed = set()
+    for number in page_numbers:
+        if claimed_ids[number] in alive:
+            committed.add(number)
+        elif claimed[number] in db:
+            db.expunge(claimed[number])
+    db.commit()
+    for number in sorted(committed):
+        reporter.page(number, claimed_ids[number], PageStatus.READY.value)
+    return committed
+
+
+def find_processed_upload(
+    db: Session, content_sha256: str, mime_type: str, fingerprint: str, exclude_id: Optional[uuid.UUID] = None
+) -> Optional[Upload]:
+    # The latest READY upload of the same original processed by the same pipeline.
+    query = db.query(Upload).filter(
+        Upload.content_sha256 == content_sha256,
+        Upload.mime_type == mime_type,
+        Upload.status == UploadStatus.READY,
+        Upload.pipeline_fingerprint == fingerprint,
+    )
+    if exclude_id is not None:
+        query = query.filter(Upload.id != exclude_id)
+    return query.order_by(Upload.created_at.desc()).first()
+
+
+def reuse_processed_upload(db: Session, source: Upload, upload: Upload) -> None:
+    # The new rows point at the source upload's stored pages, thumbnails and
+    # tiles; nothing is copied in storage and no job is enqueued.
+    source_pages = (
+        db.query(Page)
+        .filter(Page.upload_id == source.id, Page.status == PageStatus.READY)
+        .order_by(Page.page_number.asc())
+        .all()
+    )
+    upload.status = UploadStatus.READY
+    upload.warnings = source.warnings
+    upload.progress = {
+        "steps": ["queued", "done"],
+        "current": "done",
+        "reusedFromUploadId": str(source.id),
     }
-    upload.progress = progress
+    if upload.mime_type == "application/pdf":
+        upload.progress["selectedPages"] = [page.page_number for page in source_pages]
     db.add(upload)
+    for page in source_pages:
+        db.add(
+            Page(
+                upload_id=upload.id,
+                page_number=page.page_number,
+                width_px=page.width_px,
+                height_px=page.height_px,
+                dpi_estimated=page.dpi_estimated,
+                storage_key_page_png=page.storage_key_page_png,
+                storage_key_page_thumb=page.storage_key_page_thumb,
+                status=page.status,
+                warnings=page.warnings,
+                metrics=page.metrics,
+                fingerprint=page.fingerprint,
+                derived_from_page_id=page.id,
+            )
+        )
+
+
+def _reuse_identical_upload(db: Session, upload: Upload) -> bool:
+    # Only before the run has created any pages of its own.
+    if db.query(Page.id).filter(Page.upload_id == upload.id).first():
+        return False
+    source = find_processed_upload(
+        db, upload.content_sha256, upload.mime_type, pipeline_fingerprint(build_process_options()), upload.id
+    )
+    if source is None:
+        return False
+    own_original = upload.storage_key_original
+    upload.storage_key_original = source.storage_key_original
+    upload.pipeline_fingerprint = source.pipeline_fingerprint
+    reuse_processed_upload(db, source, upload)
+    db.commit()
+    if own_original != source.storage_key_original:
+        storage_client.delete(own_original)
+    return True
+
+
+def _find_unchanged_pages(db: Session, upload: Upload, fingerprints: Dict[int, str]) -> Dict[int, Page]:
+    # Closest earlier READY page in the same project, processed with the same
+    # pipeline, whose fingerprint is within page_reuse_max_distance bits.
+    candidates = (
+        db.query(Page)
+        .join(Upload, Page.upload_id == Upload.id)
+        .filter(
+            Upload.project_id == upload.project_id,
+            Upload.id != upload.id,
+            Upload.pipeline_fingerprint == upload.pipeline_fingerprint,
+            Page.status == PageStatus.READY,
+            Page.fingerprint.isnot(None),
+        )
+        .order_by(Upload.created_at.desc())
+        .all()
+    )
+    unchanged: Dict[int, Page] = {}
+    for page_number, fingerprint in fingerprints.items():
+        best_distance = None
+        for candidate in candidates:
+            distance = fingerprint_distance(fingerprint, candidate.fingerprint)
+            if distance is None or distance > settings.page_reuse_max_distance:
+                continue
+            if best_distance is None or distance < best_distance:
+                best_distance = distance
+                unchanged[page_number] = candidate
+    return unchanged
+
+
+def _copy_page(page: Page, source: Page, fingerprint: str) -> None:
+    # Points the page at the source page's stored image, thumbnails and tiles.
+    page.width_px = source.width_px
+    page.height_px = source.height_px
+    page.dpi_estimated = source.dpi_estimated
+    page.storage_key_page_png = source.storage_key_page_png
+    page.storage_key_page_thumb = source.storage_key_page_thumb
+    page.status = PageStatus.READY
+    page.warnings = source.warnings
+    page.metrics = source.metrics
+    page.fingerprint = fingerprint
+    page.derived_from_page_id = source.id
+
+
+def insert_pages(db: Session, upload_id, page_numbers: List[int]) -> List[int]:
+    # Creates PENDING rows for the pages an upload does not have yet and
+    # returns their numbers. A selection change and a run's claim may race;
+    # the (upload_id, page_number) constraint lets only one insert each row.
+    if not page_numbers:
+        return []
+    insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    statement = (
+        insert(Page)
+        .values([{"upload_id": upload_id, "page_number": number, "status": PageStatus.PENDING} for number in page_numbers])
+        .on_conflict_do_nothing(index_elements=["upload_id", "page_number"])
+        .returning(Page.page_number)
+    )
+    return sorted(db.execute(statement).scalars())
+
+
+def _claim_pages(db: Session, upload: Upload, page_numbers: List[int]) -> Dict[int, Page]:
+    # Pages are tracked individually: missing rows are created, READY ones are
+    # left alone and the rest taken over. The caller holds the upload lock, so
+    # a PROCESSING page belongs to a run that was interrupted.
+    insert_pages(db, upload.id, page_numbers)
+    claimed: Dict[int, Page] = {}
+    for page in (
+        db.query(Page)
+        .filter(Page.upload_id == upload.id, Page.page_number.in_(page_numbers))
+        .order_by(Page.page_number.asc())
+        .with_for_update()
+    ):
+        if page.status != PageStatus.READY:
+            page.status = PageStatus.PROCESSING
+            claimed[page.page_number] = page
     db.commit()
+    return claimed
+
+
+def _write_metadata(db: Session, upload: Upload) -> None:
+    pages = (
+        db.query(Page)
+        .filter(Page.upload_id == upload.id, Page.status == PageStatus.READY)
+        .order_by(Page.page_number.asc())
+        .all()
+    )
+    metadata_key = f"projects/{upload.project_id}/uploads/{upload.id}/metadata/upload.json"
+    metadata_payload = {
+        "uploadId": str(upload.id),
+        "projectId": str(upload.project_id),
+        "pages": [
+            {
+                "pageNumber": page.page_number,
+                "widthPx": page.width_px,
+                "heightPx": page.height_px,
+                "storageKeyPagePng": page.storage_key_page_png,
+                "storageKeyPageThumb": page.storage_key_page_thumb,
+                "warnings": page.warnings,
+                "metrics": page.metrics,
+            }
+            for page in pages
+        ],
+    }
+    storage_client.upload_bytes(metadata_key, json.dumps(metadata_payload).encode("utf-8"), "application/json")
 
 
-def process_upload(upload_id: str):
-    steps = ["queued", "fetching", "converting", "enhancing", "uploading_pages", "writing_db", "done"]
+def _fetch_original(upload: Upload) -> Tuple[str, str]:
+    temp_dir = tempfile.mkdtemp(prefix="upload_")
+    local_path = os.path.join(temp_dir, "original")
+    storage_client.download_file(upload.storage_key_original, local_path)
+    return temp_dir, local_path
+
+
+def _store_page(
+    db: Session,
+    upload: Upload,
+    reporter: ProgressReporter,
+    claimed: Dict[int, Page],
+    claimed_ids: Dict[int, uuid.UUID],
+    page: ProcessedPage,
+    fingerprint: Optional[str],
+) -> Tuple[Set[int], List[TransferResult], float]:
+    started = time.perf_counter()
+    items, key_png, key_thumb, metrics = _page_transfers(upload, page)
+    results = storage_client.upload_many(items)
+    seconds = time.perf_counter() - started
+    _discard_page_files(page)
+    row = claimed[page.page_number]
+    row.width_px = page.width_px
+    row.height_px = page.height_px
+    row.dpi_estimated = page.dpi_estimated
+    row.storage_key_page_png = key_png
+    row.storage_key_page_thumb = key_thumb
+    row.status = PageStatus.READY
+    row.warnings = page.warnings
+    row.metrics = metrics
+    row.fingerprint = fingerprint
+    return _commit_pages(db, reporter, claimed, claimed_ids, [page.page_number]), results, seconds
+
+
+def _process_pages(
+    db: Session,
+    upload: Upload,
+    reporter: ProgressReporter,
+    claimed: Dict[int, Page],
+    claimed_ids: Dict[int, uuid.UUID],
+    local_path: str,
+    temp_dir: str,
+    page_numbers: List[int],
+    fingerprints: Dict[int, str],
+) -> Tuple[Set[int], List[TransferResult], float]:
+    # Pages are enhanced on a producer thread while this one uploads and
+    # commits the previous page, so each page is visible as soon as it is stored.
+    # Work only starts once its estimated peak memory fits in the node's
+    # budget; pages above page_isolation_threshold_mb run one by one in a
+    # child process capped at page_isolation_limit_mb, and fail alone.
+    done: Set[int] = set()
+    results: List[TransferResult] = []
+    transfer_seconds = 0.0
+    if not page_numbers:
+        return done, results, transfer_seconds
+    options = build_process_options()
+    footprints = {
+        number: page_footprint_bytes(width, height, options)
+        for number, (width, height) in page_sizes(local_path, upload.mime_type, page_numbers).items()
+    }
+    threshold = settings.page_isolation_threshold_mb * 1024 * 1024
+    isolated = [number for number in page_numbers if threshold and footprints.get(number, 0) > threshold]
+    regular = [number for number in page_numbers if number not in isolated]
+    # Each pool worker holds a page at a time.
+    peak = max((footprints.get(number, 0) for number in regular), default=0) * max(1, options.workers)
+    reporter.update(memory={"peakMb": peak // (1024 * 1024), "isolatedPages": isolated})
+
+    def waiting() -> None:
+        reporter.update(memory={**reporter.progress["memory"], "waiting": True})
+        publish(reporter.upload_id, "memory", reporter.progress["memory"], reporter.progress)
+
+    if regular:
+        with reserve(peak, waiting):
+            pages = iter_process_file(
+                local_path, upload.mime_type, selected_pages=regular, temp_dir=temp_dir, options=options
+            )
+            for page in _pipelined(pages, settings.page_pipeline_depth):
+                stored, page_results, seconds = _store_page(
+                    db, upload, reporter, claimed, claimed_ids, page, fingerprints.get(page.page_number)
+                )
+                done |= stored
+                results.extend(page_results)
+                transfer_seconds += seconds
+
+    limit = settings.page_isolation_limit_mb * 1024 * 1024
+    for number in isolated:
+        try:
+            with reserve(min(footprints[number], limit), waiting):
+                page = process_page_isolated(local_path, upload.mime_type, number, temp_dir, options, limit)
+        except MemoryAdmissionTimeout:
+            raise
+        except Exception as exc:  # noqa: BLE001
+            # Whatever the child died of (under the limit, native code may
+            # fail with other errors than MemoryError), only this page fails.
+            # The row may have been deselected meanwhile, hence no ORM flush.
+            warning = "page_out_of_memory" if isinstance(exc, (MemoryError, BrokenProcessPool)) else "page_failed"
+            db.query(Page).filter(Page.id == claimed_ids[number]).update(
+                {Page.status: PageStatus.FAILED, Page.warnings: [warning]}, synchronize_session=False
+            )
+            db.commit()
+            continue
+        stored, page_results, seconds = _store_page(
+            db, upload, reporter, claimed, claimed_ids, page, fingerprints.get(number)
+        )
+        done |= stored
+        results.extend(page_results)
+        transfer_seconds += seconds
+    return done, results, transfer_seconds
+
+
+def _finish_upload(db: Session, upload: Upload, reporter: ProgressReporter, processed: int, transfer: Dict) -> None:
+    reporter.update(transfer=transfer)
+    reporter.step("writing_db")
+    _write_metadata(db, upload)
+    reporter.step("done")
+    reporter.update(cost=actual_cost({**(upload.progress or {}), **reporter.progress}, processed))
+    upload.progress = {**(upload.progress or {}), **reporter.progress}
+    upload.status = UploadStatus.READY
+    # Counted over the upload: a resumed run may find every page already done.
+    ready = db.query(Page).filter(Page.upload_id == upload.id, Page.status == PageStatus.READY).count()
+    upload.warnings = [] if ready else ["No pages processed"]
+    db.commit()
+    reporter.finish(UploadStatus.READY.value)
+
+
+def _fail_upload(db: Session, upload_id: str, page_ids, reporter: Optional[ProgressReporter], exc: Exception) -> None:
+    db.rollback()
+    for page in db.query(Page).filter(Page.id.in_(list(page_ids)), Page.status == PageStatus.PROCESSING):
+        page.status = PageStatus.FAILED
+    upload = db.query(Upload).filter(Upload.id == upload_id).one_or_none()
+    if upload:
+        upload.status = UploadStatus.FAILED
+        upload.error_message = str(exc)
+        if reporter:
+            upload.progress = {**(upload.progress or {}), **reporter.progress}
+        db.add(upload)
+    db.commit()
+    if reporter:
+        reporter.finish(UploadStatus.FAILED.value, str(exc))
+
+
+def _defer_pages(
+    db: Session,
+    upload_id: str,
+    page_ids,
+    reporter: Optional[ProgressReporter],
+    status: Optional[UploadStatus] = None,
+) -> List[int]:
+    # The node's memory budget stayed full: back-pressure from busy workers,
+    # not a fault of the upload. Unfinished pages go back to PENDING (and the
+    # upload to status, if given) for a later run; returns their numbers.
+    db.rollback()
+    pages = db.query(Page).filter(Page.id.in_(list(page_ids)), Page.status == PageStatus.PROCESSING).all()
+    for page in pages:
+        page.status = PageStatus.PENDING
+    if status is not None:
+        upload = db.query(Upload).filter(Upload.id == upload_id).one()
+        upload.status = status
+        if reporter:
+            upload.progress = {**(upload.progress or {}), **reporter.progress}
+    db.commit()
+    if status is not None:
+        publish(upload_id, "status", {"status": status.value, "deferred": True})
+    return sorted(page.page_number for page in pages)
+
+
+def _fan_out(
+    upload: Upload,
+    claimed_ids: Dict[int, uuid.UUID],
+    page_numbers: List[int],
+    fingerprints: Dict[int, str],
+    token: str,
+) -> None:
+    # One job per page_fanout_batch pages on the pages queue, which every
+    # worker listens to, and a finalizer that runs once they have all ended
+    # (failed ones included). Page jobs count against the project's fair share.
+    # The lock token goes with them: the run is theirs until the finalizer
+    # releases it, and jobs of a run that was taken over do nothing.
+    connection = get_current_job().connection
+    upload_id = str(upload.id)
+    size = settings.page_fanout_batch
+    page_jobs = []
+    for index in range(0, len(page_numbers), size):
+        batch = page_numbers[index : index + size]
+        page_jobs.append(
+            fairshare.submit(
+                connection,
+                PAGES_QUEUE,
+                str(upload.project_id),
+                estimate(upload.mime_type, 0, len(batch)).seconds,
+                process_page_batch,
+                upload_id,
+                {number: str(claimed_ids[number]) for number in batch},
+                {number: fingerprints[number] for number in batch if number in fingerprints},
+                token,
+                job_timeout=settings.page_job_timeout_seconds,
+            )
+        )
+    Queue(PAGES_QUEUE, connection=connection).enqueue(
+        finalize_upload,
+        upload_id,
+        [str(page_id) for page_id in claimed_ids.values()],
+        token,
+        depends_on=Dependency(jobs=page_jobs, allow_failure=True),
+    )
+
+
+def _retry_later(upload_id: str, page_numbers: Optional[List[int]]) -> None:
+    # Another run holds the upload lock: this job goes back through its cost
+    # lane and the project's fair share, to start once that run is over.
+    job = get_current_job()
+    if job is None:
+        raise RuntimeError(f"Upload {upload_id} is being processed by another run")
     db = SessionLocal()
     try:
         upload = db.query(Upload).filter(Upload.id == upload_id).one()
+        cost = routing.estimate_upload(upload, page_numbers)
+        project_id = str(upload.project_id)
+    finally:
+        db.close()
+    args = (upload_id,) if page_numbers is None else (upload_id, page_numbers)
+    routing.enqueue(
+        job.connection, cost, project_id, process_upload, *args, delay_seconds=settings.upload_lock_retry_seconds
+    )
+
+
+def process_upload(upload_id: str, page_numbers: Optional[List[int]] = None):
+    # page_numbers limits the run to those pages (a selection change); by
+    # default the upload's selectedPages are processed.
+    # Steps, timings and page completions are published to Redis as they
+    # happen; Postgres sees the status change to PROCESSING, the page rows and
+    # the final state.
+    # With page_fanout_batch set, a run with more pages than that only
+    # coordinates: the pages are handed to process_page_batch() jobs and
+    # finalize_upload() writes the final state.
+    # Each page is committed as soon as it is stored, so a run that resumes an
+    # interrupted one (see recovery.py) starts at the first unfinished page.
+    token = recovery.acquire(upload_id)
+    if token is None:
+        _retry_later(upload_id, page_numbers)
+        return
+    db = SessionLocal()
+    claimed: Dict[int, Page] = {}
+    claimed_ids: Dict[int, uuid.UUID] = {}
+    reporter: Optional[ProgressReporter] = None
+    temp_dir: Optional[str] = None
+    fanned_out = False
+    heartbeat = recovery.Heartbeat(upload_id, token).start()
+    status_before = UploadStatus.UPLOADED
+    try:
+        upload = db.query(Upload).filter(Upload.id == upload_id).one()
+        status_before = upload.status
         upload.status = UploadStatus.PROCESSING
-        _update_progress(db, upload, steps, "queued")
-
-        _update_progress(db, upload, steps, "fetching")
-        temp_dir = tempfile.mkdtemp(prefix="upload_")
-        local_path = os.path.join(temp_dir, "original")
-        with open(local_path, "wb") as handle:
-            for chunk in storage_client.get_stream(upload.storage_key_original):
-                handle.write(chunk)
-
-        _update_progress(db, upload, steps, "converting")
-        selected = None
-        if upload.progress and isinstance(upload.progress, dict):
-            selected = upload.progress.get("selectedPages")
-        processed = process_file(local_path, upload.mime_type, selected_pages=selected)
-
-        _update_progress(db, upload, steps, "enhancing")
-
-        _update_progress(db, upload, steps, "uploading_pages")
-        pages = []
-        for page in processed.pages:
-            key_png = f"projects/{upload.project_id}/uploads/{upload.id}/pages/page_{page.page_number:02d}.png"
-            key_thumb = f"projects/{upload.project_id}/uploads/{upload.id}/thumbs/page_{page.page_number:02d}.jpg"
-            storage_client.upload_file(key_png, page.png_path, "image/png")
-            storage_client.upload_file(key_thumb, page.thumb_path, "image/jpeg")
-            pages.append(
-                Page(
-                    upload_id=upload.id,
-                    page_number=page.page_number,
-                    width_px=page.width_px,
-                    height_px=page.height_px,
-                    dpi_estimated=page.dpi_estimated,
-                    storage_key_page_png=key_png,
-                    storage_key_page_thumb=key_thumb,
-                    status=PageStatus.READY,
-                    warnings=page.warnings,
-                )
+        db.commit()
+        reporter = ProgressReporter(upload_id, STEPS)
+        reporter.step("queued")
+
+        reporter.step("fetching")
+        temp_dir, local_path = _fetch_original(upload)
+        # Uploads written straight to storage are hashed here, on first fetch,
+        # and matched against earlier uploads as upload_blueprint does.
+        if not upload.content_sha256:
+            digest = hashlib.sha256()
+            with open(local_path, "rb") as handle:
+                for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            upload.content_sha256 = digest.hexdigest()
+            if page_numbers is None and _reuse_identical_upload(db, upload):
+                reporter.finish(UploadStatus.READY.value)
+                return
+
+        reporter.step("converting")
+        requested = page_numbers
+        if requested is None and isinstance(upload.progress, dict):
+            requested = upload.progress.get("selectedPages")
+        elif requested is not None:
+            # Pages an interrupted run left behind are finished by this one.
+            orphaned = db.query(Page.page_number).filter(
+                Page.upload_id == upload.id, Page.status == PageStatus.PROCESSING
             )
+            requested = sorted(set(requested) | {number for (number,) in orphaned})
+        valid = document_page_numbers(local_path, upload.mime_type, requested)
+        # Selected pages the document does not have are reported, not rendered.
+        for page in db.query(Page).filter(
+            Page.upload_id == upload.id,
+            Page.page_number.in_(sorted(set(requested or []) - set(valid))),
+            Page.status == PageStatus.PENDING,
+        ):
+            page.status = PageStatus.FAILED
+            page.warnings = ["page_not_in_document"]
+        claimed = _claim_pages(db, upload, valid)
+        claimed_ids = {page_number: page.id for page_number, page in claimed.items()}
 
-        _update_progress(db, upload, steps, "writing_db")
-        for page in pages:
-            db.add(page)
-        upload.status = UploadStatus.READY
-        upload.warnings = processed.upload_warnings
-        metadata_key = f"projects/{upload.project_id}/uploads/{upload.id}/metadata/upload.json"
-        metadata_payload = {
-            "uploadId": str(upload.id),
-            "projectId": str(upload.project_id),
-            "pages": [
-                {
-                    "pageNumber": page.page_number,
-                    "widthPx": page.width_px,
-                    "heightPx": page.height_px,
-                    "storageKeyPagePng": page.storage_key_page_png,
-                    "storageKeyPageThumb": page.storage_key_page_thumb,
-                    "warnings": page.warnings,
-                }
-                for page in pages
-            ],
-        }
-        storage_client.upload_bytes(metadata_key, json.dumps(metadata_payload).encode("utf-8"), "application/json")
-        _update_progress(db, upload, steps, "done")
+        upload.pipeline_fingerprint = pipeline_fingerprint(build_process_options())
+        # Sheets that are visually unchanged since an earlier upload of the
+        # project (e.g. a plan revision) reuse that page instead of being enhanced
+        # again. Fingerprinting renders every page once more, so it only runs
+        # when reuse is enabled.
+        fingerprints: Dict[int, str] = {}
+        unchanged: Dict[int, Page] = {}
+        if claimed and settings.page_reuse_enabled:
+            fingerprints = fingerprint_pages(local_path, upload.mime_type, selected_pages=sorted(claimed))
+            unchanged = _find_unchanged_pages(db, upload, fingerprints)
+        remaining: List[int] = [number for number in sorted(claimed) if number not in unchanged]
+
+        reporter.pages_total(len(claimed))
+        reporter.step("enhancing")
+        for page_number, source in unchanged.items():
+            _copy_page(claimed[page_number], source, fingerprints[page_number])
+        done = _commit_pages(db, reporter, claimed, claimed_ids, list(unchanged))
+
+        if settings.page_fanout_batch and len(remaining) > settings.page_fanout_batch and get_current_job():
+            recovery.refresh(upload_id, token, settings.upload_fanout_lock_seconds)
+            _fan_out(upload, claimed_ids, remaining, fingerprints, token)
+            fanned_out = True
+            return
+
+        processed, results, transfer_seconds = _process_pages(
+            db, upload, reporter, claimed, claimed_ids, local_path, temp_dir, remaining, fingerprints
+        )
+        done |= processed
+        for page_number, page in claimed.items():
+            if page_number not in done and page in db:
+                page.status = PageStatus.FAILED
+        _finish_upload(db, upload, reporter, len(done), _transfer_summary(results, transfer_seconds))
+    except MemoryAdmissionTimeout:
+        _defer_pages(db, upload_id, claimed_ids.values(), reporter, status_before)
+        _retry_later(upload_id, page_numbers)
     except Exception as exc:  # noqa: BLE001
+        _fail_upload(db, upload_id, claimed_ids.values(), reporter, exc)
+    finally:
+        heartbeat.stop()
+        db.close()
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        if fanned_out:
+            # The heartbeat may have renewed the lock with its short TTL meanwhile.
+            recovery.refresh(upload_id, token, settings.upload_fanout_lock_seconds)
+        else:
+            recovery.release(upload_id, token)
+
+
+def process_page_batch(
+    upload_id: str, page_ids: Dict[int, str], fingerprints: Dict[int, str], token: Optional[str] = None
+):
+    # Enhances and stores a slice of a fanned-out upload's pages, which the
+    # coordinator has already claimed. Pages it cannot finish are marked
+    # FAILED; the upload itself is left to finalize_upload().
+    ttl = settings.upload_fanout_lock_seconds
+    # The run was taken over (or its lock lapsed and the reaper will resume it).
+    if token and not recovery.refresh(upload_id, token, ttl):
+        return [], 0.0
+    db = SessionLocal()
+    temp_dir: Optional[str] = None
+    claimed_ids = {int(number): uuid.UUID(page_id) for number, page_id in page_ids.items()}
+    heartbeat = recovery.Heartbeat(upload_id, token, ttl).start()
+    try:
+        upload = db.query(Upload).filter(Upload.id == upload_id).one()
+        # A coordinator that failed after enqueueing has already failed the pages.
+        if upload.status == UploadStatus.FAILED:
+            return [], 0.0
+        rows = {page.id: page for page in db.query(Page).filter(Page.id.in_(list(claimed_ids.values())))}
+        claimed = {number: rows[page_id] for number, page_id in claimed_ids.items() if page_id in rows}
+        reporter = ProgressReporter.resume(upload_id, STEPS)
+        temp_dir, local_path = _fetch_original(upload)
+        _, results, transfer_seconds = _process_pages(
+            db,
+            upload,
+            reporter,
+            claimed,
+            claimed_ids,
+            local_path,
+            temp_dir,
+            sorted(claimed),
+            {int(number): fingerprint for number, fingerprint in fingerprints.items()},
+        )
+        return results, transfer_seconds
+    except MemoryAdmissionTimeout:
+        # Pages stored so far stay READY; the rest get a run of their own,
+        # which picks them up after finalize_upload() has written this one.
+        deferred = _defer_pages(db, upload_id, claimed_ids.values(), None)
+        if deferred:
+            _retry_later(upload_id, deferred)
+        return [], 0.0
+    except Exception:
         db.rollback()
-        upload = db.query(Upload).filter(Upload.id == upload_id).one_or_none()
-        if upload:
-            upload.status = UploadStatus.FAILED
-            upload.error_message = str(exc)
-            db.add(upload)
-            db.commit()
+        for page in db.query(Page).filter(Page.id.in_(list(claimed_ids.values())), Page.status == PageStatus.PROCESSING):
+            page.status = PageStatus.FAILED
+        db.commit()
+        raise
+    finally:
+        heartbeat.stop()
+        db.close()
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def finalize_upload(upload_id: str, page_ids: List[str], token: Optional[str] = None):
+    # Runs after every page job of a fanned-out upload has ended: pages that
+    # no job finished are marked FAILED, then metadata and status are written
+    # as process_upload() would, and the upload lock is released.
+    if token and not recovery.refresh(upload_id, token):
+        return
+    db = SessionLocal()
+    reporter: Optional[ProgressReporter] = None
+    ids = [uuid.UUID(page_id) for page_id in page_ids]
+    heartbeat = recovery.Heartbeat(upload_id, token).start()
+    try:
+        upload = db.query(Upload).filter(Upload.id == upload_id).one()
+        if upload.status == UploadStatus.FAILED:
+            return
+        reporter = ProgressReporter.resume(upload_id, STEPS)
+        results: List[TransferResult] = []
+        transfer_seconds = 0.0
+        for dependency in get_current_job().fetch_dependencies():
+            outcome = dependency.return_value()
+            if outcome:
+                results.extend(outcome[0])
+                transfer_seconds += outcome[1]
+        ready = 0
+        for page in db.query(Page).filter(Page.id.in_(ids)):
+            if page.status == PageStatus.PROCESSING:
+                page.status = PageStatus.FAILED
+            ready += page.status == PageStatus.READY
+        _finish_upload(db, upload, reporter, ready, _transfer_summary(results, transfer_seconds))
+    except Exception as exc:  # noqa: BLE001
+        _fail_upload(db, upload_id, ids, reporter, exc)
     finally:
+        heartbeat.stop()
         db.close()
+        if token:
+            recovery.release(upload_id, token)
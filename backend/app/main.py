@@ -1,30 +1,52 @@
 import json
+import math
 import os
 import re
+import time
 import uuid
-from fastapi import Depends, FastAPI, File, HTTPException, UploadFile
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+from botocore.exceptions import ClientError
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 import redis
 from rq import Queue
 from .config import settings
 from .db import get_db
-from .jobs import process_upload
+from .encoding import content_type_for
+from .ingest import UploadRejected, receive_file
+from .jobs import build_process_options, find_processed_upload, insert_pages, process_upload, reuse_processed_upload
 from .models import Calibration, Page, Project, Upload, UploadStatus
+from .processor import pipeline_fingerprint
+from . import events, resumable, routing
 from .rate_limit import UploadRateLimitMiddleware
 from .schemas import (
     CalibrationIn,
     CalibrationOut,
     HealthOut,
     PageSelection,
+    PageSelectionOut,
     ProjectCreate,
     ProjectOut,
+    ResumableUploadIn,
+    ResumableUploadOut,
+    PresignedPart,
     UploadCreateResponse,
+    UploadFinalizeIn,
     UploadOut,
+    UploadPresignIn,
+    UploadPresignOut,
 )
 from .storage import storage_client
+from .tiles import TILE_FORMATS, max_level, tile_grid
+
+# Tile pyramid objects are written once per page and never change.
+IMMUTABLE_CACHE_HEADERS = {"Cache-Control": "public, max-age=31536000, immutable"}
 
 ALLOWED_MIME_TYPES = {
     "application/pdf",
@@ -40,11 +62,11 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"] ,
     allow_headers=["*"],
+    expose_headers=["Upload-Offset", "Upload-Length"],
 )
 app.add_middleware(UploadRateLimitMiddleware)
 
 redis_conn = redis.Redis.from_url(settings.redis_url)
-queue = Queue("uploads", connection=redis_conn)
 
 
 def _sanitize_filename(filename: str) -> str:
@@ -69,39 +91,316 @@ async def create_project(payload: ProjectCreate, db: Session = Depends(get_db)):
 
 
 @app.post("/api/projects/{project_id}/uploads", response_model=UploadCreateResponse)
-async def upload_blueprint(project_id: str, file: UploadFile = File(...), db: Session = Depends(get_db)):
-    if file.content_type not in ALLOWED_MIME_TYPES:
-        raise HTTPException(status_code=400, detail="Unsupported file type")
+async def upload_blueprint(project_id: str, request: Request, db: Session = Depends(get_db)):
+    # The body is streamed into storage under a fresh key while it is hashed;
+    # the original is only matched against earlier uploads once it is complete.
+    upload_id = uuid.uuid4()
+    try:
+        received = await receive_file(
+            request,
+            "file",
+            settings.upload_max_bytes,
+            ALLOWED_MIME_TYPES,
+            lambda name: f"projects/{project_id}/uploads/{upload_id}/original/{_sanitize_filename(name)}",
+        )
+    except UploadRejected as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail)
+    content_sha256 = received.sha256
+    fingerprint = pipeline_fingerprint(build_process_options())
+    filename = _sanitize_filename(received.filename or "upload")
+
+    processed = find_processed_upload(db, content_sha256, received.content_type, fingerprint)
+    existing_original = processed or (
+        db.query(Upload)
+        .filter(Upload.content_sha256 == content_sha256, Upload.mime_type == received.content_type)
+        .order_by(Upload.created_at.desc())
+        .first()
+    )
+    storage_key_original = received.key
+    if existing_original:
+        storage_client.delete(received.key)
+        storage_key_original = existing_original.storage_key_original
 
-    contents = await file.read()
-    if len(contents) > settings.upload_max_bytes:
-        raise HTTPException(status_code=400, detail="File too large")
+    upload = Upload(
+        id=upload_id,
+        project_id=project_id,
+        original_filename=filename,
+        mime_type=received.content_type,
+        size_bytes=received.size_bytes,
+        storage_key_original=storage_key_original,
+        content_sha256=content_sha256,
+        pipeline_fingerprint=fingerprint,
+        status=UploadStatus.UPLOADED,
+        progress=_initial_progress(received.content_type),
+    )
 
-    filename = _sanitize_filename(file.filename or "upload")
-    upload_id = uuid.uuid4()
-    storage_key_original = f"projects/{project_id}/uploads/{upload_id}/original/{filename}"
+    if processed:
+        reuse_processed_upload(db, processed, upload)
+        db.commit()
+        return UploadCreateResponse(uploadId=str(upload_id), status=upload.status)
+
+    db.add(upload)
+    await run_in_threadpool(_enqueue_processing, db, upload)
+    return UploadCreateResponse(uploadId=str(upload_id), status=upload.status)
 
-    storage_client.upload_bytes(storage_key_original, contents, file.content_type)
 
-    progress = {"steps": ["queued"], "current": "queued"}
-    if file.content_type == "application/pdf":
-        progress["selectedPages"] = [1]
+def _pending_upload_key(upload_id: str) -> str:
+    return f"upload_pending:{upload_id}"
 
+
+# Direct-to-storage uploads: presign hands out URLs for the same object key
+# upload_blueprint would write, and finalize checks the object and creates the
+# Upload row. The pending state lives in Redis until then; multipart uploads
+# never finalized are left to the bucket's incomplete-upload lifecycle rule.
+@app.post("/api/projects/{project_id}/uploads/presign", response_model=UploadPresignOut)
+async def presign_upload(project_id: str, payload: UploadPresignIn, db: Session = Depends(get_db)):
+    if not db.query(Project.id).filter(Project.id == project_id).one_or_none():
+        raise HTTPException(status_code=404, detail="Project not found")
+    if payload.contentType not in ALLOWED_MIME_TYPES:
+        raise HTTPException(status_code=400, detail="Unsupported file type")
+    if payload.sizeBytes > settings.upload_max_bytes:
+        raise HTTPException(status_code=400, detail="File too large")
+
+    upload_id = str(uuid.uuid4())
+    filename = _sanitize_filename(payload.filename)
+    storage_key = f"projects/{project_id}/uploads/{upload_id}/original/{filename}"
+    expires = settings.upload_presign_expiry_seconds
+    response = UploadPresignOut(uploadId=upload_id, storageKey=storage_key, expiresIn=expires)
+    pending = {
+        "projectId": project_id,
+        "filename": filename,
+        "mimeType": payload.contentType,
+        "sizeBytes": payload.sizeBytes,
+        "storageKey": storage_key,
+    }
+    if payload.sizeBytes > settings.upload_presign_multipart_mb * 1024 * 1024:
+        # S3 allows at most 10000 parts per upload.
+        part_size = max(settings.upload_part_size_mb * 1024 * 1024, math.ceil(payload.sizeBytes / 10000))
+        multipart_id = storage_client.create_multipart(storage_key, payload.contentType)
+        pending["multipartId"] = multipart_id
+        response.partSize = part_size
+        response.parts = [
+            PresignedPart(partNumber=number, url=storage_client.presign_part(storage_key, multipart_id, number, expires))
+            for number in range(1, math.ceil(payload.sizeBytes / part_size) + 1)
+        ]
+    else:
+        response.url = storage_client.presign_put(storage_key, payload.contentType, expires)
+        response.headers = {"Content-Type": payload.contentType}
+    redis_conn.setex(_pending_upload_key(upload_id), expires, json.dumps(pending))
+    return response
+
+
+@app.post("/api/uploads/{upload_id}/finalize", response_model=UploadCreateResponse)
+async def finalize_upload(upload_id: str, payload: UploadFinalizeIn, db: Session = Depends(get_db)):
+    existing = db.query(Upload).filter(Upload.id == upload_id).one_or_none()
+    if existing:
+        return UploadCreateResponse(uploadId=str(existing.id), status=existing.status)
+    raw = redis_conn.get(_pending_upload_key(upload_id))
+    if not raw:
+        raise HTTPException(status_code=404, detail="Upload not found or expired")
+    pending = json.loads(raw)
+    storage_key = pending["storageKey"]
+
+    head = storage_client.head(storage_key)
+    if head is None and pending.get("multipartId"):
+        if not payload.parts:
+            raise HTTPException(status_code=400, detail="Uploaded parts are required")
+        parts = [
+            {"PartNumber": part.partNumber, "ETag": part.etag}
+            for part in sorted(payload.parts, key=lambda part: part.partNumber)
+        ]
+        try:
+            storage_client.complete_multipart(storage_key, pending["multipartId"], parts)
+        except ClientError:
+            raise HTTPException(status_code=400, detail="Could not complete multipart upload")
+        head = storage_client.head(storage_key)
+    if head is None:
+        raise HTTPException(status_code=400, detail="File has not been uploaded")
+    if (
+        head["ContentLength"] != pending["sizeBytes"]
+        or head["ContentLength"] > settings.upload_max_bytes
+        or head.get("ContentType") != pending["mimeType"]
+    ):
+        storage_client.delete(storage_key)
+        redis_conn.delete(_pending_upload_key(upload_id))
+        raise HTTPException(status_code=400, detail="Uploaded file does not match the presigned upload")
+
+    upload = await run_in_threadpool(
+        _create_stored_upload,
+        db,
+        upload_id,
+        pending["projectId"],
+        pending["filename"],
+        pending["mimeType"],
+        head["ContentLength"],
+        storage_key,
+    )
+    redis_conn.delete(_pending_upload_key(upload_id))
+    return UploadCreateResponse(uploadId=upload_id, status=upload.status)
+
+
+def _create_stored_upload(
+    db: Session, upload_id: str, project_id: str, filename: str, mime_type: str, size_bytes: int, storage_key: str
+) -> Upload:
+    # For originals written to storage without passing through the API. The
+    # content hash is not known here; the worker records it when it fetches
+    # the original, and reuses an earlier identical upload from there.
     upload = Upload(
-        id=upload_id,
+        id=uuid.UUID(upload_id),
         project_id=project_id,
         original_filename=filename,
-        mime_type=file.content_type,
-        size_bytes=len(contents),
-        storage_key_original=storage_key_original,
+        mime_type=mime_type,
+        size_bytes=size_bytes,
+        storage_key_original=storage_key,
+        pipeline_fingerprint=pipeline_fingerprint(build_process_options()),
         status=UploadStatus.UPLOADED,
-        progress=progress,
+        progress=_initial_progress(mime_type),
     )
     db.add(upload)
+    _enqueue_processing(db, upload)
+    return upload
+
+
+# Resumable uploads: the client declares the file, then PATCHes bytes from
+# the current offset. Every complete part_size slice is stored as a part of
+# an S3 multipart upload before the offset moves past it, so after a dropped
+# connection HEAD reports where to continue. Sessions not completed within
+# UPLOAD_SESSION_TTL_SECONDS of their last write are aborted by a GC job.
+@app.post("/api/projects/{project_id}/uploads/resumable", response_model=ResumableUploadOut)
+async def create_resumable_upload(project_id: str, payload: ResumableUploadIn, db: Session = Depends(get_db)):
+    if not db.query(Project.id).filter(Project.id == project_id).one_or_none():
+        raise HTTPException(status_code=404, detail="Project not found")
+    if payload.contentType not in ALLOWED_MIME_TYPES:
+        raise HTTPException(status_code=400, detail="Unsupported file type")
+    if payload.sizeBytes > settings.upload_max_bytes:
+        raise HTTPException(status_code=400, detail="File too large")
+
+    upload_id = str(uuid.uuid4())
+    filename = _sanitize_filename(payload.filename)
+    storage_key = f"projects/{project_id}/uploads/{upload_id}/original/{filename}"
+    session = resumable.create_session(
+        project_id, upload_id, filename, payload.contentType, payload.sizeBytes, storage_key
+    )
+    if resumable.gc_due():
+        # Cheap housekeeping, so it goes to the small-jobs lane.
+        Queue(routing.LANES[0][1], connection=redis_conn).enqueue(resumable.collect_expired_sessions)
+    return _session_out(session)
+
+
+def _session_out(session: resumable.UploadSession, status: Optional[UploadStatus] = None) -> ResumableUploadOut:
+    return ResumableUploadOut(
+        uploadId=session.upload_id,
+        offset=session.offset,
+        sizeBytes=session.size_bytes,
+        chunkSize=session.part_size,
+        expiresAt=datetime.fromtimestamp(session.expires_at, tz=timezone.utc),
+        status=status,
+    )
+
+
+@app.head("/api/uploads/{upload_id}/resumable")
+async def get_resumable_offset(upload_id: str, db: Session = Depends(get_db)):
+    session = resumable.load_session(upload_id)
+    if session:
+        offset, length = session.offset, session.size_bytes
+    else:
+        upload = db.query(Upload).filter(Upload.id == upload_id).one_or_none()
+        if not upload:
+            raise HTTPException(status_code=404, detail="Upload not found or expired")
+        offset = length = upload.size_bytes
+    return Response(
+        status_code=200,
+        headers={"Upload-Offset": str(offset), "Upload-Length": str(length), "Cache-Control": "no-store"},
+    )
+
+
+@app.patch("/api/uploads/{upload_id}/resumable", response_model=ResumableUploadOut)
+async def append_resumable_upload(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset"),
+    db: Session = Depends(get_db),
+):
+    session = resumable.load_session(upload_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Upload not found or expired")
+    token = resumable.acquire(upload_id)
+    if not token:
+        raise HTTPException(status_code=409, detail="Upload is being written by another request")
+    try:
+        # Re-read under the lock; the offset may have moved since.
+        session = resumable.load_session(upload_id)
+        if upload_offset != session.offset:
+            raise HTTPException(
+                status_code=409,
+                detail="Upload-Offset does not match the stored offset",
+                headers={"Upload-Offset": str(session.offset)},
+            )
+        buffer = bytearray()
+        refreshed_at = time.monotonic()
+        try:
+            async for chunk in request.stream():
+                buffer += chunk
+                if session.offset + len(buffer) > session.size_bytes:
+                    raise HTTPException(status_code=400, detail="Data exceeds the declared upload length")
+                while len(buffer) >= session.part_size:
+                    await run_in_threadpool(resumable.store_part, session, token, bytes(buffer[: session.part_size]))
+                    del buffer[: session.part_size]
+                    refreshed_at = time.monotonic()
+                # A slow client may take longer than the lock TTL to send one part.
+                if time.monotonic() - refreshed_at > settings.upload_session_lock_seconds / 3:
+                    if not resumable.refresh(upload_id, token):
+                        raise resumable.LockLost(upload_id)
+                    refreshed_at = time.monotonic()
+            # A trailing partial part is only stored when it ends the file; a
+            # shorter remainder has to be sent again.
+            if buffer and session.offset + len(buffer) == session.size_bytes:
+                await run_in_threadpool(resumable.store_part, session, token, bytes(buffer))
+        except ClientDisconnect:
+            # Parts stored so far are kept; the client resumes from HEAD.
+            return _session_out(session)
+        except resumable.LockLost:
+            # Another request may own the session now; the client asks HEAD.
+            raise HTTPException(status_code=409, detail="Upload lock was lost; resume from the stored offset")
+        if not session.complete:
+            return _session_out(session)
+
+        await run_in_threadpool(resumable.finish_session, session)
+        upload = db.query(Upload).filter(Upload.id == upload_id).one_or_none()
+        if not upload:
+            upload = await run_in_threadpool(
+                _create_stored_upload,
+                db,
+                upload_id,
+                session.project_id,
+                session.filename,
+                session.mime_type,
+                session.size_bytes,
+                session.storage_key,
+            )
+        resumable.delete_session(upload_id)
+        return _session_out(session, upload.status)
+    finally:
+        resumable.release(upload_id, token)
+
+
+def _enqueue_processing(db: Session, upload: Upload, page_numbers: Optional[list] = None) -> None:
+    # Routes the job to a lane by its estimated cost; the estimate is kept in
+    # progress["cost"], where the worker adds the actual cost when it is done.
+    # Estimating may probe the original in storage, so endpoints call this
+    # (and _create_stored_upload) through run_in_threadpool.
+    cost = routing.estimate_upload(upload, page_numbers)
+    upload.progress = {**(upload.progress or {}), "cost": cost.as_progress()}
     db.commit()
+    args = (str(upload.id),) if page_numbers is None else (str(upload.id), page_numbers)
+    routing.enqueue(redis_conn, cost, str(upload.project_id), process_upload, *args)
 
-    queue.enqueue(process_upload, str(upload_id))
-    return UploadCreateResponse(uploadId=str(upload_id), status=upload.status)
+
+def _initial_progress(mime_type: str) -> dict:
+    progress = {"steps": ["queued"], "current": "queued"}
+    if mime_type == "application/pdf":
+        progress["selectedPages"] = [1]
+    return progress
 
 
 @app.get("/api/uploads/{upload_id}", response_model=UploadOut)
@@ -111,22 +410,67 @@ async def get_upload(upload_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Upload not found")
     pages = db.query(Page).filter(Page.upload_id == upload_id).order_by(Page.page_number.asc()).all()
     upload.pages = pages
+    # While a job runs, its progress lives in Redis; Postgres has the last terminal state.
+    live = events.snapshot(upload_id) if upload.status in (UploadStatus.UPLOADED, UploadStatus.PROCESSING) else None
+    if live:
+        upload.progress = {**(upload.progress or {}), **live}
     return upload
 
 
-@app.post("/api/uploads/{upload_id}/select-pages")
+@app.get("/api/uploads/{upload_id}/events")
+async def stream_upload_events(
+    upload_id: str,
+    request: Request,
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+    db: Session = Depends(get_db),
+):
+    upload = db.query(Upload).filter(Upload.id == upload_id).one_or_none()
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    status = upload.status.value
+    # The stream can stay open for minutes; don't hold a DB connection for it.
+    db.close()
+    return StreamingResponse(
+        events.follow(upload_id, status, last_event_id or "0", request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/api/uploads/{upload_id}/select-pages", response_model=PageSelectionOut)
 async def select_pages(upload_id: str, payload: PageSelection, db: Session = Depends(get_db)):
     upload = db.query(Upload).filter(Upload.id == upload_id).one_or_none()
     if not upload:
         raise HTTPException(status_code=404, detail="Upload not found")
     if upload.mime_type != "application/pdf":
-        return {"status": "ignored"}
-    progress = upload.progress or {}
-    progress["selectedPages"] = payload.activePageNumbers
+        return PageSelectionOut(status="ignored")
+    selected = sorted({number for number in payload.activePageNumbers if number >= 1})
+    progress = dict(upload.progress or {})
+    progress["selectedPages"] = selected
     upload.progress = progress
     db.add(upload)
+
+    # Pages are tracked per row: deselected pages are dropped, new ones are
+    # queued as PENDING and only those are rendered; processed pages are kept.
+    pages = {page.page_number: page for page in db.query(Page).filter(Page.upload_id == upload.id)}
+    removed = sorted(set(pages) - set(selected))
+    removed_ids = [pages[number].id for number in removed]
+    if removed_ids:
+        db.query(Calibration).filter(Calibration.page_id.in_(removed_ids)).delete(synchronize_session=False)
+        # Later pages may have been derived from these; their blobs stay in storage.
+        db.query(Page).filter(Page.derived_from_page_id.in_(removed_ids)).update(
+            {Page.derived_from_page_id: None}, synchronize_session=False
+        )
+        db.query(Page).filter(Page.id.in_(removed_ids)).delete(synchronize_session=False)
+    # A running claim may have created some of these rows meanwhile; only
+    # the ones inserted here are new.
+    added = insert_pages(db, upload.id, [number for number in selected if number not in pages])
     db.commit()
-    return {"status": "saved"}
+
+    # An upload whose first job has not started yet picks the selection up from progress.
+    if added and upload.status != UploadStatus.UPLOADED:
+        await run_in_threadpool(_enqueue_processing, db, upload, added)
+    return PageSelectionOut(status="saved", addedPages=added, removedPages=removed)
 
 
 @app.get("/api/pages/{page_id}/image")
@@ -134,15 +478,66 @@ async def get_page_image(page_id: str, db: Session = Depends(get_db)):
     page = db.query(Page).filter(Page.id == page_id).one_or_none()
     if not page:
         raise HTTPException(status_code=404, detail="Page not found")
-    return StreamingResponse(storage_client.get_stream(page.storage_key_page_png), media_type="image/png")
+    if not page.storage_key_page_png:
+        raise HTTPException(status_code=404, detail="Page not processed yet")
+    media_type = content_type_for(page.storage_key_page_png, "image/png")
+    return StreamingResponse(storage_client.get_stream(page.storage_key_page_png), media_type=media_type)
+
+
+def _page_tiles(page_id: str, db: Session) -> Tuple[Page, dict]:
+    page = db.query(Page).filter(Page.id == page_id).one_or_none()
+    if not page:
+        raise HTTPException(status_code=404, detail="Page not found")
+    tiles = (page.metrics or {}).get("tiles")
+    if not tiles:
+        raise HTTPException(status_code=404, detail="Page has no tile pyramid")
+    return page, tiles
+
+
+# Paths mirror the DeepZoom convention, so a viewer pointed at image.dzi
+# requests tiles from image_files/{level}/{col}_{row}.{format}.
+@app.get("/api/pages/{page_id}/image.dzi")
+async def get_page_dzi(page_id: str, db: Session = Depends(get_db)):
+    _, tiles = _page_tiles(page_id, db)
+    return StreamingResponse(
+        storage_client.get_stream(tiles["dziKey"]), media_type="application/xml", headers=IMMUTABLE_CACHE_HEADERS
+    )
+
+
+@app.get("/api/pages/{page_id}/image_files/{level}/{tile_name}")
+async def get_page_tile(page_id: str, level: int, tile_name: str, db: Session = Depends(get_db)):
+    page, tiles = _page_tiles(page_id, db)
+    match = re.fullmatch(r"(\d+)_(\d+)\.(\w+)", tile_name)
+    if not match or match.group(3) != tiles["format"] or not 0 <= level <= max_level(page.width_px, page.height_px):
+        raise HTTPException(status_code=404, detail="Tile not found")
+    col, row = int(match.group(1)), int(match.group(2))
+    cols, rows = tile_grid(page.width_px, page.height_px, level, tiles["tileSize"])
+    if col >= cols or row >= rows:
+        raise HTTPException(status_code=404, detail="Tile not found")
+    key = f"{tiles['dziKey'][:-len('.dzi')]}_files/{level}/{tile_name}"
+    return StreamingResponse(
+        storage_client.get_stream(key), media_type=TILE_FORMATS[tiles["format"]], headers=IMMUTABLE_CACHE_HEADERS
+    )
+
+
+def _thumb_key(page: Page, size: Optional[int]) -> str:
+    # Smallest stored thumbnail at least `size` px, else the largest one.
+    thumbnails = (page.metrics or {}).get("thumbnails") or {}
+    if size is None or not thumbnails:
+        return page.storage_key_page_thumb
+    sizes = sorted(int(s) for s in thumbnails)
+    fitting = [s for s in sizes if s >= size]
+    return thumbnails[str(fitting[0] if fitting else sizes[-1])]
 
 
 @app.get("/api/pages/{page_id}/thumb")
-async def get_page_thumb(page_id: str, db: Session = Depends(get_db)):
+async def get_page_thumb(page_id: str, size: Optional[int] = Query(None, gt=0), db: Session = Depends(get_db)):
     page = db.query(Page).filter(Page.id == page_id).one_or_none()
     if not page:
         raise HTTPException(status_code=404, detail="Page not found")
-    return StreamingResponse(storage_client.get_stream(page.storage_key_page_thumb), media_type="image/jpeg")
+    if not page.storage_key_page_thumb:
+        raise HTTPException(status_code=404, detail="Page not processed yet")
+    return StreamingResponse(storage_client.get_stream(_thumb_key(page, size)), media_type="image/jpeg")
 
 
 @app.post("/api/pages/{page_id}/calibration", response_model=CalibrationOut)
@@ -0,0 +1,71 @@
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+import redis
+from .config import settings
+
+# Reservations against a node's memory budget: a sorted set per node whose
+# members are "token:bytes", scored by the time they lapse, so a worker that
+# dies cannot hold its share for longer than memory_reservation_ttl_seconds.
+BUDGET_KEY = "memory_budget:{}"
+
+_RESERVE = """
+local key, member = KEYS[1], ARGV[1]
+local wanted, budget, now, lapses = tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5])
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now)
+local used = 0
+for _, held in ipairs(redis.call('ZRANGE', key, 0, -1)) do
+  used = used + tonumber(string.match(held, ':(%d+)$'))
+end
+-- Something larger than the whole budget still runs, alone.
+if used > 0 and used + wanted > budget then
+  return 0
+end
+redis.call('ZADD', key, lapses, member)
+return 1
+"""
+
+redis_conn = redis.Redis.from_url(settings.redis_url, decode_responses=True)
+
+
+class MemoryAdmissionTimeout(Exception):
+    pass
+
+
+def node_name() -> str:
+    return settings.node_name or socket.gethostname()
+
+
+@contextmanager
+def reserve(nbytes: int, on_wait: Optional[Callable[[], None]] = None) -> Iterator[None]:
+    # Blocks until nbytes fit under this node's budget next to the work other
+    # worker processes on the node have admitted; on_wait is called once if
+    # that means waiting. No-op without a budget.
+    budget = settings.node_memory_budget_mb * 1024 * 1024
+    if not budget or nbytes <= 0:
+        yield
+        return
+    key = BUDGET_KEY.format(node_name())
+    member = f"{uuid.uuid4().hex}:{int(nbytes)}"
+    script = redis_conn.register_script(_RESERVE)
+    give_up = time.time() + settings.memory_admission_wait_seconds
+    waited = False
+    while True:
+        now = time.time()
+        if script(keys=[key], args=[member, int(nbytes), budget, now, now + settings.memory_reservation_ttl_seconds]):
+            break
+        if now > give_up:
+            raise MemoryAdmissionTimeout(
+                f"{nbytes // (1024 * 1024)} MiB did not fit in the memory budget of {node_name()} "
+                f"within {settings.memory_admission_wait_seconds} s"
+            )
+        if on_wait and not waited:
+            on_wait()
+            waited = True
+        time.sleep(1)
+    try:
+        yield
+    finally:
+        redis_conn.zrem(key, member)
@@ -21,6 +21,8 @@ class UploadStatus(str, PyEnum):
 
 
 class PageStatus(str, PyEnum):
+    PENDING = "PENDING"
+    PROCESSING = "PROCESSING"
     READY = "READY"
     FAILED = "FAILED"
 
@@ -54,6 +56,8 @@ class Upload(Base):
     mime_type = Column(String, nullable=False)
     size_bytes = Column(Integer, nullable=False)
     storage_key_original = Column(String, nullable=False)
+    content_sha256 = Column(String(64), nullable=True, index=True)
+    pipeline_fingerprint = Column(String, nullable=True)
     status = Column(Enum(UploadStatus), nullable=False)
     error_message = Column(String, nullable=True)
     warnings = Column(JSON, nullable=True)
@@ -66,17 +70,22 @@ class Upload(Base):
 
 class Page(Base):
     __tablename__ = "pages"
+    __table_args__ = (UniqueConstraint("upload_id", "page_number", name="uniq_page_upload_number"),)
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     upload_id = Column(UUID(as_uuid=True), ForeignKey("uploads.id"), nullable=False)
     page_number = Column(Integer, nullable=False)
-    width_px = Column(Integer, nullable=False)
-    height_px = Column(Integer, nullable=False)
+    # Unset until the page has been processed.
+    width_px = Column(Integer, nullable=True)
+    height_px = Column(Integer, nullable=True)
     dpi_estimated = Column(Integer, nullable=True)
-    storage_key_page_png = Column(String, nullable=False)
+    storage_key_page_png = Column(String, nullable=True)
     storage_key_page_thumb = Column(String, nullable=True)
     status = Column(Enum(PageStatus), nullable=False)
     warnings = Column(JSON, nullable=True)
+    metrics = Column(JSON, nullable=True)
+    fingerprint = Column(String, nullable=True)
+    derived_from_page_id = Column(UUID(as_uuid=True), ForeignKey("pages.id"), nullable=True)
 
     upload = relationship("Upload", back_populates="pages")
     calibration = relationship("Calibration", back_populates="page", uselist=False)
@@ -1,12 +1,24 @@
+import hashlib
 import io
+import json
 import math
+import multiprocessing
+import os
+import re
+import resource
 import tempfile
-from dataclasses import dataclass
-from typing import Dict, List, Optional
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
 import cv2
 import numpy as np
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 from PIL import Image
+from . import tiling
+from .encoding import MONO_SAMPLE_PIXELS, encode_page, get_profile, sample_is_monochrome
+from .quality import PageQuality, analyze_page
+from .tiles import TilePyramid, build_pyramid
 
 
 @dataclass
@@ -18,6 +30,11 @@ class ProcessedPage:
     warnings: List[str]
     png_path: str
     thumb_path: str
+    content_type: str = "image/png"
+    metrics: Dict = field(default_factory=dict)
+    # Thumbnail JPEG per requested size; thumb_path is the largest of them.
+    thumb_paths: Dict[int, str] = field(default_factory=dict)
+    tiles: Optional[TilePyramid] = None
 
 
 @dataclass
@@ -26,66 +43,209 @@ class ProcessedUpload:
     pages: List[ProcessedPage]
 
 
+@dataclass
+class ProcessOptions:
+    # workers > 1 fans PDF pages out across a process pool; each child rasterizes
+    # and enhances its own page, so only the small ProcessedPage result is pickled.
+    workers: int = 1
+    # Threads OpenCV may use per process; 0 keeps the OpenCV default.
+    cv_threads: int = 0
+    render_window: int = 1
+    # Name of an encoding.OUTPUT_PROFILES entry used for the page image.
+    output_profile: str = "fast"
+    # Pages whose estimated in-memory footprint exceeds this many bytes are
+    # rendered to disk and processed in bands; 0 disables tiled processing.
+    page_memory_limit_bytes: int = 0
+    # Where tiled pages keep their full-size intermediates. With scratch_memmap
+    # they are numpy.memmap files (default: the job temp dir), otherwise RAM.
+    scratch_dir: Optional[str] = None
+    scratch_memmap: bool = True
+    # Longest side of each thumbnail written per page.
+    thumbnail_sizes: Tuple[int, ...] = (512,)
+    # DeepZoom tile pyramid written next to the page image; 0 disables it.
+    tile_size: int = 0
+    tile_overlap: int = 1
+    tile_format: str = "jpg"
+
+
+# Bump whenever a pipeline change alters the pages produced for the same input,
+# so previously processed uploads are no longer reused for identical originals.
+PIPELINE_VERSION = 2
 BLUR_THRESHOLD = 120.0
 MIN_SHORT_SIDE = 1800
+PDF_DPI = 350
+# Pixel budget of the pyramid level used to estimate the skew angle, and of
+# the bands in which the orientation is decided at full resolution.
+ANGLE_PROXY_PIXELS = 2_000_000
+# Approximate peak bytes per pixel of the in-memory pipeline on an RGB page:
+# PIL raster, numpy copy, warp output, LAB planes/merge and the float Laplacian.
+IN_MEMORY_BYTES_PER_PIXEL = 24
+# Interpreter, OpenCV and NumPy before any page is loaded.
+PROCESS_BASE_BYTES = 300 * 1024 * 1024
+THUMBNAIL_JPEG_QUALITY = 85
+# Perceptual page fingerprints: a FINGERPRINT_GRID x FINGERPRINT_GRID difference
+# hash of a low resolution render. Neighbor differences within
+# FINGERPRINT_MARGIN gray levels count as flat, so blank paper hashes stably.
+FINGERPRINT_DPI = 36
+FINGERPRINT_GRID = 64
+FINGERPRINT_MARGIN = 2
+# Image uploads have no render DPI; they are reduced to this longest side instead.
+FINGERPRINT_IMAGE_SIDE = 1024
 
 
-def _deskew(image: np.ndarray) -> np.ndarray:
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    gray = cv2.bitwise_not(gray)
-    thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
-    coords = np.column_stack(np.where(thresh > 0))
-    if coords.size == 0:
-        return image
-    angle = cv2.minAreaRect(coords)[-1]
+def pipeline_fingerprint(options: ProcessOptions) -> str:
+    # Only options that change the produced pages. Workers, thread counts and
+    # memory limits do not: the parallel and tiled paths give identical output.
+    params = {
+        "version": PIPELINE_VERSION,
+        "pdfDpi": PDF_DPI,
+        "outputProfile": options.output_profile,
+        "thumbnailSizes": sorted(set(options.thumbnail_sizes)),
+        "tileSize": options.tile_size,
+        "tileOverlap": options.tile_overlap,
+        "tileFormat": options.tile_format,
+    }
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _proxy_factor(height: int, width: int) -> int:
+    return max(1, math.ceil(math.sqrt(height * width / ANGLE_PROXY_PIXELS)))
+
+
+def _pyramid_proxy(gray: np.ndarray, rows: int) -> np.ndarray:
+    # Integer box decimation, computed the same way whether the page is held in
+    # memory or streamed in bands, so both paths estimate identical angles.
+    height, width = gray.shape[:2]
+    return tiling.reduce_bands(gray, _proxy_factor(height, width), rows)
+
+
+def _min_area_angle(points: Optional[np.ndarray]) -> Optional[float]:
+    if points is None or points.size == 0:
+        return None
+    angle = cv2.minAreaRect(points)[-1]
     if angle < -45:
-        angle = -(90 + angle)
-    else:
-        angle = -angle
-    (h, w) = image.shape[:2]
-    center = (w // 2, h // 2)
-    m = cv2.getRotationMatrix2D(center, angle, 1.0)
-    rotated = cv2.warpAffine(image, m, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
-    return rotated
+        return -(90 + angle)
+    return -angle
+
+
+def _skew_angle(proxy: np.ndarray) -> float:
+    # minAreaRect angles are scale invariant, so the skew is estimated on a
+    # bounded pyramid level and only the final warp touches the full page.
+    inverted = cv2.bitwise_not(proxy)
+    thresh = cv2.threshold(inverted, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
+    angle = _min_area_angle(np.column_stack(np.where(thresh > 0)))
+    return 0.0 if angle is None else angle
+
+
+def _orientation(gray: np.ndarray, angle: float, rows: int) -> int:
+    # The quarter-turn snap is not scale invariant: on a deskewed page the
+    # edge rectangle sits near 0 or 90 degrees, and which one minAreaRect
+    # reports depends on single edge pixels. It is therefore decided on the
+    # full-resolution deskewed page, as before, streamed in bands. This pass
+    # (a cubic warp and Canny of the whole page) costs about as much as the
+    # legacy estimate did: the proxy bounds memory, not time.
+    (h, w) = gray.shape[:2]
+    m = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+    hull = tiling.edge_hull_bands(gray, m, (w, h), rows, (50, 150))
+    snapped = _min_area_angle(hull)
+    if snapped is None:
+        return 0
+    return (round(snapped / 90) * 90) % 360
+
+
+def _estimate_transform(gray: np.ndarray, rows: Optional[int] = None) -> Tuple[float, int]:
+    # rows bounds the band height for pages streamed from Scratch; the result
+    # does not depend on it, so pages in memory use ANGLE_PROXY_PIXELS bands.
+    rows = rows or max(tiling.MIN_BAND_ROWS, ANGLE_PROXY_PIXELS // gray.shape[1])
+    angle = _skew_angle(_pyramid_proxy(gray, rows))
+    return angle, _orientation(gray, angle, rows)
+
+
+_ROTATE_CODES = {
+    90: cv2.ROTATE_90_CLOCKWISE,
+    180: cv2.ROTATE_180,
+    270: cv2.ROTATE_90_COUNTERCLOCKWISE,
+}
+
+
+def _snap_matrix(snapped: int, w: int, h: int) -> Tuple[np.ndarray, Tuple[int, int]]:
+    # Homogeneous equivalents of cv2.rotate on a w x h canvas, plus the output size.
+    if snapped == 90:
+        return np.array([[0, -1, h - 1], [1, 0, 0], [0, 0, 1]], dtype=np.float64), (h, w)
+    if snapped == 180:
+        return np.array([[-1, 0, w - 1], [0, -1, h - 1], [0, 0, 1]], dtype=np.float64), (w, h)
+    if snapped == 270:
+        return np.array([[0, 1, 0], [-1, 0, w - 1], [0, 0, 1]], dtype=np.float64), (h, w)
+    return np.eye(3, dtype=np.float64), (w, h)
+
 
+def _fused_matrix(angle: float, snapped: int, w: int, h: int) -> Tuple[np.ndarray, Tuple[int, int]]:
+    skew = np.vstack([cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0), [0, 0, 1]])
+    snap, size = _snap_matrix(snapped, w, h)
+    return (snap @ skew)[:2], size
 
-def _auto_rotate(image: np.ndarray) -> np.ndarray:
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    edges = cv2.Canny(gray, 50, 150)
-    coords = np.column_stack(np.where(edges > 0))
-    if coords.size == 0:
+
+def _to_gray(image: np.ndarray) -> np.ndarray:
+    if image.ndim == 2:
         return image
-    angle = cv2.minAreaRect(coords)[-1]
-    if angle < -45:
-        angle = -(90 + angle)
-    else:
-        angle = -angle
-    snapped = round(angle / 90) * 90
-    if snapped % 360 == 0:
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def _is_monochrome(image: Image.Image) -> bool:
+    factor = max(1, math.ceil(math.sqrt(image.width * image.height / MONO_SAMPLE_PIXELS)))
+    return sample_is_monochrome(np.asarray(image.reduce(factor) if factor > 1 else image))
+
+
+def _open_image(file_path: str) -> Image.Image:
+    image = Image.open(file_path)
+    if image.mode == "L":
+        return image
+    if image.format != "JPEG" or image.mode != "RGB":
+        return image.convert("RGB")
+    # Check for monochrome on a DCT-scaled 1/8 decode; a monochrome JPEG is then
+    # decoded from its luma plane only, skipping color conversion entirely.
+    with Image.open(file_path) as preview:
+        preview.draft("RGB", (preview.width // 8, preview.height // 8))
+        monochrome = _is_monochrome(preview.convert("RGB"))
+    if monochrome:
+        image.draft("L", image.size)
+        image.load()
         return image
-    if snapped % 360 == 90:
-        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
-    if snapped % 360 == 180:
-        return cv2.rotate(image, cv2.ROTATE_180)
-    if snapped % 360 == 270:
-        return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
-    return image
+    return image.convert("RGB")
+
+
+def _load_page(image: Image.Image) -> np.ndarray:
+    # Monochrome sheets stay single channel through the whole pipeline.
+    if image.mode == "L":
+        return np.array(image)
+    if _is_monochrome(image):
+        return np.array(image.convert("L"))
+    return cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+
+
+def _orient_page(image: np.ndarray) -> np.ndarray:
+    # Deskew and the 90 degree orientation snap are composed into one affine
+    # transform, so the page is resampled (and reallocated) at most once.
+    # Deciding the snap warps the gray page once more, band by band.
+    angle, snapped = _estimate_transform(_to_gray(image))
+    if angle == 0:
+        return cv2.rotate(image, _ROTATE_CODES[snapped]) if snapped else image
+    (h, w) = image.shape[:2]
+    m, size = _fused_matrix(angle, snapped, w, h)
+    return cv2.warpAffine(image, m, size, flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
 
 
 def _clahe(image: np.ndarray) -> np.ndarray:
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    if image.ndim == 2:
+        return clahe.apply(image)
     lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
     l, a, b = cv2.split(lab)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
     cl = clahe.apply(l)
     limg = cv2.merge((cl, a, b))
     return cv2.cvtColor(limg, cv2.COLOR_LAB2BGR)
 
 
-def _blur_score(image: np.ndarray) -> float:
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    return cv2.Laplacian(gray, cv2.CV_64F).var()
-
-
 def _estimate_dpi(image: Image.Image) -> Optional[int]:
     dpi = image.info.get("dpi")
     if dpi:
@@ -93,26 +253,293 @@ def _estimate_dpi(image: Image.Image) -> Optional[int]:
     return None
 
 
-def _save_thumbnail(image: Image.Image, path: str) -> None:
-    thumb = image.copy()
-    thumb.thumbnail((512, 512))
-    thumb.save(path, format="JPEG", quality=85)
+def _thumbnail_factor(shape: Tuple[int, ...], sizes: Tuple[int, ...]) -> int:
+    # Integer reduction that keeps the page at least as large as the biggest thumbnail.
+    return max(1, max(shape[:2]) // max(sizes))
 
 
-def process_file(file_path: str, mime_type: str, selected_pages: Optional[List[int]] = None) -> ProcessedUpload:
-    upload_warnings: List[str] = []
-    pages: List[ProcessedPage] = []
-    temp_dir = tempfile.mkdtemp(prefix="processed_")
+def _save_thumbnails(source: np.ndarray, path_stem: str, sizes: Tuple[int, ...]) -> Dict[int, str]:
+    # source is an already reduced pyramid level. Sizes are written largest
+    # first and each one is downscaled from the previous, so the full-size page
+    # is not touched here.
+    paths: Dict[int, str] = {}
+    current = source
+    for size in sorted(set(sizes), reverse=True):
+        height, width = current.shape[:2]
+        scale = size / max(height, width)
+        if scale < 1:
+            target = (max(1, round(width * scale)), max(1, round(height * scale)))
+            current = cv2.resize(current, target, interpolation=cv2.INTER_AREA)
+        path = f"{path_stem}_{size}.jpg"
+        cv2.imwrite(path, current, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_JPEG_QUALITY])
+        paths[size] = path
+    return paths
+
+
+def _read_ppm_header(path: str) -> Tuple[int, int, int, int]:
+    # Returns (width, height, channels, data offset) of a binary P5/P6 file.
+    with open(path, "rb") as handle:
+        head = handle.read(512)
+    tokens: List[bytes] = []
+    offset = 0
+    while len(tokens) < 4:
+        while head[offset:offset + 1].isspace():
+            offset += 1
+        if head[offset:offset + 1] == b"#":
+            offset = head.index(b"\n", offset) + 1
+            continue
+        end = offset
+        while not head[end:end + 1].isspace():
+            end += 1
+        tokens.append(head[offset:end])
+        offset = end
+    magic, width, height, _maxval = tokens
+    channels = 3 if magic == b"P6" else 1
+    return int(width), int(height), channels, offset + 1
+
+
+def _pdf_page_numbers(file_path: str, selected_pages: Optional[List[int]]) -> List[int]:
+    page_count = int(pdfinfo_from_path(file_path)["Pages"])
+    if not selected_pages:
+        return list(range(1, page_count + 1))
+    return sorted({n for n in selected_pages if 1 <= n <= page_count})
+
 
+def document_page_numbers(file_path: str, mime_type: str, selected_pages: Optional[List[int]] = None) -> List[int]:
     if mime_type == "application/pdf":
-        images = convert_from_path(file_path, dpi=350)
-        for idx, pil_image in enumerate(images, start=1):
-            if selected_pages and idx not in selected_pages:
-                continue
-            pages.append(_process_page(pil_image, idx, temp_dir))
+        return _pdf_page_numbers(file_path, selected_pages)
+    return [1]
+
+
+def page_sizes(file_path: str, mime_type: str, page_numbers: List[int]) -> Dict[int, Tuple[int, int]]:
+    # Pixel size each page is processed at (PDF pages at PDF_DPI), from
+    # pdfinfo or the image header; nothing is rendered or decoded.
+    if mime_type != "application/pdf":
+        with Image.open(file_path) as image:
+            return {1: image.size}
+    if not page_numbers:
+        return {}
+    info = pdfinfo_from_path(file_path, first_page=min(page_numbers), last_page=max(page_numbers))
+    points: Dict[int, Tuple[float, float]] = {}
+    for key, value in info.items():
+        match = re.match(r"Page\s+(\d+) size$|Page size$", key)
+        size = re.match(r"([\d.]+) x ([\d.]+) pts", value) if match else None
+        if size is None:
+            continue
+        if match.group(1):
+            points[int(match.group(1))] = (float(size.group(1)), float(size.group(2)))
+        else:
+            # Without per-page lines, every page has the size of the first.
+            points.update({number: (float(size.group(1)), float(size.group(2))) for number in page_numbers})
+    return {
+        number: (math.ceil(width / 72 * PDF_DPI), math.ceil(height / 72 * PDF_DPI))
+        for number, (width, height) in points.items()
+        if number in page_numbers
+    }
+
+
+def page_footprint_bytes(width: int, height: int, options: ProcessOptions) -> int:
+    # Estimated peak memory of one process enhancing this page. Tiled pages
+    # keep band buffers within page_memory_limit_bytes plus the memory-mapped
+    # raster, which still counts against an address-space limit.
+    in_memory = width * height * IN_MEMORY_BYTES_PER_PIXEL
+    if options.page_memory_limit_bytes and in_memory > options.page_memory_limit_bytes:
+        return PROCESS_BASE_BYTES + options.page_memory_limit_bytes + width * height * 3
+    return PROCESS_BASE_BYTES + in_memory
+
+
+def _page_runs(page_numbers: List[int], window: int) -> Iterator[Tuple[int, int]]:
+    start = prev = None
+    for number in page_numbers:
+        if start is not None and number == prev + 1 and number - start < window:
+            prev = number
+            continue
+        if start is not None:
+            yield start, prev
+        start = prev = number
+    if start is not None:
+        yield start, prev
+
+
+def _render_pdf_pages(file_path: str, page_numbers: List[int], window: int) -> Iterator[Tuple[int, Image.Image]]:
+    for first, last in _page_runs(page_numbers, max(1, window)):
+        images = convert_from_path(file_path, dpi=PDF_DPI, first_page=first, last_page=last)
+        page_number = first
+        while images:
+            # Hand pages over one at a time so each raster can be freed as soon as it is processed.
+            yield page_number, images.pop(0)
+            page_number += 1
+
+
+def _fingerprint(gray: np.ndarray) -> str:
+    # "{width}x{height}:{hex}"; the render size is kept so that only sheets of
+    # the same format are compared.
+    small = cv2.resize(gray, (FINGERPRINT_GRID + 1, FINGERPRINT_GRID), interpolation=cv2.INTER_AREA).astype(np.int16)
+    bits = (small[:, 1:] - small[:, :-1]) > FINGERPRINT_MARGIN
+    height, width = gray.shape[:2]
+    return f"{width}x{height}:{np.packbits(bits).tobytes().hex()}"
+
+
+def fingerprint_distance(a: str, b: str) -> Optional[int]:
+    # Hamming distance between two fingerprints, None when they are not comparable.
+    size_a, _, hash_a = a.partition(":")
+    size_b, _, hash_b = b.partition(":")
+    if size_a != size_b or len(hash_a) != len(hash_b):
+        return None
+    return (int(hash_a, 16) ^ int(hash_b, 16)).bit_count()
+
+
+def fingerprint_pages(file_path: str, mime_type: str, selected_pages: Optional[List[int]] = None) -> Dict[int, str]:
+    if mime_type == "application/pdf":
+        fingerprints: Dict[int, str] = {}
+        for first, last in _page_runs(_pdf_page_numbers(file_path, selected_pages), 16):
+            images = convert_from_path(file_path, dpi=FINGERPRINT_DPI, first_page=first, last_page=last, grayscale=True)
+            for offset, image in enumerate(images):
+                fingerprints[first + offset] = _fingerprint(np.asarray(image.convert("L")))
+        return fingerprints
+    with Image.open(file_path) as image:
+        factor = max(1, math.ceil(max(image.size) / FINGERPRINT_IMAGE_SIDE))
+        target = (math.ceil(image.width / factor), math.ceil(image.height / factor))
+        # JPEGs are DCT-scaled while decoding; the final size is fixed either way.
+        image.draft("L", target)
+        gray = np.asarray(image.convert("L"))
+    if gray.shape[1::-1] != target:
+        gray = cv2.resize(gray, target, interpolation=cv2.INTER_AREA)
+    return {1: _fingerprint(gray)}
+
+
+def _init_pool_worker(cv_threads: int) -> None:
+    if cv_threads > 0:
+        cv2.setNumThreads(cv_threads)
+
+
+def _process_pdf_page(file_path: str, page_number: int, temp_dir: str, options: ProcessOptions) -> ProcessedPage:
+    if options.page_memory_limit_bytes:
+        return _process_pdf_page_on_disk(file_path, page_number, temp_dir, options)
+    images = convert_from_path(file_path, dpi=PDF_DPI, first_page=page_number, last_page=page_number)
+    return _process_page(images[0], page_number, temp_dir, options, render_dpi=PDF_DPI)
+
+
+def _process_pdf_page_on_disk(file_path: str, page_number: int, temp_dir: str, options: ProcessOptions) -> ProcessedPage:
+    # pdftoppm writes the raster straight to scratch, so its size is known
+    # before anything is decoded into memory.
+    scratch_dir = options.scratch_dir or temp_dir
+    ppm_path = convert_from_path(
+        file_path,
+        dpi=PDF_DPI,
+        first_page=page_number,
+        last_page=page_number,
+        output_folder=scratch_dir,
+        fmt="ppm",
+        paths_only=True,
+    )[0]
+    try:
+        width, height, channels, offset = _read_ppm_header(ppm_path)
+        if width * height * IN_MEMORY_BYTES_PER_PIXEL <= options.page_memory_limit_bytes:
+            with Image.open(ppm_path) as pil_image:
+                return _process_page(pil_image.convert("RGB"), page_number, temp_dir, options, render_dpi=PDF_DPI)
+        shape = (height, width, channels) if channels == 3 else (height, width)
+        raster = np.memmap(ppm_path, dtype=np.uint8, mode="r", offset=offset, shape=shape)
+        return _process_page_tiled(raster, page_number, temp_dir, options)
+    finally:
+        os.remove(ppm_path)
+
+
+def _iter_parallel(
+    file_path: str, page_numbers: List[int], temp_dir: str, options: ProcessOptions
+) -> Iterator[ProcessedPage]:
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    max_in_flight = options.workers * 2
+    remaining = iter(page_numbers)
+    with ProcessPoolExecutor(
+        max_workers=options.workers,
+        mp_context=context,
+        initializer=_init_pool_worker,
+        initargs=(options.cv_threads,),
+    ) as pool:
+        pending = deque()
+        for page_number in remaining:
+            pending.append(pool.submit(_process_pdf_page, file_path, page_number, temp_dir, options))
+            if len(pending) >= max_in_flight:
+                break
+        while pending:
+            # Results are consumed strictly in submission order, so pages come back in page order.
+            page = pending.popleft().result()
+            next_page = next(remaining, None)
+            if next_page is not None:
+                pending.append(pool.submit(_process_pdf_page, file_path, next_page, temp_dir, options))
+            yield page
+
+
+def _init_isolated_worker(cv_threads: int, limit_bytes: int) -> None:
+    _init_pool_worker(cv_threads)
+    resource.setrlimit(resource.RLIMIT_AS, (limit_bytes, limit_bytes))
+
+
+def _process_file_page(
+    file_path: str, mime_type: str, page_number: int, temp_dir: str, options: ProcessOptions
+) -> ProcessedPage:
+    if mime_type == "application/pdf":
+        return _process_pdf_page(file_path, page_number, temp_dir, options)
+    return _process_page(_open_image(file_path), 1, temp_dir, options)
+
+
+def process_page_isolated(
+    file_path: str, mime_type: str, page_number: int, temp_dir: str, options: ProcessOptions, limit_bytes: int
+) -> ProcessedPage:
+    # Processes one page in a child process whose address space is capped at
+    # limit_bytes, so a page that needs more fails on its own (MemoryError,
+    # or BrokenProcessPool if the child is killed) instead of taking the
+    # worker with it.
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    with ProcessPoolExecutor(
+        max_workers=1,
+        mp_context=context,
+        initializer=_init_isolated_worker,
+        initargs=(options.cv_threads, limit_bytes),
+    ) as pool:
+        return pool.submit(_process_file_page, file_path, mime_type, page_number, temp_dir, options).result()
+
+
+def iter_process_file(
+    file_path: str,
+    mime_type: str,
+    selected_pages: Optional[List[int]] = None,
+    temp_dir: Optional[str] = None,
+    options: Optional[ProcessOptions] = None,
+) -> Iterator[ProcessedPage]:
+    options = options or ProcessOptions()
+    get_profile(options.output_profile)
+    temp_dir = temp_dir or tempfile.mkdtemp(prefix="processed_")
+    _init_pool_worker(options.cv_threads)
+
+    if mime_type == "application/pdf":
+        page_numbers = _pdf_page_numbers(file_path, selected_pages)
+        if options.workers > 1 and len(page_numbers) > 1:
+            yield from _iter_parallel(file_path, page_numbers, temp_dir, options)
+            return
+        if options.page_memory_limit_bytes:
+            for page_number in page_numbers:
+                yield _process_pdf_page_on_disk(file_path, page_number, temp_dir, options)
+            return
+        for page_number, pil_image in _render_pdf_pages(file_path, page_numbers, options.render_window):
+            page = _process_page(pil_image, page_number, temp_dir, options, render_dpi=PDF_DPI)
+            del pil_image
+            yield page
     else:
-        pil_image = Image.open(file_path).convert("RGB")
-        pages.append(_process_page(pil_image, 1, temp_dir))
+        yield _process_page(_open_image(file_path), 1, temp_dir, options)
+
+
+def process_file(
+    file_path: str,
+    mime_type: str,
+    selected_pages: Optional[List[int]] = None,
+    options: Optional[ProcessOptions] = None,
+) -> ProcessedUpload:
+    upload_warnings: List[str] = []
+    pages = list(iter_process_file(file_path, mime_type, selected_pages=selected_pages, options=options))
 
     if not pages:
         upload_warnings.append("No pages processed")
@@ -120,32 +547,105 @@ def process_file(file_path: str, mime_type: str, selected_pages: Optional[List[i
     return ProcessedUpload(upload_warnings=upload_warnings, pages=pages)
 
 
-def _process_page(pil_image: Image.Image, page_number: int, temp_dir: str) -> ProcessedPage:
-    warnings: List[str] = []
-    np_image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-    np_image = _deskew(np_image)
-    np_image = _auto_rotate(np_image)
+def _process_page(
+    pil_image: Image.Image,
+    page_number: int,
+    temp_dir: str,
+    options: ProcessOptions,
+    render_dpi: Optional[int] = None,
+) -> ProcessedPage:
+    np_image = _load_page(pil_image)
+    np_image = _orient_page(np_image)
     np_image = _clahe(np_image)
 
+    dpi_estimated = _estimate_dpi(pil_image)
+    page_quality = analyze_page(np_image, dpi_estimated or render_dpi)
+    thumb_factor = _thumbnail_factor(np_image.shape, options.thumbnail_sizes)
+    thumb_source = tiling.reduce_bands(np_image, thumb_factor, np_image.shape[0])
+    return _finish_page(np_image, thumb_source, page_quality, page_number, temp_dir, options, dpi_estimated)
+
+
+def _process_page_tiled(raster: np.ndarray, page_number: int, temp_dir: str, options: ProcessOptions) -> ProcessedPage:
+    # Same stages as _process_page, run band by band so that only
+    # band-sized buffers live in RAM; full-size intermediates go to Scratch.
+    height, width = raster.shape[:2]
+    rows = tiling.band_rows(width, 3, options.page_memory_limit_bytes)
+    scratch_dir = (options.scratch_dir or temp_dir) if options.scratch_memmap else None
+    with tiling.Scratch(scratch_dir) as scratch:
+        if raster.ndim == 2:
+            page = raster
+        else:
+            step = max(1, math.ceil(math.sqrt(height * width / MONO_SAMPLE_PIXELS)))
+            monochrome = sample_is_monochrome(raster[::step, ::step])
+            tiling.release(raster)
+            if monochrome:
+                page = tiling.convert_bands(raster, cv2.COLOR_RGB2GRAY, scratch.allocate((height, width)), rows)
+            else:
+                page = tiling.convert_bands(raster, cv2.COLOR_RGB2BGR, scratch.allocate((height, width, 3)), rows)
+
+        gray = page if page.ndim == 2 else tiling.convert_bands(
+            page, cv2.COLOR_BGR2GRAY, scratch.allocate((height, width)), rows
+        )
+        angle, snapped = _estimate_transform(gray, rows)
+        del gray
+        if angle != 0 or snapped:
+            m, size = _fused_matrix(angle, snapped, width, height)
+            # A pure quarter turn is an exact pixel permutation; no need to interpolate.
+            flags = cv2.INTER_CUBIC if angle != 0 else cv2.INTER_NEAREST
+            oriented = scratch.allocate((size[1], size[0]) + page.shape[2:])
+            page = tiling.warp_bands(page, m, size, oriented, rows, flags=flags)
+
+        enhanced = tiling.clahe_bands(page, scratch.allocate(page.shape), rows)
+        del page
+        page_quality = analyze_page(enhanced, PDF_DPI)
+        thumbnail = tiling.reduce_bands(enhanced, _thumbnail_factor(enhanced.shape, options.thumbnail_sizes), rows)
+        return _finish_page(enhanced, thumbnail, page_quality, page_number, temp_dir, options, None)
+
+
+def _finish_page(
+    np_image: np.ndarray,
+    thumb_source: np.ndarray,
+    page_quality: PageQuality,
+    page_number: int,
+    temp_dir: str,
+    options: ProcessOptions,
+    dpi_estimated: Optional[int],
+) -> ProcessedPage:
+    warnings: List[str] = []
     height, width = np_image.shape[:2]
-    blur = _blur_score(np_image)
-    if blur < BLUR_THRESHOLD:
+    if page_quality.blur_score < BLUR_THRESHOLD:
         warnings.append("blur_detected")
     if min(height, width) < MIN_SHORT_SIDE:
         warnings.append("low_resolution")
 
-    png_path = f"{temp_dir}/page_{page_number:02d}.png"
-    thumb_path = f"{temp_dir}/page_{page_number:02d}.jpg"
-    cv2.imwrite(png_path, np_image)
-    pil_out = Image.fromarray(cv2.cvtColor(np_image, cv2.COLOR_BGR2RGB))
-    _save_thumbnail(pil_out, thumb_path)
+    encoded = encode_page(np_image, f"{temp_dir}/page_{page_number:02d}", get_profile(options.output_profile))
+    thumb_paths = _save_thumbnails(thumb_source, f"{temp_dir}/page_{page_number:02d}", options.thumbnail_sizes)
+    metrics = {"encoding": encoded.as_metrics(), "quality": page_quality.as_metrics()}
+    tiles = None
+    if options.tile_size:
+        rows = height
+        if options.page_memory_limit_bytes:
+            rows = tiling.band_rows(width, 3, options.page_memory_limit_bytes)
+        tiles = build_pyramid(
+            np_image,
+            f"{temp_dir}/page_{page_number:02d}",
+            tile_size=options.tile_size,
+            overlap=options.tile_overlap,
+            tile_format=options.tile_format,
+            rows=rows,
+        )
+        metrics["tiles"] = tiles.as_metrics()
 
     return ProcessedPage(
         page_number=page_number,
         width_px=width,
         height_px=height,
-        dpi_estimated=_estimate_dpi(pil_image),
+        dpi_estimated=dpi_estimated,
         warnings=warnings,
-        png_path=png_path,
-        thumb_path=thumb_path,
+        png_path=encoded.path,
+        thumb_path=thumb_paths[max(thumb_paths)],
+        content_type=encoded.content_type,
+        metrics=metrics,
+        thumb_paths=thumb_paths,
+        tiles=tiles,
     )
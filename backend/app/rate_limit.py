@@ -12,7 +12,7 @@ class UploadRateLimitMiddleware(BaseHTTPMiddleware):
         self.redis = redis.Redis.from_url(settings.redis_url, decode_responses=True)
 
     async def dispatch(self, request: Request, call_next):
-        if request.url.path.endswith("/uploads") and request.method == "POST":
+        if request.url.path.endswith(("/uploads", "/uploads/presign", "/uploads/resumable")) and request.method == "POST":
             client_ip = request.client.host if request.client else "unknown"
             key = f"upload_rate:{client_ip}"
             current = self.redis.incr(key)
@@ -0,0 +1,134 @@
+import threading
+import uuid
+from typing import List, Optional
+import redis
+from . import routing
+from .config import settings
+from .db import SessionLocal
+from .events import publish
+from .models import Page, PageStatus, Upload, UploadStatus
+
+# One run at a time per upload: the run holds LOCK_KEY, whose TTL its
+# heartbeat keeps extending. A PROCESSING upload without the key has lost
+# its worker; reap_stalled_uploads() queues it again and the new run skips
+# every page that is already READY (pages are committed one by one).
+LOCK_KEY = "upload_lock:{}"
+REAPER_KEY = "upload_reaper"
+
+_REFRESH = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+redis_conn = redis.Redis.from_url(settings.redis_url, decode_responses=True)
+
+
+def acquire(upload_id: str) -> Optional[str]:
+    token = uuid.uuid4().hex
+    if redis_conn.set(LOCK_KEY.format(upload_id), token, nx=True, ex=settings.upload_lock_ttl_seconds):
+        return token
+    return None
+
+
+def refresh(upload_id: str, token: str, ttl: Optional[int] = None) -> bool:
+    ttl = ttl or settings.upload_lock_ttl_seconds
+    return bool(redis_conn.register_script(_REFRESH)(keys=[LOCK_KEY.format(upload_id)], args=[token, ttl]))
+
+
+def release(upload_id: str, token: str) -> None:
+    redis_conn.register_script(_RELEASE)(keys=[LOCK_KEY.format(upload_id)], args=[token])
+
+
+class Heartbeat:
+    # Keeps the upload lock alive from a background thread while a job runs;
+    # if the process dies, the lock lapses within its TTL. Without a token
+    # (jobs queued before locking existed) it does nothing.
+    def __init__(self, upload_id: str, token: Optional[str], ttl: Optional[int] = None) -> None:
+        self.upload_id = str(upload_id)
+        self.token = token
+        self.ttl = ttl or settings.upload_lock_ttl_seconds
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _beat(self) -> None:
+        while not self._stop.wait(max(1, self.ttl // 3)):
+            try:
+                if not refresh(self.upload_id, self.token, self.ttl):
+                    return
+            except redis.RedisError:
+                continue
+
+    def start(self) -> "Heartbeat":
+        if self.token:
+            self._thread = threading.Thread(target=self._beat, name="upload-heartbeat", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def reap_due() -> bool:
+    # True at most once per interval across all workers.
+    return bool(redis_conn.set(REAPER_KEY, "1", nx=True, ex=settings.upload_reaper_interval_seconds))
+
+
+def reap_stalled_uploads(connection, limit: int = 100) -> List[str]:
+    # Uploads left PROCESSING by a dead worker: their unfinished pages go back
+    # to PENDING and the upload is queued again, or failed once it has been
+    # resumed upload_max_resumes times (e.g. a page that kills every worker).
+    from .jobs import process_upload
+
+    db = SessionLocal()
+    resumed: List[str] = []
+    try:
+        stalled = [
+            upload_id
+            for (upload_id,) in db.query(Upload.id).filter(Upload.status == UploadStatus.PROCESSING).limit(limit)
+        ]
+        for upload_id in stalled:
+            token = acquire(str(upload_id))
+            if token is None:
+                continue
+            try:
+                # Re-read under the lock: the run may have finished meanwhile.
+                upload = db.query(Upload).filter(Upload.id == upload_id).one()
+                db.refresh(upload)
+                if upload.status != UploadStatus.PROCESSING:
+                    db.commit()
+                    continue
+                db.query(Page).filter(Page.upload_id == upload.id, Page.status == PageStatus.PROCESSING).update(
+                    {Page.status: PageStatus.PENDING}, synchronize_session=False
+                )
+                progress = dict(upload.progress or {})
+                progress["resumes"] = progress.get("resumes", 0) + 1
+                if progress["resumes"] > settings.upload_max_resumes:
+                    upload.progress = progress
+                    upload.status = UploadStatus.FAILED
+                    upload.error_message = "Processing was interrupted too many times"
+                    db.commit()
+                    publish(str(upload.id), "status", {"status": UploadStatus.FAILED.value, "error": upload.error_message})
+                    continue
+                cost = routing.estimate_upload(upload)
+                upload.progress = {**progress, "cost": cost.as_progress()}
+                upload.status = UploadStatus.UPLOADED
+                db.commit()
+                routing.enqueue(connection, cost, str(upload.project_id), process_upload, str(upload.id))
+                publish(str(upload.id), "status", {"status": UploadStatus.UPLOADED.value, "resumed": True})
+                resumed.append(str(upload.id))
+            finally:
+                release(str(upload_id), token)
+    finally:
+        db.close()
+    return resumed
@@ -0,0 +1,225 @@
+import json
+import math
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+import redis
+from .config import settings
+from .storage import storage_client
+
+# Sessions are Redis hashes; SESSIONS_KEY scores each session id by the time
+# it expires, for collect_expired_sessions().
+SESSION_KEY = "upload_session:{}"
+SESSIONS_KEY = "upload_sessions"
+LOCK_KEY = "upload_session_lock:{}"
+GC_KEY = "upload_session_gc"
+# S3 allows at most this many parts per upload.
+MAX_PARTS = 10000
+
+# A part is only written while the caller still holds the session lock and
+# the session is still at the offset it read; recording the part checks both
+# again and extends the lock, so a long PATCH keeps it and a lapsed one stops.
+_CLAIM = """
+if redis.call('GET', KEYS[2]) ~= ARGV[1] then
+  return 0
+end
+if redis.call('HGET', KEYS[1], 'offset') ~= ARGV[2] then
+  return 0
+end
+return redis.call('EXPIRE', KEYS[2], ARGV[3])
+"""
+
+_RECORD = """
+if redis.call('GET', KEYS[2]) ~= ARGV[1] then
+  return 0
+end
+if redis.call('HGET', KEYS[1], 'offset') ~= ARGV[2] then
+  return 0
+end
+redis.call('HSET', KEYS[1], 'offset', ARGV[3], 'etags', ARGV[4], 'expires_at', ARGV[5])
+redis.call('ZADD', KEYS[3], ARGV[5], ARGV[6])
+return redis.call('EXPIRE', KEYS[2], ARGV[7])
+"""
+
+_REFRESH = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+redis_conn = redis.Redis.from_url(settings.redis_url, decode_responses=True)
+
+
+class LockLost(Exception):
+    """The session lock lapsed or moved to another writer mid-request."""
+
+
+@dataclass
+class UploadSession:
+    # Bytes [0, offset) are stored as parts 1..offset/part_size of the
+    # multipart upload; a part is only counted once S3 has accepted it.
+    upload_id: str
+    project_id: str
+    filename: str
+    mime_type: str
+    size_bytes: int
+    storage_key: str
+    multipart_id: str
+    part_size: int
+    offset: int = 0
+    expires_at: float = 0.0
+    etags: Dict[str, str] = field(default_factory=dict)
+
+    @property
+    def complete(self) -> bool:
+        return self.offset >= self.size_bytes
+
+    def next_part_number(self) -> int:
+        return self.offset // self.part_size + 1
+
+    def completed_parts(self) -> List[Dict]:
+        numbers = sorted(int(number) for number in self.etags)
+        return [{"PartNumber": number, "ETag": self.etags[str(number)]} for number in numbers]
+
+
+def _save(session: UploadSession) -> None:
+    session.expires_at = time.time() + settings.upload_session_ttl_seconds
+    mapping = {**asdict(session), "etags": json.dumps(session.etags)}
+    pipe = redis_conn.pipeline()
+    pipe.hset(SESSION_KEY.format(session.upload_id), mapping=mapping)
+    pipe.zadd(SESSIONS_KEY, {session.upload_id: session.expires_at})
+    pipe.execute()
+
+
+def create_session(
+    project_id: str, upload_id: str, filename: str, mime_type: str, size_bytes: int, storage_key: str
+) -> UploadSession:
+    part_size = max(settings.upload_part_size_mb * 1024 * 1024, math.ceil(size_bytes / MAX_PARTS))
+    session = UploadSession(
+        upload_id=upload_id,
+        project_id=project_id,
+        filename=filename,
+        mime_type=mime_type,
+        size_bytes=size_bytes,
+        storage_key=storage_key,
+        multipart_id=storage_client.create_multipart(storage_key, mime_type),
+        part_size=part_size,
+    )
+    _save(session)
+    return session
+
+
+def load_session(upload_id: str) -> Optional[UploadSession]:
+    data = redis_conn.hgetall(SESSION_KEY.format(upload_id))
+    if not data or float(data["expires_at"]) < time.time():
+        return None
+    return UploadSession(
+        upload_id=data["upload_id"],
+        project_id=data["project_id"],
+        filename=data["filename"],
+        mime_type=data["mime_type"],
+        size_bytes=int(data["size_bytes"]),
+        storage_key=data["storage_key"],
+        multipart_id=data["multipart_id"],
+        part_size=int(data["part_size"]),
+        offset=int(data["offset"]),
+        expires_at=float(data["expires_at"]),
+        etags=json.loads(data["etags"]),
+    )
+
+
+def acquire(upload_id: str) -> Optional[str]:
+    # One writer per session, so concurrent PATCHes cannot both claim an offset.
+    token = uuid.uuid4().hex
+    if redis_conn.set(LOCK_KEY.format(upload_id), token, nx=True, ex=settings.upload_session_lock_seconds):
+        return token
+    return None
+
+
+def refresh(upload_id: str, token: str) -> bool:
+    # Extends the lock while a PATCH is still receiving a part.
+    return bool(
+        redis_conn.register_script(_REFRESH)(
+            keys=[LOCK_KEY.format(upload_id)], args=[token, settings.upload_session_lock_seconds]
+        )
+    )
+
+
+def release(upload_id: str, token: str) -> None:
+    redis_conn.register_script(_RELEASE)(keys=[LOCK_KEY.format(upload_id)], args=[token])
+
+
+def store_part(session: UploadSession, token: str, data: bytes) -> None:
+    # Uploads one part at the session's offset and records it. Raises LockLost,
+    # without writing, if token no longer holds the lock or another writer has
+    # moved the offset; the part is then not counted.
+    keys = [SESSION_KEY.format(session.upload_id), LOCK_KEY.format(session.upload_id), SESSIONS_KEY]
+    if not redis_conn.register_script(_CLAIM)(
+        keys=keys[:2], args=[token, session.offset, settings.upload_session_lock_seconds]
+    ):
+        raise LockLost(session.upload_id)
+    part_number = session.next_part_number()
+    etag = storage_client.upload_part(session.storage_key, session.multipart_id, part_number, data)
+    etags = {**session.etags, str(part_number): etag}
+    expires_at = time.time() + settings.upload_session_ttl_seconds
+    recorded = redis_conn.register_script(_RECORD)(
+        keys=keys,
+        args=[
+            token,
+            session.offset,
+            session.offset + len(data),
+            json.dumps(etags),
+            expires_at,
+            session.upload_id,
+            settings.upload_session_lock_seconds,
+        ],
+    )
+    if not recorded:
+        raise LockLost(session.upload_id)
+    session.etags = etags
+    session.offset += len(data)
+    session.expires_at = expires_at
+
+
+def finish_session(session: UploadSession) -> None:
+    # Safe to repeat: an object that already exists was completed before.
+    if storage_client.head(session.storage_key) is None:
+        storage_client.complete_multipart(session.storage_key, session.multipart_id, session.completed_parts())
+
+
+def delete_session(upload_id: str) -> None:
+    pipe = redis_conn.pipeline()
+    pipe.delete(SESSION_KEY.format(upload_id))
+    pipe.zrem(SESSIONS_KEY, upload_id)
+    pipe.execute()
+
+
+def gc_due() -> bool:
+    # True at most once per interval across API processes.
+    return bool(redis_conn.set(GC_KEY, "1", nx=True, ex=settings.upload_session_gc_interval_seconds))
+
+
+def collect_expired_sessions(limit: int = 500) -> int:
+    # Aborts the multipart uploads of sessions that were never completed,
+    # which releases their stored parts, and forgets the sessions.
+    expired = redis_conn.zrangebyscore(SESSIONS_KEY, 0, time.time(), start=0, num=limit)
+    for upload_id in expired:
+        if redis_conn.exists(LOCK_KEY.format(upload_id)):
+            continue
+        data = redis_conn.hgetall(SESSION_KEY.format(upload_id))
+        if data:
+            try:
+                storage_client.abort_multipart(data["storage_key"], data["multipart_id"])
+            except Exception:  # noqa: BLE001
+                pass
+        delete_session(upload_id)
+    return len(expired)
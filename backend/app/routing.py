@@ -0,0 +1,162 @@
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from PIL import ImageFile
+from . import fairshare
+from .config import settings
+from .models import Upload
+from .processor import PDF_DPI
+from .storage import storage_client
+
+# Lanes in worker priority order: (lane, queue name). "uploads" keeps its
+# name so jobs enqueued before lanes existed are still picked up.
+LANES: List[Tuple[str, str]] = [
+    ("small", "uploads_small"),
+    ("standard", "uploads"),
+    ("large", "uploads_large"),
+]
+# Bytes read from each end of the original to find page count and size.
+PROBE_BYTES = 64 * 1024
+# Used when the probe finds nothing: an ARCH D sheet, a phone photo, and
+# the average PDF page size of plan sets.
+DEFAULT_PDF_PAGE_POINTS = (36 * 72, 24 * 72)
+DEFAULT_IMAGE_PIXELS = 12_000_000
+DEFAULT_PDF_BYTES_PER_PAGE = 300 * 1024
+# Never below RQ's default timeout; otherwise a few times the estimate.
+MIN_JOB_TIMEOUT_SECONDS = 180
+JOB_TIMEOUT_FACTOR = 4
+
+_LINEARIZED_PAGES = re.compile(rb"/Linearized\b.{0,200}?/N\s+(\d+)", re.S)
+_PAGE_TREE_COUNT = re.compile(rb"/Type\s*/Pages\b[^>]{0,200}?/Count\s+(\d+)|/Count\s+(\d+)[^>]{0,200}?/Type\s*/Pages\b", re.S)
+_MEDIA_BOX = re.compile(rb"/MediaBox\s*\[\s*(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s*\]")
+
+
+@dataclass
+class CostEstimate:
+    lane: str
+    queue: str
+    seconds: float
+    pages: int
+    megapixels: float
+    probed: bool
+
+    def as_progress(self) -> Dict:
+        return {
+            "lane": self.lane,
+            "estimatedSeconds": self.seconds,
+            "pages": self.pages,
+            "megapixels": self.megapixels,
+            "probed": self.probed,
+        }
+
+
+def _probe_pdf(key: str) -> Tuple[Optional[int], Optional[Tuple[float, float]]]:
+    # Linearized PDFs state the page count up front; otherwise the page tree
+    # root is often near either end. Compressed object streams hide both.
+    head = storage_client.read_range(key, f"bytes=0-{PROBE_BYTES - 1}")
+    tail = storage_client.read_range(key, f"bytes=-{PROBE_BYTES}")
+    count = None
+    match = _LINEARIZED_PAGES.search(head[:2048])
+    if match:
+        count = int(match.group(1))
+    else:
+        counts = [int(a or b) for a, b in _PAGE_TREE_COUNT.findall(head + tail)]
+        count = max(counts) if counts else None
+    size = None
+    box = _MEDIA_BOX.search(head) or _MEDIA_BOX.search(tail)
+    if box:
+        x0, y0, x1, y1 = (float(value) for value in box.groups())
+        size = (abs(x1 - x0), abs(y1 - y0))
+    return count, size
+
+
+def _probe_image(key: str) -> Optional[Tuple[int, int]]:
+    parser = ImageFile.Parser()
+    try:
+        parser.feed(storage_client.read_range(key, f"bytes=0-{PROBE_BYTES - 1}"))
+    except Exception:  # noqa: BLE001
+        return None
+    return parser.image.size if parser.image is not None else None
+
+
+def _lane_for(seconds: float) -> Tuple[str, str]:
+    if seconds <= settings.lane_small_max_seconds:
+        return LANES[0]
+    if seconds >= settings.lane_large_min_seconds:
+        return LANES[2]
+    return LANES[1]
+
+
+def estimate(
+    mime_type: str,
+    size_bytes: int,
+    page_count: Optional[int] = None,
+    page_pixels: Optional[int] = None,
+    probed: bool = False,
+) -> CostEstimate:
+    # Seconds of worker time: a fixed overhead, fetching the original, and
+    # rendering and enhancing every page, which scales with its pixel count.
+    if page_pixels is None:
+        if mime_type == "application/pdf":
+            width, height = DEFAULT_PDF_PAGE_POINTS
+            page_pixels = int(width / 72 * PDF_DPI * height / 72 * PDF_DPI)
+        else:
+            page_pixels = DEFAULT_IMAGE_PIXELS
+    if page_count is None:
+        page_count = max(1, size_bytes // DEFAULT_PDF_BYTES_PER_PAGE) if mime_type == "application/pdf" else 1
+    megapixels = page_count * page_pixels / 1_000_000
+    seconds = (
+        settings.cost_base_seconds
+        + size_bytes / (1024 * 1024) * settings.cost_seconds_per_mb
+        + megapixels * settings.cost_seconds_per_megapixel
+    )
+    lane, queue_name = _lane_for(seconds)
+    return CostEstimate(lane, queue_name, round(seconds, 1), page_count, round(megapixels, 1), probed)
+
+
+def estimate_upload(upload: Upload, page_numbers: Optional[List[int]] = None) -> CostEstimate:
+    # page_numbers as passed to process_upload; by default the run covers the
+    # selected pages, or the whole document when none are selected.
+    if page_numbers is None and isinstance(upload.progress, dict):
+        page_numbers = upload.progress.get("selectedPages")
+    try:
+        if upload.mime_type == "application/pdf":
+            count, points = _probe_pdf(upload.storage_key_original)
+            pixels = int(points[0] / 72 * PDF_DPI * points[1] / 72 * PDF_DPI) if points else None
+            probed = count is not None or points is not None
+        else:
+            count, size = 1, _probe_image(upload.storage_key_original)
+            pixels = size[0] * size[1] if size else None
+            probed = size is not None
+    except Exception:  # noqa: BLE001
+        count, pixels, probed = None, None, False
+    if page_numbers:
+        count = len(page_numbers) if count is None else len([n for n in page_numbers if n <= count])
+    return estimate(upload.mime_type, upload.size_bytes, count, pixels, probed)
+
+
+def enqueue(connection, cost: CostEstimate, project_id: str, func, *args, delay_seconds: float = 0):
+    # The estimate travels with the job; TimedJob adds the measured run time.
+    # Projects share each lane through the fair-share scheduler.
+    timeout = max(MIN_JOB_TIMEOUT_SECONDS, int(cost.seconds * JOB_TIMEOUT_FACTOR))
+    return fairshare.submit(
+        connection,
+        cost.queue,
+        project_id,
+        cost.seconds,
+        func,
+        *args,
+        job_timeout=timeout,
+        meta={"cost": cost.as_progress()},
+        delay_seconds=delay_seconds,
+    )
+
+
+def actual_cost(progress: Dict, pages: int) -> Dict:
+    # The estimate next to what the run took, for the API and for tuning the cost_* settings.
+    timings = progress.get("timings") or {}
+    return {
+        **(progress.get("cost") or {}),
+        "actualSeconds": round(sum(timings.values()) / 1000, 1),
+        "actualPages": pages,
+    }
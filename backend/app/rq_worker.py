@@ -1,14 +1,197 @@
+import importlib
+import logging
+import multiprocessing
 import os
+import resource
+import signal
+import time
 import redis
-from rq import Worker, Queue, Connection
+from rq import Queue, SimpleWorker, Worker
+from rq.job import Job
+from rq.logutils import setup_loghandlers
+from rq.worker import StopRequested
+from . import fairshare, recovery
 from .config import settings
+from .jobs import PAGES_QUEUE
+from .routing import LANES
+
+logger = logging.getLogger("rq.worker")
+
+# Imported once per worker process instead of once per job.
+PRELOAD_MODULES = [
+    "numpy",
+    "cv2",
+    "PIL.Image",
+    "pdf2image",
+    "sqlalchemy.orm",
+    "app.db",
+    "app.storage",
+    "app.processor",
+    "app.jobs",
+]
+
+
+def preload() -> float:
+    started = time.perf_counter()
+    for name in PRELOAD_MODULES:
+        importlib.import_module(name)
+    return (time.perf_counter() - started) * 1000
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as handle:
+            return int(handle.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak rather than current RSS, in KiB on Linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class TimedJob(Job):
+    def _execute(self):
+        started = time.perf_counter()
+        try:
+            return super()._execute()
+        finally:
+            self.meta["runMs"] = round((time.perf_counter() - started) * 1000, 1)
+            self.save_meta()
+
+
+class _SetupTimingMixin:
+    # Setup overhead is everything around the job function: fork, imports,
+    # deserialization and bookkeeping. It is logged and kept in job.meta.
+    def execute_job(self, job, queue):
+        started = time.perf_counter()
+        super().execute_job(job, queue)
+        total_ms = (time.perf_counter() - started) * 1000
+        run_ms = job.get_meta(refresh=True).get("runMs")
+        if run_ms is not None:
+            job.meta["setupMs"] = round(total_ms - run_ms, 1)
+            job.save_meta()
+            logger.info("Job %s: %.1f ms total, %.1f ms setup", job.id, total_ms, job.meta["setupMs"])
+
+
+class _FairShareMixin:
+    # Moves jobs from the fair-share backlog onto this worker's queues before
+    # every dequeue, at least every fairshare_poll_seconds while idle, and
+    # when a job starts; a finished job gives its project slot back.
+    def dequeue_job_and_maintain_ttl(self, timeout, max_idle_time=None):
+        if timeout is None or max_idle_time is not None:
+            fairshare.dispatch(self.connection, self.queue_names())
+            return super().dequeue_job_and_maintain_ttl(timeout, max_idle_time)
+        while True:
+            fairshare.dispatch(self.connection, self.queue_names())
+            result = super().dequeue_job_and_maintain_ttl(timeout, settings.fairshare_poll_seconds)
+            if result is not None:
+                return result
+
+    def execute_job(self, job, queue):
+        fairshare.dispatch(self.connection, [queue.name])
+        try:
+            super().execute_job(job, queue)
+        finally:
+            fairshare.release(self.connection, job)
+
+
+class _ReaperMixin:
+    # Sits below _FairShareMixin, so idle workers pass here every
+    # fairshare_poll_seconds; one of them resumes stalled uploads per
+    # upload_reaper_interval_seconds.
+    def dequeue_job_and_maintain_ttl(self, timeout, max_idle_time=None):
+        if recovery.reap_due():
+            try:
+                resumed = recovery.reap_stalled_uploads(self.connection)
+                if resumed:
+                    logger.info("Resumed stalled uploads: %s", ", ".join(resumed))
+            except Exception:  # noqa: BLE001
+                logger.exception("Reaping stalled uploads failed")
+        return super().dequeue_job_and_maintain_ttl(timeout, max_idle_time)
+
+
+class TimedWorker(_FairShareMixin, _ReaperMixin, _SetupTimingMixin, Worker):
+    pass
+
+
+class PreloadedWorker(_FairShareMixin, _ReaperMixin, _SetupTimingMixin, SimpleWorker):
+    # Runs jobs in its own (preloaded) process and stops once it has grown
+    # past max_rss_bytes; run_pool() replaces it with a fresh child.
+    max_rss_bytes = 0
+
+    def execute_job(self, job, queue):
+        super().execute_job(job, queue)
+        rss = _rss_bytes()
+        if self.max_rss_bytes and rss > self.max_rss_bytes:
+            logger.info("Worker %s: RSS %d MiB over ceiling, recycling", self.key, rss // (1024 * 1024))
+            raise StopRequested()
+
+
+def _queues(connection):
+    # Page jobs first, so uploads already in flight finish before new ones
+    # start; then the lanes from small to large.
+    names = settings.worker_queues or [PAGES_QUEUE] + [name for _, name in LANES]
+    return [Queue(name, connection=connection) for name in names]
+
+
+def _run_child(max_jobs: int, max_rss_bytes: int) -> None:
+    # The database pool is reset after fork() in db.py; Redis gets a new client.
+    connection = redis.Redis.from_url(settings.redis_url)
+    worker = PreloadedWorker(_queues(connection), connection=connection, job_class=TimedJob)
+    worker.max_rss_bytes = max_rss_bytes
+    worker.work(with_scheduler=True, max_jobs=max_jobs or None)
+
+
+def run_pool(processes: int, max_jobs: int, max_rss_bytes: int) -> None:
+    # Keeps `processes` children running PreloadedWorker. Modules are imported
+    # here before forking, so every child starts with them loaded; a child
+    # exits after max_jobs jobs or past the RSS ceiling and is replaced.
+    logger.info("Preloaded worker modules in %.0f ms", preload())
+    context = multiprocessing.get_context("fork")
+    children = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for child in children.values():
+            if child.is_alive():
+                os.kill(child.pid, signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    slots = range(processes)
+    while True:
+        for slot in slots:
+            child = children.get(slot)
+            if child is not None and child.is_alive():
+                continue
+            if child is not None:
+                child.join()
+            if stopping:
+                children.pop(slot, None)
+                continue
+            child = context.Process(target=_run_child, args=(max_jobs, max_rss_bytes), name=f"rq-preloaded-{slot}")
+            child.start()
+            children[slot] = child
+        if stopping and not children:
+            return
+        time.sleep(0.5)
 
 
 def run_worker():
+    setup_loghandlers("INFO")
+    if settings.worker_mode == "preloaded":
+        run_pool(
+            max(1, settings.worker_processes),
+            settings.worker_max_jobs,
+            settings.worker_max_rss_mb * 1024 * 1024,
+        )
+        return
+    # Forking mode: still import the pipeline once in the parent, so each
+    # work horse inherits it instead of importing it per job.
+    preload()
     redis_conn = redis.Redis.from_url(settings.redis_url)
-    with Connection(redis_conn):
-        worker = Worker([Queue("uploads")])
-        worker.work(with_scheduler=True)
+    worker = TimedWorker(_queues(redis_conn), connection=redis_conn, job_class=TimedJob)
+    worker.work(with_scheduler=True)
 
 
 if __name__ == "__main__":
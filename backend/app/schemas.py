@@ -29,13 +29,15 @@ class PageOut(BaseModel):
     id: str
     uploadId: str = Field(alias="upload_id")
     pageNumber: int = Field(alias="page_number")
-    widthPx: int = Field(alias="width_px")
-    heightPx: int = Field(alias="height_px")
+    widthPx: Optional[int] = Field(alias="width_px")
+    heightPx: Optional[int] = Field(alias="height_px")
     dpiEstimated: Optional[int] = Field(alias="dpi_estimated")
-    storageKeyPagePng: str = Field(alias="storage_key_page_png")
+    storageKeyPagePng: Optional[str] = Field(alias="storage_key_page_png")
     storageKeyPageThumb: Optional[str] = Field(alias="storage_key_page_thumb")
     status: PageStatus
     warnings: Optional[dict]
+    metrics: Optional[dict] = None
+    derivedFromPageId: Optional[str] = Field(None, alias="derived_from_page_id")
 
     class Config:
         populate_by_name = True
@@ -48,6 +50,7 @@ class UploadOut(BaseModel):
     mimeType: str = Field(alias="mime_type")
     sizeBytes: int = Field(alias="size_bytes")
     storageKeyOriginal: str = Field(alias="storage_key_original")
+    contentSha256: Optional[str] = Field(None, alias="content_sha256")
     status: UploadStatus
     errorMessage: Optional[str] = Field(alias="error_message")
     warnings: Optional[dict]
@@ -64,10 +67,66 @@ class UploadCreateResponse(BaseModel):
     status: UploadStatus
 
 
+class UploadPresignIn(BaseModel):
+    filename: str
+    contentType: str
+    sizeBytes: int = Field(gt=0)
+
+
+class PresignedPart(BaseModel):
+    partNumber: int
+    url: str
+
+
+class UploadPresignOut(BaseModel):
+    uploadId: str
+    storageKey: str
+    expiresIn: int
+    # Single PUT: send the file to url with these headers.
+    url: Optional[str] = None
+    headers: dict = {}
+    # Multipart: PUT each partSize slice to its part url and pass the ETags to finalize.
+    partSize: Optional[int] = None
+    parts: List[PresignedPart] = []
+
+
+class CompletedPart(BaseModel):
+    partNumber: int
+    etag: str
+
+
+class UploadFinalizeIn(BaseModel):
+    parts: List[CompletedPart] = []
+
+
+class ResumableUploadIn(BaseModel):
+    filename: str
+    contentType: str
+    sizeBytes: int = Field(gt=0)
+
+
+class ResumableUploadOut(BaseModel):
+    uploadId: str
+    offset: int
+    sizeBytes: int
+    # Bytes are stored in chunkSize pieces; a PATCH that stops mid-chunk
+    # resumes from the start of that chunk.
+    chunkSize: int
+    expiresAt: datetime
+    # Set once the last byte is received and the upload is queued.
+    status: Optional[UploadStatus] = None
+
+
 class PageSelection(BaseModel):
     activePageNumbers: List[int]
 
 
+class PageSelectionOut(BaseModel):
+    status: str
+    addedPages: List[int] = []
+    removedPages: List[int] = []
+
+
 class CalibrationIn(BaseModel):
     p1x: int
     p1y: int
@@ -1,22 +1,128 @@
 import io
-from typing import Iterable
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.client import Config
 from botocore.exceptions import ClientError
 from .config import settings
 
 
+# S3 requires every part but the last to be at least 5 MiB.
+MIN_PART_BYTES = 5 * 1024 * 1024
+
+
+class MultipartWriter:
+    # Buffers writes into part_size parts and sends each as it fills, so at
+    # most one part is held in memory. Objects smaller than one part are sent
+    # with a single put_object on complete().
+    def __init__(self, client, key: str, content_type: str, part_size: int) -> None:
+        self.client = client
+        self.key = key
+        self.content_type = content_type
+        self.part_size = max(MIN_PART_BYTES, part_size)
+        self.upload_id: Optional[str] = None
+        self.parts: List[Dict] = []
+        self.buffer = bytearray()
+
+    def write(self, data: bytes) -> None:
+        self.buffer += data
+        while len(self.buffer) >= self.part_size:
+            self._send_part(bytes(self.buffer[: self.part_size]))
+            del self.buffer[: self.part_size]
+
+    def _send_part(self, body: bytes) -> None:
+        if self.upload_id is None:
+            self.upload_id = self.client.create_multipart_upload(
+                Bucket=settings.s3_bucket, Key=self.key, ContentType=self.content_type
+            )["UploadId"]
+        part_number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Bucket=settings.s3_bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=body,
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+
+    def complete(self) -> None:
+        if self.upload_id is None:
+            self.client.put_object(
+                Bucket=settings.s3_bucket, Key=self.key, Body=bytes(self.buffer), ContentType=self.content_type
+            )
+        else:
+            if self.buffer:
+                self._send_part(bytes(self.buffer))
+            self.client.complete_multipart_upload(
+                Bucket=settings.s3_bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                MultipartUpload={"Parts": self.parts},
+            )
+        self.buffer = bytearray()
+
+    def abort(self) -> None:
+        self.buffer = bytearray()
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=settings.s3_bucket, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+
+
+@dataclass
+class TransferResult:
+    key: str
+    size_bytes: int
+    seconds: float
+
+
+def _s3_client(endpoint_url: str):
+    # One pooled connection per concurrent request: upload_many runs
+    # s3_transfer_threads objects at once, each in up to s3_max_concurrency parts.
+    return boto3.client(
+        "s3",
+        endpoint_url=endpoint_url,
+        aws_access_key_id=settings.s3_access_key,
+        aws_secret_access_key=settings.s3_secret_key,
+        region_name=settings.s3_region,
+        use_ssl=settings.s3_secure,
+        config=Config(
+            signature_version="s3v4",
+            max_pool_connections=max(10, settings.s3_transfer_threads * settings.s3_max_concurrency),
+        ),
+    )
+
+
 class StorageClient:
     def __init__(self) -> None:
-        self.client = boto3.client(
-            "s3",
-            endpoint_url=settings.s3_endpoint,
-            aws_access_key_id=settings.s3_access_key,
-            aws_secret_access_key=settings.s3_secret_key,
-            region_name=settings.s3_region,
-            use_ssl=settings.s3_secure,
-            config=Config(signature_version="s3v4"),
+        self.client = _s3_client(settings.s3_endpoint)
+        # Presigned URLs are used by browsers, which may reach storage under a
+        # different host than the API does; the host is part of the signature.
+        self.presign_client = self.client
+        if settings.s3_public_endpoint:
+            self.presign_client = _s3_client(settings.s3_public_endpoint)
+        # Files above the threshold are sent and fetched as parallel parts / ranged GETs.
+        self.transfer_config = TransferConfig(
+            multipart_threshold=settings.s3_multipart_threshold_mb * 1024 * 1024,
+            multipart_chunksize=settings.s3_multipart_chunk_mb * 1024 * 1024,
+            max_concurrency=settings.s3_max_concurrency,
         )
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    def _transfer_pool(self) -> ThreadPoolExecutor:
+        # Shared by every upload_many call in the process, so concurrent
+        # batches together stay within s3_transfer_threads.
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=settings.s3_transfer_threads, thread_name_prefix="s3-transfer"
+                )
+            return self._pool
 
     def upload_bytes(self, key: str, data: bytes, content_type: str) -> None:
         self.client.put_object(
@@ -32,14 +138,90 @@ class StorageClient:
             settings.s3_bucket,
             key,
             ExtraArgs={"ContentType": content_type},
+            Config=self.transfer_config,
         )
 
+    def _timed_upload(self, key: str, file_path: str, content_type: str) -> TransferResult:
+        started = time.perf_counter()
+        self.upload_file(key, file_path, content_type)
+        return TransferResult(key, os.path.getsize(file_path), time.perf_counter() - started)
+
+    def upload_many(self, items: Iterable[Tuple[str, str, str]]) -> List[TransferResult]:
+        # (key, file path, content type) triples, uploaded concurrently on the
+        # shared pool. Waits for every transfer, then raises the first error.
+        pool = self._transfer_pool()
+        futures = [pool.submit(self._timed_upload, *item) for item in items]
+        results: List[TransferResult] = []
+        error: Optional[BaseException] = None
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as exc:  # noqa: BLE001
+                error = error or exc
+        if error:
+            raise error
+        return results
+
+    def download_file(self, key: str, file_path: str) -> int:
+        # Large objects are fetched as parallel ranged GETs per transfer_config.
+        self.client.download_file(settings.s3_bucket, key, file_path, Config=self.transfer_config)
+        return os.path.getsize(file_path)
+
+    def open_multipart(self, key: str, content_type: str) -> MultipartWriter:
+        return MultipartWriter(self.client, key, content_type, settings.upload_part_size_mb * 1024 * 1024)
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=settings.s3_bucket, Key=key)
+
+    def presign_put(self, key: str, content_type: str, expires: int) -> str:
+        # The client has to send the same Content-Type header with the PUT.
+        return self.presign_client.generate_presigned_url(
+            "put_object",
+            Params={"Bucket": settings.s3_bucket, "Key": key, "ContentType": content_type},
+            ExpiresIn=expires,
+        )
+
+    def create_multipart(self, key: str, content_type: str) -> str:
+        return self.client.create_multipart_upload(Bucket=settings.s3_bucket, Key=key, ContentType=content_type)[
+            "UploadId"
+        ]
+
+    def presign_part(self, key: str, multipart_id: str, part_number: int, expires: int) -> str:
+        return self.presign_client.generate_presigned_url(
+            "upload_part",
+            Params={"Bucket": settings.s3_bucket, "Key": key, "UploadId": multipart_id, "PartNumber": part_number},
+            ExpiresIn=expires,
+        )
+
+    def upload_part(self, key: str, multipart_id: str, part_number: int, data: bytes) -> str:
+        return self.client.upload_part(
+            Bucket=settings.s3_bucket, Key=key, UploadId=multipart_id, PartNumber=part_number, Body=data
+        )["ETag"]
+
+    def complete_multipart(self, key: str, multipart_id: str, parts: List[Dict]) -> None:
+        self.client.complete_multipart_upload(
+            Bucket=settings.s3_bucket, Key=key, UploadId=multipart_id, MultipartUpload={"Parts": parts}
+        )
+
+    def abort_multipart(self, key: str, multipart_id: str) -> None:
+        self.client.abort_multipart_upload(Bucket=settings.s3_bucket, Key=key, UploadId=multipart_id)
+
+    def head(self, key: str) -> Optional[Dict]:
+        try:
+            return self.client.head_object(Bucket=settings.s3_bucket, Key=key)
+        except ClientError:
+            return None
+
     def get_stream(self, key: str) -> Iterable[bytes]:
         obj = self.client.get_object(Bucket=settings.s3_bucket, Key=key)
         body = obj["Body"]
         for chunk in iter(lambda: body.read(1024 * 1024), b""):
             yield chunk
 
+    def read_range(self, key: str, byte_range: str) -> bytes:
+        # byte_range is an HTTP Range value, e.g. "bytes=0-65535" or "bytes=-65536".
+        return self.client.get_object(Bucket=settings.s3_bucket, Key=key, Range=byte_range)["Body"].read()
+
     def exists(self, key: str) -> bool:
         try:
             self.client.head_object(Bucket=settings.s3_bucket, Key=key)
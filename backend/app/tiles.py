@@ -0,0 +1,136 @@
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterator, Tuple
+import cv2
+import numpy as np
+from . import tiling
+
+
+TILE_FORMATS = {
+    "jpg": "image/jpeg",
+    "png": "image/png",
+}
+TILE_JPEG_QUALITY = 90
+
+
+@dataclass
+class TilePyramid:
+    # DeepZoom layout: {files_dir}/{level}/{col}_{row}.{format} plus a .dzi descriptor.
+    dzi_path: str
+    files_dir: str
+    width: int
+    height: int
+    tile_size: int
+    overlap: int
+    format: str
+    levels: int
+    tile_count: int
+    build_ms: float
+
+    def as_metrics(self) -> Dict:
+        return {
+            "tileSize": self.tile_size,
+            "overlap": self.overlap,
+            "format": self.format,
+            "levels": self.levels,
+            "tileCount": self.tile_count,
+            "buildMs": round(self.build_ms, 1),
+        }
+
+
+def max_level(width: int, height: int) -> int:
+    return max(0, math.ceil(math.log2(max(width, height, 1))))
+
+
+def level_size(width: int, height: int, level: int) -> Tuple[int, int]:
+    scale = 2 ** (max_level(width, height) - level)
+    return max(1, math.ceil(width / scale)), max(1, math.ceil(height / scale))
+
+
+def tile_grid(width: int, height: int, level: int, tile_size: int) -> Tuple[int, int]:
+    level_width, level_height = level_size(width, height, level)
+    return math.ceil(level_width / tile_size), math.ceil(level_height / tile_size)
+
+
+def _tile_bounds(
+    level_width: int, level_height: int, tile_size: int, overlap: int
+) -> Iterator[Tuple[int, int, int, int, int, int]]:
+    for row in range(math.ceil(level_height / tile_size)):
+        for col in range(math.ceil(level_width / tile_size)):
+            x0 = max(0, col * tile_size - overlap)
+            y0 = max(0, row * tile_size - overlap)
+            x1 = min(level_width, (col + 1) * tile_size + overlap)
+            y1 = min(level_height, (row + 1) * tile_size + overlap)
+            yield col, row, x0, y0, x1, y1
+
+
+def _dzi_xml(width: int, height: int, tile_size: int, overlap: int, tile_format: str) -> str:
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{tile_format}" '
+        f'Overlap="{overlap}" TileSize="{tile_size}">\n'
+        f'  <Size Width="{width}" Height="{height}"/>\n'
+        "</Image>\n"
+    )
+
+
+def build_pyramid(
+    image: np.ndarray,
+    path_stem: str,
+    tile_size: int = 256,
+    overlap: int = 1,
+    tile_format: str = "jpg",
+    rows: int = 1024,
+) -> TilePyramid:
+    # Levels are written from full resolution down to 1x1, each one halved
+    # from the previous, so only the current level and its half-size
+    # successor are alive at once. The full-size level is only sliced, which
+    # keeps memmap-backed pages out of RAM.
+    if tile_format not in TILE_FORMATS:
+        raise ValueError(f"Unknown tile format {tile_format!r}; expected one of {sorted(TILE_FORMATS)}")
+    started = time.perf_counter()
+    height, width = image.shape[:2]
+    files_dir = f"{path_stem}_files"
+    params = [cv2.IMWRITE_JPEG_QUALITY, TILE_JPEG_QUALITY] if tile_format == "jpg" else [cv2.IMWRITE_PNG_COMPRESSION, 1]
+
+    tile_count = 0
+    top = max_level(width, height)
+    current = image
+    for level in range(top, -1, -1):
+        level_dir = os.path.join(files_dir, str(level))
+        os.makedirs(level_dir, exist_ok=True)
+        level_height, level_width = current.shape[:2]
+        for col, row, x0, y0, x1, y1 in _tile_bounds(level_width, level_height, tile_size, overlap):
+            tile = np.ascontiguousarray(current[y0:y1, x0:x1])
+            cv2.imwrite(os.path.join(level_dir, f"{col}_{row}.{tile_format}"), tile, params)
+            tile_count += 1
+        tiling.release(current)
+        if level:
+            current = tiling.reduce_bands(current, 2, rows)
+
+    dzi_path = f"{path_stem}.dzi"
+    with open(dzi_path, "w", encoding="utf-8") as handle:
+        handle.write(_dzi_xml(width, height, tile_size, overlap, tile_format))
+
+    return TilePyramid(
+        dzi_path=dzi_path,
+        files_dir=files_dir,
+        width=width,
+        height=height,
+        tile_size=tile_size,
+        overlap=overlap,
+        format=tile_format,
+        levels=top + 1,
+        tile_count=tile_count,
+        build_ms=(time.perf_counter() - started) * 1000,
+    )
+
+
+def iter_tile_files(pyramid: TilePyramid) -> Iterator[Tuple[str, str]]:
+    # (relative key suffix, local path) for every tile, e.g. ("12/3_4.jpg", ...).
+    for level in sorted(os.listdir(pyramid.files_dir), key=int):
+        level_dir = os.path.join(pyramid.files_dir, level)
+        for name in sorted(os.listdir(level_dir)):
+            yield f"{level}/{name}", os.path.join(level_dir, name)
@@ -0,0 +1,329 @@
+import math
+import mmap
+import os
+import tempfile
+from typing import Dict, List, Optional, Tuple
+import cv2
+import numpy as np
+
+
+# Rough number of band-sized buffers alive at once while a band is processed
+# (source slice, LAB planes, CLAHE output).
+BAND_COPIES = 12
+MIN_BAND_ROWS = 64
+# Rows of context a band needs for Canny's 3x3 gradients and non-maximum suppression.
+EDGE_CONTEXT_ROWS = 2
+
+
+class Scratch:
+    """Allocates page-sized intermediates, as numpy.memmap files when a directory is given."""
+
+    def __init__(self, directory: Optional[str]) -> None:
+        self.directory = directory
+        self.paths: List[str] = []
+
+    def allocate(self, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        if self.directory is None:
+            return np.empty(shape, dtype=dtype)
+        fd, path = tempfile.mkstemp(prefix="scratch_", suffix=".raw", dir=self.directory)
+        os.close(fd)
+        self.paths.append(path)
+        return np.memmap(path, dtype=dtype, mode="w+", shape=shape)
+
+    def cleanup(self) -> None:
+        for path in self.paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.paths = []
+
+    def __enter__(self) -> "Scratch":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.cleanup()
+
+
+def release(*arrays: np.ndarray) -> None:
+    # Drop the resident pages of memmap-backed arrays from this process; the
+    # data stays in the file (and page cache) and faults back in on access.
+    for array in arrays:
+        mapping = getattr(array, "_mmap", None)
+        if mapping is not None and hasattr(mmap, "MADV_DONTNEED"):
+            mapping.madvise(mmap.MADV_DONTNEED)
+
+
+def band_rows(width: int, channels: int, memory_limit_bytes: int) -> int:
+    return max(MIN_BAND_ROWS, memory_limit_bytes // max(1, width * channels * BAND_COPIES))
+
+
+def _bands(height: int, rows: int):
+    for start in range(0, height, rows):
+        yield start, min(height, start + rows)
+
+
+def convert_bands(src: np.ndarray, code: int, out: np.ndarray, rows: int) -> np.ndarray:
+    for start, stop in _bands(src.shape[0], rows):
+        out[start:stop] = cv2.cvtColor(np.ascontiguousarray(src[start:stop]), code)
+        release(src, out)
+    return out
+
+
+def _box_reduce(band: np.ndarray, factor: int, width: int) -> np.ndarray:
+    height = band.shape[0]
+    full_height, full_width = height - height % factor, width - width % factor
+    out = np.empty((math.ceil(height / factor), math.ceil(width / factor)) + band.shape[2:], dtype=band.dtype)
+    if full_height and full_width:
+        out[: full_height // factor, : full_width // factor] = cv2.resize(
+            band[:full_height, :full_width], (full_width // factor, full_height // factor), interpolation=cv2.INTER_AREA
+        )
+    # Blocks cut off by the right or bottom edge average the pixels they have.
+    for rows, cols in (
+        (slice(0, full_height), slice(full_width, width)),
+        (slice(full_height, height), slice(0, full_width)),
+        (slice(full_height, height), slice(full_width, width)),
+    ):
+        region = band[rows, cols]
+        if not region.size:
+            continue
+        block_rows, block_cols = min(factor, region.shape[0]), min(factor, region.shape[1])
+        blocks = region.astype(np.uint32).reshape(
+            (region.shape[0] // block_rows, block_rows, region.shape[1] // block_cols, block_cols) + band.shape[2:]
+        )
+        area = block_rows * block_cols
+        out[rows.start // factor : math.ceil(rows.stop / factor), cols.start // factor : math.ceil(cols.stop / factor)] = (
+            blocks.sum(axis=(1, 3)) + area // 2
+        ) // area
+    return out
+
+
+def reduce_bands(image: np.ndarray, factor: int, rows: int) -> np.ndarray:
+    # Integer box downscale. Band heights are kept multiples of the factor, so
+    # the result does not depend on rows; when both sides divide by the
+    # factor it is exactly a whole-image INTER_AREA resize.
+    if factor <= 1:
+        return image
+    height, width = image.shape[:2]
+    rows = max(factor, rows - rows % factor)
+    parts = []
+    for start, stop in _bands(height, rows):
+        parts.append(_box_reduce(np.ascontiguousarray(image[start:stop]), factor, width))
+        release(image)
+    return np.concatenate(parts, axis=0)
+
+
+def warp_bands(
+    src: np.ndarray,
+    matrix: np.ndarray,
+    size: Tuple[int, int],
+    out: np.ndarray,
+    rows: int,
+    flags: int = cv2.INTER_CUBIC,
+    border_mode: int = cv2.BORDER_REPLICATE,
+) -> np.ndarray:
+    out_width, out_height = size
+    for start, stop in _bands(out_height, rows):
+        # Shift the destination origin to the top of the band.
+        band_matrix = matrix.copy()
+        band_matrix[1, 2] -= start
+        out[start:stop] = cv2.warpAffine(src, band_matrix, (out_width, stop - start), flags=flags, borderMode=border_mode)
+        release(src, out)
+    return out
+
+
+def _hull(points: Optional[np.ndarray], row_offset: int, col_offset: int = 0) -> Optional[np.ndarray]:
+    # Convex hull of findNonZero points as (row, col), shifted to page coordinates.
+    if points is None:
+        return None
+    hull = cv2.convexHull(points)[:, 0, ::-1] + np.array([row_offset, col_offset], dtype=np.int32)
+    return hull.astype(np.int32)
+
+
+def edge_hull_bands(
+    src: np.ndarray,
+    matrix: np.ndarray,
+    size: Tuple[int, int],
+    rows: int,
+    thresholds: Tuple[float, float],
+    flags: int = cv2.INTER_CUBIC,
+    border_mode: int = cv2.BORDER_REPLICATE,
+) -> Optional[np.ndarray]:
+    # Convex hull, as (row, col) points, of cv2.Canny(warped, *thresholds)
+    # where warped is src warped by matrix, without holding the warped page.
+    # Gradients and non-maximum suppression only need EDGE_CONTEXT_ROWS of
+    # context; hysteresis is not local, so each band is split into edge
+    # candidates above the low threshold, grouped into 8-connected components,
+    # and components are joined across band boundaries. A component is an
+    # edge iff its group holds a pixel above the high threshold, exactly as
+    # in Canny. A minimum-area rectangle only depends on the hull, so it can
+    # be fitted to the union of the kept components' hulls.
+    low, high = thresholds
+    out_width, out_height = size
+    hulls: List[np.ndarray] = []
+    parent: Dict[Tuple[int, int], Tuple[int, int]] = {}
+    strong_nodes = set()
+    pending: List[Tuple[Tuple[int, int], np.ndarray]] = []
+
+    def find(node: Tuple[int, int]) -> Tuple[int, int]:
+        while parent.setdefault(node, node) != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    previous_row: Optional[np.ndarray] = None
+    for band_index, (start, stop) in enumerate(_bands(out_height, rows)):
+        lo, hi = max(0, start - EDGE_CONTEXT_ROWS), min(out_height, stop + EDGE_CONTEXT_ROWS)
+        band_matrix = matrix.copy()
+        band_matrix[1, 2] -= lo
+        band = cv2.warpAffine(src, band_matrix, (out_width, hi - lo), flags=flags, borderMode=border_mode)
+        release(src)
+        candidates = cv2.Canny(band, low, low)[start - lo:stop - lo]
+        strong = cv2.Canny(band, high, high)[start - lo:stop - lo]
+        del band
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(candidates, connectivity=8)
+        is_strong = np.zeros(count, dtype=bool)
+        is_strong[labels[strong > 0]] = True
+        is_strong[0] = False
+        hull = _hull(cv2.findNonZero(np.isin(labels, np.flatnonzero(is_strong)).astype(np.uint8)), start)
+        if hull is not None:
+            hulls.append(hull)
+
+        # Components that touch a band boundary may join a strong component
+        # in the neighbouring band.
+        boundary = np.union1d(labels[0], labels[-1])
+        for label in boundary[boundary > 0]:
+            node = (band_index, int(label))
+            find(node)
+            if is_strong[label]:
+                strong_nodes.add(node)
+            else:
+                x, y, w, h = stats[label, :4]
+                component = (labels[y:y + h, x:x + w] == label).astype(np.uint8)
+                pending.append((node, _hull(cv2.findNonZero(component), start + y, x)))
+        if previous_row is not None:
+            current_row = labels[0]
+            for shift in (-1, 0, 1):
+                above = previous_row[max(0, -shift):out_width - max(0, shift)]
+                below = current_row[max(0, shift):out_width - max(0, -shift)]
+                touching = (above > 0) & (below > 0)
+                for a, b in set(zip(above[touching].tolist(), below[touching].tolist())):
+                    parent[find((band_index - 1, a))] = find((band_index, b))
+        previous_row = labels[-1].copy()
+
+    strong_roots = {find(node) for node in strong_nodes}
+    hulls.extend(hull for node, hull in pending if find(node) in strong_roots)
+    if not hulls:
+        return None
+    # Row-major, as np.where lists the pixels: when two rectangles fit equally
+    # well, which one minAreaRect reports depends on the point order.
+    points = np.concatenate(hulls)
+    return points[np.lexsort((points[:, 1], points[:, 0]))]
+
+
+def _luminance(band: np.ndarray) -> np.ndarray:
+    if band.ndim == 2:
+        return band
+    return np.ascontiguousarray(cv2.cvtColor(band, cv2.COLOR_BGR2LAB)[:, :, 0])
+
+
+def _clahe_luts(histograms: np.ndarray, clip_limit: float, tile_pixels: int) -> np.ndarray:
+    # cv::CLAHE's per-tile table: clip the histogram, hand the excess back
+    # evenly (the remainder one count at a time, spread over the levels),
+    # then scale the cumulative histogram to 0-255.
+    histograms = histograms.astype(np.int64)
+    if clip_limit > 0:
+        limit = max(1, int(clip_limit * tile_pixels / 256))
+        clipped = np.maximum(histograms - limit, 0).sum(axis=-1)
+        histograms = np.minimum(histograms, limit) + (clipped // 256)[..., None]
+        for tile, residual in np.ndenumerate(clipped % 256):
+            if residual:
+                step = max(256 // residual, 1)
+                histograms[tile][0 : step * residual : step] += 1
+    scale = np.float32(255) / np.float32(tile_pixels)
+    return np.rint(np.cumsum(histograms, axis=-1).astype(np.float32) * scale).astype(np.uint8)
+
+
+def _clahe_weights(length: int, tile: int, tiles: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Neighbouring tiles and the weight of the second one, per row or column,
+    # in float32 and from page coordinates, as OpenCV computes them.
+    position = np.arange(length, dtype=np.float32) * (np.float32(1) / np.float32(tile)) - np.float32(0.5)
+    first = np.floor(position).astype(np.int64)
+    weight = position - first.astype(np.float32)
+    return np.maximum(first, 0), np.minimum(first + 1, tiles - 1), weight
+
+
+def _segments(first: np.ndarray, second: np.ndarray) -> List[Tuple[int, int]]:
+    # Runs of positions that blend the same pair of tiles.
+    change = np.flatnonzero((np.diff(first) != 0) | (np.diff(second) != 0)) + 1
+    edges = [0] + change.tolist() + [len(first)]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def clahe_bands(
+    image: np.ndarray,
+    out: np.ndarray,
+    rows: int,
+    clip_limit: float = 2.0,
+    grid: Tuple[int, int] = (8, 8),
+) -> np.ndarray:
+    # cv2.createCLAHE(clip_limit, grid).apply() on the page's luminance (the L
+    # plane of LAB for BGR pages), in two passes over bands of rows rows, so
+    # memory follows rows rather than the page or tile height. The first pass
+    # collects the tile histograms and builds the tables; the second blends
+    # the tables of the four nearest tiles for each pixel. Padding, tables and
+    # blending follow OpenCV's implementation, so the result matches it.
+    height, width = image.shape[:2]
+    grid_x, grid_y = grid
+    pad_y = pad_x = 0
+    if height % grid_y or width % grid_x:
+        # OpenCV pads both sides by reflection once either does not divide.
+        pad_y, pad_x = grid_y - height % grid_y, grid_x - width % grid_x
+    tile_height, tile_width = (height + pad_y) // grid_y, (width + pad_x) // grid_x
+
+    histograms = np.zeros((grid_y, grid_x, 256), dtype=np.int64)
+
+    def collect(luminance: np.ndarray, page_rows: np.ndarray) -> None:
+        if pad_x:
+            luminance = cv2.copyMakeBorder(luminance, 0, 0, 0, pad_x, cv2.BORDER_REFLECT_101)
+        for tile_y in np.unique(page_rows // tile_height):
+            block = luminance[page_rows // tile_height == tile_y]
+            for tile_x in range(grid_x):
+                histograms[tile_y, tile_x] += np.bincount(
+                    block[:, tile_x * tile_width : (tile_x + 1) * tile_width].ravel(), minlength=256
+                )
+
+    for start, stop in _bands(height, rows):
+        collect(_luminance(np.ascontiguousarray(image[start:stop])), np.arange(start, stop))
+        release(image)
+    if pad_y:
+        padded = np.arange(height, height + pad_y)
+        collect(_luminance(np.ascontiguousarray(image[2 * (height - 1) - padded])), padded)
+    luts = _clahe_luts(histograms, clip_limit, tile_height * tile_width)
+
+    top, bottom, row_weight = _clahe_weights(height, tile_height, grid_y)
+    left, right, col_weight = _clahe_weights(width, tile_width, grid_x)
+    col_segments = _segments(left, right)
+    for start, stop in _bands(height, rows):
+        band = np.ascontiguousarray(image[start:stop])
+        luminance = _luminance(band)
+        enhanced = np.empty_like(luminance)
+        for row_lo, row_hi in _segments(top[start:stop], bottom[start:stop]):
+            y0, y1 = start + row_lo, start + row_hi
+            lower = row_weight[y0:y1, None]
+            upper = np.float32(1) - lower
+            for x0, x1 in col_segments:
+                values = luminance[row_lo:row_hi, x0:x1]
+                right_weight = col_weight[x0:x1]
+                left_weight = np.float32(1) - right_weight
+                near = luts[top[y0], left[x0]].take(values) * left_weight + luts[top[y0], right[x0]].take(values) * right_weight
+                far = luts[bottom[y0], left[x0]].take(values) * left_weight + luts[bottom[y0], right[x0]].take(values) * right_weight
+                enhanced[row_lo:row_hi, x0:x1] = np.rint(near * upper + far * lower)
+        if band.ndim == 2:
+            out[start:stop] = enhanced
+        else:
+            lab = cv2.cvtColor(band, cv2.COLOR_BGR2LAB)
+            lab[:, :, 0] = enhanced
+            out[start:stop] = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+        release(image, out)
+    return out
@@ -0,0 +1,128 @@
+"""Compare full-resolution and pyramid-proxy skew estimation on large sheets.
+
+Run from backend/:  python -m benchmarks.deskew_proxy --sizes 4200x6300,8400x12600 --skews=-0.7,1.5
+
+"proxy" is the in-memory estimator, "banded" the one used for pages streamed
+from Scratch. Both estimate the skew angle on a pyramid level of at most
+ANGLE_PROXY_PIXELS, which is where the peak memory drops. The quarter-turn
+snap is still decided on the full-resolution deskewed page: it follows the
+sign of a residual well below one proxy pixel, and deciding it on the proxy
+instead (the "snap@proxy" column) disagrees with the legacy path on about a
+quarter of these sheets. That pass dominates the run time, so expect times
+close to the legacy path's; the saving is memory, not time.
+
+Exits non-zero if "proxy" or "banded" picks a different orientation than the
+full-resolution legacy path.
+
+Each measurement runs in a fresh child that only loads the sheet, so the peak
+RSS delta (which includes OpenCV allocations tracemalloc cannot see) is
+attributed to one estimator.
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from typing import Tuple
+import cv2
+import numpy as np
+from app.processor import ANGLE_PROXY_PIXELS, _estimate_transform, _proxy_factor, _pyramid_proxy, _skew_angle
+from app.tiling import MIN_BAND_ROWS
+from tests.helpers import legacy_orientation, legacy_transform, synthetic_sheet
+
+
+def banded_transform(gray: np.ndarray) -> Tuple[float, int]:
+    return _estimate_transform(gray, MIN_BAND_ROWS * 8)
+
+
+def proxy_snap_transform(gray: np.ndarray) -> Tuple[float, int]:
+    # The orientation as it would come out of the proxy alone, for comparison.
+    height, width = gray.shape[:2]
+    factor = _proxy_factor(height, width)
+    proxy = _pyramid_proxy(gray, max(MIN_BAND_ROWS, ANGLE_PROXY_PIXELS // width))
+    angle = _skew_angle(proxy)
+    m = cv2.getRotationMatrix2D(((width // 2) / factor, (height // 2) / factor), angle, 1.0)
+    deskewed = cv2.warpAffine(proxy, m, proxy.shape[::-1], flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+    return angle, legacy_orientation(deskewed)
+
+
+def _rss_kb(field: str) -> int:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _reset_peak_rss() -> None:
+    # Linux: writing 5 to clear_refs resets VmHWM to the current RSS.
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+
+def _measure(name: str, sheet_path: str, conn) -> None:
+    estimators = {
+        "legacy": legacy_transform,
+        "proxy": _estimate_transform,
+        "banded": banded_transform,
+        "snap@proxy": proxy_snap_transform,
+    }
+    gray = np.load(sheet_path)
+    _reset_peak_rss()
+    baseline_kb = _rss_kb("VmRSS")
+    started = time.perf_counter()
+    angle, orientation = estimators[name](gray)
+    elapsed = time.perf_counter() - started
+    peak_kb = _rss_kb("VmHWM")
+    conn.send((angle, orientation, elapsed, (peak_kb - baseline_kb) / 1024))
+    conn.close()
+
+
+def run(name: str, sheet_path: str) -> Tuple[float, int, float, float]:
+    context = multiprocessing.get_context("spawn")
+    parent, child = context.Pipe(duplex=False)
+    process = context.Process(target=_measure, args=(name, sheet_path, child))
+    process.start()
+    result = parent.recv()
+    process.join()
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="2100x3150,4200x6300,8400x12600", help="HxW list, comma separated")
+    parser.add_argument("--skews", default="-3.0,-0.7,1.5", help="skew angles in degrees, comma separated")
+    args = parser.parse_args()
+
+    print(f"{'size':>12} {'skew':>6} | {'legacy angle':>12} {'proxy angle':>11} {'orient':>9} {'snap@proxy':>10} | "
+          f"{'legacy s':>8} {'proxy s':>8} {'banded s':>8} | {'legacy MB':>9} {'proxy MB':>9} {'banded MB':>9}")
+    mismatches = []
+    for size in args.sizes.split(","):
+        height, width = (int(v) for v in size.split("x"))
+        for skew in (float(v) for v in args.skews.split(",")):
+            with tempfile.TemporaryDirectory(prefix="bench_deskew_") as scratch:
+                sheet_path = os.path.join(scratch, "sheet.npy")
+                np.save(sheet_path, synthetic_sheet(height, width, skew))
+                legacy = run("legacy", sheet_path)
+                proxy = run("proxy", sheet_path)
+                banded = run("banded", sheet_path)
+                proxy_snap = run("snap@proxy", sheet_path)
+            orientations = {legacy[1], proxy[1], banded[1]}
+            orientation = "same" if len(orientations) == 1 else f"{legacy[1]}/{proxy[1]}/{banded[1]}"
+            if len(orientations) > 1:
+                mismatches.append(f"{size} skew {skew}")
+            snap = "same" if proxy_snap[1] == legacy[1] else str(proxy_snap[1])
+            print(f"{size:>12} {skew:>6.2f} | {legacy[0]:>12.3f} {proxy[0]:>11.3f} {orientation:>9} {snap:>10} | "
+                  f"{legacy[2]:>8.3f} {proxy[2]:>8.3f} {banded[2]:>8.3f} | "
+                  f"{legacy[3]:>9.1f} {proxy[3]:>9.1f} {banded[3]:>9.1f}")
+    if mismatches:
+        sys.exit("orientation differs from the legacy path: " + ", ".join(mismatches))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+"""page metrics
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-16 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("pages", sa.Column("metrics", sa.JSON(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("pages", "metrics")
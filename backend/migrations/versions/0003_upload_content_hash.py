@@ -0,0 +1,27 @@
+"""upload content hash
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-16 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("uploads", sa.Column("content_sha256", sa.String(length=64), nullable=True))
+    op.add_column("uploads", sa.Column("pipeline_fingerprint", sa.String(), nullable=True))
+    op.create_index("ix_uploads_content_sha256", "uploads", ["content_sha256"])
+
+
+def downgrade():
+    op.drop_index("ix_uploads_content_sha256", table_name="uploads")
+    op.drop_column("uploads", "pipeline_fingerprint")
+    op.drop_column("uploads", "content_sha256")
@@ -0,0 +1,29 @@
+"""page fingerprint
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-16 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("pages", sa.Column("fingerprint", sa.String(), nullable=True))
+    op.add_column(
+        "pages",
+        sa.Column("derived_from_page_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("pages.id"), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_column("pages", "derived_from_page_id")
+    op.drop_column("pages", "fingerprint")
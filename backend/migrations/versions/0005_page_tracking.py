@@ -0,0 +1,46 @@
+"""per-page processing status
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-16 00:00:00.000000
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # ADD VALUE cannot run inside a transaction block on older PostgreSQL.
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE pagestatus ADD VALUE IF NOT EXISTS 'PENDING'")
+        op.execute("ALTER TYPE pagestatus ADD VALUE IF NOT EXISTS 'PROCESSING'")
+    op.alter_column("pages", "width_px", existing_type=sa.Integer(), nullable=True)
+    op.alter_column("pages", "height_px", existing_type=sa.Integer(), nullable=True)
+    op.alter_column("pages", "storage_key_page_png", existing_type=sa.String(), nullable=True)
+    # Pages are now created ahead of processing by concurrent callers, which
+    # rely on this constraint (INSERT ... ON CONFLICT DO NOTHING). Duplicates
+    # left by earlier runs are dropped first, keeping calibrated or referenced rows.
+    op.execute(
+        """
+        DELETE FROM pages p USING pages q
+        WHERE p.upload_id = q.upload_id AND p.page_number = q.page_number AND p.ctid > q.ctid
+          AND NOT EXISTS (SELECT 1 FROM calibrations c WHERE c.page_id = p.id)
+          AND NOT EXISTS (SELECT 1 FROM pages d WHERE d.derived_from_page_id = p.id)
+        """
+    )
+    op.create_unique_constraint("uniq_page_upload_number", "pages", ["upload_id", "page_number"])
+
+
+def downgrade():
+    op.drop_constraint("uniq_page_upload_number", "pages", type_="unique")
+    op.execute("DELETE FROM pages WHERE status IN ('PENDING', 'PROCESSING') OR storage_key_page_png IS NULL")
+    op.alter_column("pages", "storage_key_page_png", existing_type=sa.String(), nullable=False)
+    op.alter_column("pages", "height_px", existing_type=sa.Integer(), nullable=False)
+    op.alter_column("pages", "width_px", existing_type=sa.Integer(), nullable=False)
+    # PostgreSQL cannot drop enum values; PENDING/PROCESSING stay on the type.
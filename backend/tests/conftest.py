@@ -0,0 +1,107 @@
+import os
+import uuid
+from types import SimpleNamespace
+
+# app.config reads these at import; the tests never reach Postgres or S3.
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+os.environ.setdefault("S3_ENDPOINT", "http://localhost:9000")
+os.environ.setdefault("S3_ACCESS_KEY", "test")
+os.environ.setdefault("S3_SECRET_KEY", "test")
+os.environ.setdefault("S3_BUCKET", "test")
+
+import fakeredis  # noqa: E402
+import pytest  # noqa: E402
+from PIL import Image  # noqa: E402
+from sqlalchemy import create_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+from sqlalchemy.sql import sqltypes  # noqa: E402
+from app import models, processor  # noqa: E402
+from app.db import Base  # noqa: E402
+from tests.helpers import synthetic_sheet  # noqa: E402
+
+
+@pytest.fixture
+def redis_bytes():
+    # RQ needs a connection without decode_responses.
+    return fakeredis.FakeRedis()
+
+
+@pytest.fixture
+def redis_text():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def _accept_string_ids(bind_processor):
+    # Postgres takes ids as the strings the API receives; SQLite's UUID
+    # binding only takes uuid.UUID.
+    def accepting(self, dialect):
+        process = bind_processor(self, dialect)
+        if process is None or not self.as_uuid:
+            return process
+        return lambda value: process(uuid.UUID(value) if isinstance(value, str) else value)
+
+    return accepting
+
+
+@pytest.fixture
+def db_session(monkeypatch):
+    # In-memory SQLite stands in for Postgres; one connection, shared by the test.
+    monkeypatch.setattr(sqltypes.Uuid, "bind_processor", _accept_string_ids(sqltypes.Uuid.bind_processor))
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine, autoflush=False, autocommit=False)()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+@pytest.fixture
+def make_upload(db_session):
+    def make(mime_type: str = "application/pdf", status=models.UploadStatus.UPLOADED, **fields) -> models.Upload:
+        # A new project per upload unless project_id is given.
+        project_id = fields.pop("project_id", None)
+        if project_id is None:
+            project = models.Project(name="Lot 12", foundation_type=models.FoundationType.SLAB)
+            db_session.add(project)
+            db_session.flush()
+            project_id = project.id
+        upload = models.Upload(
+            project_id=project_id,
+            original_filename="plans.pdf" if mime_type == "application/pdf" else "plan.png",
+            mime_type=mime_type,
+            size_bytes=fields.pop("size_bytes", 1024),
+            storage_key_original=fields.pop("storage_key_original", f"projects/{project_id}/uploads/original"),
+            status=status,
+            **fields,
+        )
+        db_session.add(upload)
+        db_session.commit()
+        return upload
+
+    return make
+
+
+@pytest.fixture
+def drawing():
+    # drawing(height, width, skew=0.0, seed=0) -> a synthetic plan sheet.
+    return synthetic_sheet
+
+
+@pytest.fixture
+def fake_pdf(monkeypatch):
+    # A five page "PDF" of 160 x 120 px sheets: pdfinfo and pdftoppm are
+    # replaced. Renders are recorded in .rendered; pages in .broken fail.
+    pdf = SimpleNamespace(rendered=[], broken=set())
+
+    def convert_from_path(file_path, dpi, first_page, last_page, **kwargs):
+        pdf.rendered.append((first_page, last_page))
+        if pdf.broken & set(range(first_page, last_page + 1)):
+            raise RuntimeError("pdftoppm failed")
+        return [Image.fromarray(synthetic_sheet(160, 120, seed=number)) for number in range(first_page, last_page + 1)]
+
+    info = {"Pages": 5, "Page size": "24.69 x 32.91 pts"}
+    monkeypatch.setattr(processor, "pdfinfo_from_path", lambda file_path, **kwargs: info)
+    monkeypatch.setattr(processor, "convert_from_path", convert_from_path)
+    return pdf
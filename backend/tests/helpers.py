@@ -0,0 +1,153 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+import cv2
+import numpy as np
+from app.storage import TransferResult
+
+
+def synthetic_sheet(height: int, width: int, skew: float = 0.0, seed: int = 0) -> np.ndarray:
+    # Stand-in for a plan sheet: white paper, a border, ruled lines and text,
+    # rotated by skew degrees.
+    rng = np.random.default_rng(seed)
+    sheet = np.full((height, width), 255, np.uint8)
+    margin = max(height, width) // 40
+    stroke = max(2, max(height, width) // 4000)
+    cv2.rectangle(sheet, (margin, margin), (width - margin, height - margin), 0, stroke * 3)
+    for _ in range(400):
+        x1, x2 = sorted(rng.integers(margin, width - margin, 2))
+        y = int(rng.integers(margin, height - margin))
+        cv2.line(sheet, (int(x1), y), (int(x2), y), 0, stroke)
+        y1, y2 = sorted(rng.integers(margin, height - margin, 2))
+        x = int(rng.integers(margin, width - margin))
+        cv2.line(sheet, (x, int(y1)), (x, int(y2)), 0, stroke)
+    for _ in range(200):
+        origin = (int(rng.integers(margin, width - margin * 4)), int(rng.integers(margin * 2, height - margin)))
+        cv2.putText(sheet, "A-101 DETAIL", origin, cv2.FONT_HERSHEY_SIMPLEX, stroke, 0, stroke)
+    m = cv2.getRotationMatrix2D((width // 2, height // 2), skew, 1.0)
+    return cv2.warpAffine(sheet, m, (width, height), flags=cv2.INTER_LINEAR, borderValue=255)
+
+
+# Skew and orientation as estimated on the full-resolution page before the
+# pyramid proxy (app.processor._estimate_transform), kept as the reference.
+def _legacy_angle(mask: np.ndarray) -> Optional[float]:
+    coords = np.column_stack(np.where(mask > 0))
+    if coords.size == 0:
+        return None
+    angle = cv2.minAreaRect(coords)[-1]
+    if angle < -45:
+        return -(90 + angle)
+    return -angle
+
+
+def legacy_skew_angle(gray: np.ndarray) -> float:
+    inverted = cv2.bitwise_not(gray)
+    thresh = cv2.threshold(inverted, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)[1]
+    angle = _legacy_angle(thresh)
+    return 0.0 if angle is None else angle
+
+
+def legacy_orientation(gray: np.ndarray) -> int:
+    angle = _legacy_angle(cv2.Canny(gray, 50, 150))
+    if angle is None:
+        return 0
+    return (round(angle / 90) * 90) % 360
+
+
+def legacy_transform(gray: np.ndarray) -> Tuple[float, int]:
+    angle = legacy_skew_angle(gray)
+    (h, w) = gray.shape[:2]
+    m = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+    deskewed = cv2.warpAffine(gray, m, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+    return angle, legacy_orientation(deskewed)
+
+
+class _MemoryWriter:
+    def __init__(self, storage: "MemoryStorage", key: str, content_type: str) -> None:
+        self.storage, self.key, self.content_type = storage, key, content_type
+        self.chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> None:
+        self.chunks.append(bytes(data))
+
+    def complete(self) -> None:
+        self.storage.upload_bytes(self.key, b"".join(self.chunks), self.content_type)
+
+    def abort(self) -> None:
+        self.storage.aborted.append(self.key)
+
+
+class MemoryStorage:
+    # Stand-in for app.storage.StorageClient that keeps objects in a dict.
+    def __init__(self) -> None:
+        self.objects: Dict[str, bytes] = {}
+        self.types: Dict[str, str] = {}
+        self.multiparts: Dict[str, Dict[int, bytes]] = {}
+        self.aborted: List[str] = []
+
+    def upload_bytes(self, key: str, data: bytes, content_type: str) -> None:
+        self.objects[key] = bytes(data)
+        self.types[key] = content_type
+
+    def upload_file(self, key: str, file_path: str, content_type: str) -> None:
+        with open(file_path, "rb") as handle:
+            self.upload_bytes(key, handle.read(), content_type)
+
+    def upload_many(self, items: Iterable[Tuple[str, str, str]]) -> List[TransferResult]:
+        results = []
+        for key, file_path, content_type in items:
+            self.upload_file(key, file_path, content_type)
+            results.append(TransferResult(key, len(self.objects[key]), 0.0))
+        return results
+
+    def download_file(self, key: str, file_path: str) -> int:
+        with open(file_path, "wb") as handle:
+            handle.write(self.objects[key])
+        return len(self.objects[key])
+
+    def open_multipart(self, key: str, content_type: str) -> _MemoryWriter:
+        return _MemoryWriter(self, key, content_type)
+
+    def delete(self, key: str) -> None:
+        self.objects.pop(key, None)
+
+    def presign_put(self, key: str, content_type: str, expires: int) -> str:
+        return f"https://storage.test/{key}"
+
+    def create_multipart(self, key: str, content_type: str) -> str:
+        multipart_id = f"mp-{len(self.multiparts) + 1}"
+        self.multiparts[multipart_id] = {}
+        self.types[key] = content_type
+        return multipart_id
+
+    def presign_part(self, key: str, multipart_id: str, part_number: int, expires: int) -> str:
+        return f"https://storage.test/{key}?uploadId={multipart_id}&partNumber={part_number}"
+
+    def upload_part(self, key: str, multipart_id: str, part_number: int, data: bytes) -> str:
+        self.multiparts[multipart_id][part_number] = bytes(data)
+        return f'"etag-{part_number}"'
+
+    def complete_multipart(self, key: str, multipart_id: str, parts: List[Dict]) -> None:
+        stored = self.multiparts.pop(multipart_id)
+        self.objects[key] = b"".join(stored[part["PartNumber"]] for part in parts)
+
+    def abort_multipart(self, key: str, multipart_id: str) -> None:
+        self.multiparts.pop(multipart_id, None)
+        self.aborted.append(key)
+
+    def head(self, key: str) -> Optional[Dict]:
+        if key not in self.objects:
+            return None
+        return {"ContentLength": len(self.objects[key]), "ContentType": self.types.get(key)}
+
+    def get_stream(self, key: str) -> Iterable[bytes]:
+        yield self.objects[key]
+
+    def read_range(self, key: str, byte_range: str) -> bytes:
+        start, _, stop = byte_range.split("=", 1)[1].partition("-")
+        data = self.objects[key]
+        if not start:
+            return data[-int(stop):]
+        return data[int(start) : int(stop) + 1 if stop else None]
+
+    def exists(self, key: str) -> bool:
+        return key in self.objects
+
@@ -0,0 +1,51 @@
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+from app import encoding
+
+
+def _red_markup(drawing) -> np.ndarray:
+    page = cv2.cvtColor(drawing(300, 240, seed=4), cv2.COLOR_GRAY2BGR)
+    cv2.rectangle(page, (40, 60), (200, 220), (0, 0, 255), 6)
+    return page
+
+
+@pytest.mark.parametrize("profile", ["bilevel", "palette"])
+def test_monochrome_page_uses_the_profile(drawing, tmp_path, profile):
+    page = drawing(300, 240, seed=4)
+    encoded = encoding.encode_page(page, str(tmp_path / "page"), encoding.get_profile(profile))
+    assert encoded.codec == encoding.get_profile(profile).codec
+    assert "fallbackFrom" not in encoded.as_metrics()
+
+
+def test_bilevel_keeps_colour_pages_in_png(drawing, tmp_path):
+    page = _red_markup(drawing)
+    encoded = encoding.encode_page(page, str(tmp_path / "page"), encoding.get_profile("bilevel"))
+    assert encoded.codec == "png"
+    assert encoded.as_metrics()["fallbackFrom"] == "png_bilevel"
+    assert encoded.as_metrics()["fallbackReason"] == "color_page"
+    # The red markup survives, pixel for pixel.
+    assert np.array_equal(cv2.imread(encoded.path), page)
+
+
+def test_palette_takes_colour_pages_that_fit(tmp_path):
+    page = np.full((120, 90, 3), 255, dtype=np.uint8)
+    page[20:60, 10:50] = (0, 0, 255)
+    page[70:100, 30:80] = (255, 0, 0)
+    encoded = encoding.encode_page(page, str(tmp_path / "page"), encoding.get_profile("palette"))
+    assert encoded.codec == "png_palette"
+    with Image.open(encoded.path) as image:
+        assert image.mode == "P"
+
+
+def test_palette_falls_back_on_many_colours(tmp_path):
+    page = np.random.default_rng(0).integers(0, 256, (120, 90, 3), dtype=np.uint8)
+    encoded = encoding.encode_page(page, str(tmp_path / "page"), encoding.get_profile("palette"))
+    assert encoded.codec == "png"
+    assert encoded.as_metrics()["fallbackReason"] == "too_many_colors"
+
+
+def test_unknown_profile():
+    with pytest.raises(ValueError):
+        encoding.get_profile("jpeg2000")
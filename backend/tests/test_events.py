@@ -0,0 +1,88 @@
+import asyncio
+import json
+import fakeredis
+import pytest
+from app import events, main
+from app.config import settings
+from app.models import Page, PageStatus, UploadStatus
+
+STEPS = ["queued", "enhancing", "done"]
+
+
+@pytest.fixture
+def streams(monkeypatch):
+    # The job side publishes through the sync client, SSE reads through the async one.
+    server = fakeredis.FakeServer()
+    sync = fakeredis.FakeRedis(server=server, decode_responses=True)
+    monkeypatch.setattr(events, "redis_conn", sync)
+    monkeypatch.setattr(events, "_async_conn", fakeredis.FakeAsyncRedis(server=server, decode_responses=True))
+    monkeypatch.setattr(settings, "progress_keepalive_seconds", 1)
+    return sync
+
+
+def _run_job(upload_id):
+    reporter = events.ProgressReporter(upload_id, STEPS)
+    reporter.step("queued")
+    reporter.step("enhancing")
+    reporter.pages_total(2)
+    reporter.page(1, "page-1", "READY")
+    reporter.page(2, "page-2", "READY")
+    reporter.finish("READY")
+    return reporter
+
+
+def _follow(upload_id, status="PROCESSING", last_id="0", connected_for=100):
+    checks = iter(range(connected_for))
+
+    async def is_disconnected():
+        return next(checks, None) is None
+
+    async def collect():
+        return [frame async for frame in events.follow(upload_id, status, last_id, is_disconnected)]
+
+    return asyncio.run(collect())
+
+
+def _parse(frame):
+    fields = dict(line.split(": ", 1) for line in frame.strip().split("\n"))
+    return fields.get("id"), fields["event"], json.loads(fields["data"])
+
+
+def test_events_are_framed_and_end_with_the_terminal_status(streams):
+    _run_job("u1")
+    frames = _follow("u1")
+    assert all(frame.endswith("\n\n") for frame in frames)
+    parsed = [_parse(frame) for frame in frames]
+    assert [event for _, event, _ in parsed] == ["progress", "timing", "progress", "page", "page", "status"]
+    assert parsed[4][2] == {"pageNumber": 2, "pageId": "page-2", "status": "READY", "pagesReady": 2, "pagesTotal": 2}
+    assert parsed[-1][2] == {"status": "READY"}
+    assert all(event_id for event_id, _, _ in parsed)
+
+
+def test_reconnect_resumes_after_the_last_event_id(streams):
+    _run_job("u1")
+    first = [_parse(frame) for frame in _follow("u1")]
+    resumed = [_parse(frame) for frame in _follow("u1", last_id=first[3][0])]
+    assert resumed == first[4:]
+
+
+def test_finished_upload_without_a_stream_gets_its_status(streams):
+    assert [_parse(frame) for frame in _follow("u1", status="READY")] == [(None, "status", {"status": "READY"})]
+
+
+def test_idle_stream_sends_keepalives_until_the_client_leaves(streams):
+    assert _follow("u1", connected_for=1) == [": keepalive\n\n"]
+
+
+def test_running_upload_reports_progress_from_redis(db_session, make_upload, streams):
+    upload = make_upload(status=UploadStatus.PROCESSING)
+    db_session.add(Page(upload_id=upload.id, page_number=1, status=PageStatus.READY))
+    db_session.commit()
+    reporter = events.ProgressReporter(str(upload.id), STEPS)
+    reporter.step("enhancing")
+    reporter.pages_total(3)
+    reporter.page(1, "page-1", "READY")
+
+    out = asyncio.run(main.get_upload(str(upload.id), db=db_session))
+    assert (out.progress["current"], out.progress["pagesReady"], out.progress["pagesTotal"]) == ("enhancing", 1, 3)
+    assert [page.status for page in out.pages] == [PageStatus.READY]
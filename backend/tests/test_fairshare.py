@@ -0,0 +1,85 @@
+import time
+import pytest
+from rq.job import Job, JobStatus
+from app import fairshare
+from app.config import settings
+
+QUEUE = "uploads"
+
+
+@pytest.fixture(autouse=True)
+def fair_settings(monkeypatch):
+    monkeypatch.setattr(settings, "fairshare_enabled", True)
+    monkeypatch.setattr(settings, "fairshare_queue_depth", 1)
+    monkeypatch.setattr(settings, "fairshare_project_max_running", 0)
+    monkeypatch.setattr(settings, "fairshare_aging_per_second", 0)
+
+
+def _submit(redis, project, cost=10.0, **kwargs):
+    return fairshare.submit(redis, QUEUE, project, cost, print, project, job_timeout=60, **kwargs)
+
+
+def _take(redis):
+    # What a worker would do: pop the queue head, then let dispatch refill it.
+    job_id = redis.lpop("rq:queue:" + QUEUE)
+    if job_id is None:
+        return None
+    fairshare.dispatch(redis, [QUEUE])
+    return Job.fetch(job_id.decode(), connection=redis).meta["fairshare"]["project"]
+
+
+def test_projects_take_turns(redis_bytes):
+    for _ in range(4):
+        _submit(redis_bytes, "a")
+    for _ in range(2):
+        _submit(redis_bytes, "b")
+    order = [_take(redis_bytes) for _ in range(6)]
+    # A's first job was dispatched before B arrived; B is not left behind all of A.
+    assert order == ["a", "a", "b", "a", "b", "a"]
+    assert _take(redis_bytes) is None
+
+
+def test_weights_scale_the_charge(redis_bytes):
+    redis_bytes.hset(fairshare.WEIGHTS_KEY, "b", 2)
+    _submit(redis_bytes, "a")
+    for _ in range(3):
+        _submit(redis_bytes, "a")
+        _submit(redis_bytes, "b")
+    order = [_take(redis_bytes) for _ in range(7)]
+    # B is charged half per job, so it gets two turns for each of A's.
+    assert order == ["a", "a", "b", "b", "a", "b", "a"]
+
+
+def test_dispatched_job_is_queued(redis_bytes):
+    job = _submit(redis_bytes, "a")
+    job.refresh()
+    assert job.get_status() == JobStatus.QUEUED
+    assert redis_bytes.lrange("rq:queue:" + QUEUE, 0, -1) == [job.id.encode()]
+
+
+def test_project_cap_skips_busy_project(redis_bytes, monkeypatch):
+    monkeypatch.setattr(settings, "fairshare_project_max_running", 1)
+    monkeypatch.setattr(settings, "fairshare_queue_depth", 2)
+    first = _submit(redis_bytes, "a")
+    _submit(redis_bytes, "a")
+    _submit(redis_bytes, "b")
+    queued = [Job.fetch(i.decode(), connection=redis_bytes) for i in redis_bytes.lrange("rq:queue:" + QUEUE, 0, -1)]
+    assert [job.meta["fairshare"]["project"] for job in queued] == ["a", "b"]
+
+    # A's second job waits until its first has ended.
+    redis_bytes.lpop("rq:queue:" + QUEUE)
+    assert fairshare.dispatch(redis_bytes, [QUEUE]) == 0
+    fairshare.release(redis_bytes, first)
+    assert fairshare.dispatch(redis_bytes, [QUEUE]) == 1
+
+
+def test_delayed_job_waits_until_due(redis_bytes, monkeypatch):
+    job = _submit(redis_bytes, "a", delay_seconds=30)
+    assert fairshare.dispatch(redis_bytes, [QUEUE]) == 0
+    assert Job.fetch(job.id, connection=redis_bytes).get_status() == JobStatus.DEFERRED
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 31)
+    assert fairshare.dispatch(redis_bytes, [QUEUE]) == 1
+    assert redis_bytes.lrange("rq:queue:" + QUEUE, 0, -1) == [job.id.encode()]
+    assert redis_bytes.zcard(fairshare.PREFIX.format(QUEUE) + ":delayed") == 0
@@ -0,0 +1,104 @@
+import asyncio
+import hashlib
+from typing import Optional
+import pytest
+from fastapi import HTTPException
+from app import ingest, main
+from app.config import settings
+from app.models import Upload
+from tests.helpers import MemoryStorage
+
+BOUNDARY = "plan-boundary"
+ALLOWED = {"application/pdf"}
+
+
+class StreamedRequest:
+    # Just enough of starlette's Request: headers and the body in chunks.
+    def __init__(self, body: bytes, chunk_size: int = 1000, content_length: bool = True) -> None:
+        self.headers = {"content-type": f"multipart/form-data; boundary={BOUNDARY}"}
+        if content_length:
+            self.headers["content-length"] = str(len(body))
+        self.body = body
+        self.chunk_size = chunk_size
+        self.sent = 0
+
+    async def stream(self):
+        while self.sent < len(self.body):
+            chunk = self.body[self.sent : self.sent + self.chunk_size]
+            self.sent += len(chunk)
+            yield chunk
+
+
+def _form(data: Optional[bytes], content_type: str = "application/pdf") -> bytes:
+    # A note field, then the file part unless data is None.
+    body = f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="note"\r\n\r\nrev B\r\n'.encode()
+    if data is not None:
+        body += (
+            f"--{BOUNDARY}\r\n"
+            'Content-Disposition: form-data; name="file"; filename="plans.pdf"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode() + data + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    fake = MemoryStorage()
+    monkeypatch.setattr(ingest, "storage_client", fake)
+    return fake
+
+
+def _receive(request, max_bytes=50_000):
+    return asyncio.run(ingest.receive_file(request, "file", max_bytes, ALLOWED, lambda name: f"originals/{name}"))
+
+
+def test_file_part_is_streamed_and_hashed(storage):
+    data = bytes(range(256)) * 100
+    received = _receive(StreamedRequest(_form(data)))
+    assert (received.key, received.filename) == ("originals/plans.pdf", "plans.pdf")
+    assert received.content_type == "application/pdf"
+    assert received.size_bytes == len(data)
+    assert received.sha256 == hashlib.sha256(data).hexdigest()
+    assert storage.objects["originals/plans.pdf"] == data
+
+
+def test_declared_length_over_the_limit_is_rejected_before_reading(storage):
+    request = StreamedRequest(_form(b"x" * 200_000))
+    with pytest.raises(ingest.UploadRejected) as raised:
+        _receive(request)
+    assert raised.value.detail == "File too large"
+    assert request.sent == 0
+
+
+def test_stream_is_cut_off_once_the_file_passes_the_limit(storage):
+    # Without a Content-Length only the bytes received count.
+    request = StreamedRequest(_form(b"x" * 200_000), content_length=False)
+    with pytest.raises(ingest.UploadRejected) as raised:
+        _receive(request)
+    assert raised.value.detail == "File too large"
+    assert request.sent < 60_000
+    assert storage.aborted == ["originals/plans.pdf"]
+    assert storage.objects == {}
+
+
+@pytest.mark.parametrize(
+    "body, detail",
+    [
+        (_form(b"x", "image/gif"), "Unsupported file type"),
+        (_form(None), "Missing file"),
+        (b"not a form", "Malformed multipart body"),
+    ],
+)
+def test_rejected_forms(storage, body, detail):
+    with pytest.raises(ingest.UploadRejected) as raised:
+        _receive(StreamedRequest(body))
+    assert (raised.value.status_code, raised.value.detail) == (400, detail)
+    assert storage.objects == {}
+
+
+def test_upload_endpoint_turns_rejections_into_400(storage, db_session, monkeypatch):
+    monkeypatch.setattr(settings, "upload_max_bytes", 1000)
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(main.upload_blueprint("p1", StreamedRequest(_form(b"x" * 5000)), db=db_session))
+    assert (raised.value.status_code, raised.value.detail) == (400, "File too large")
+    assert db_session.query(Upload).count() == 0
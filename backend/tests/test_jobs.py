@@ -0,0 +1,252 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+import cv2
+import pytest
+from rq import Queue, get_current_job
+from sqlalchemy.orm import sessionmaker
+from app import events, fairshare, jobs, memory, recovery, routing
+from app.config import settings
+from app.models import Page, PageStatus, UploadStatus
+from app.processor import pipeline_fingerprint
+from app.rq_worker import PreloadedWorker, TimedJob
+from tests.helpers import MemoryStorage, synthetic_sheet
+
+MB = 1024 * 1024
+
+
+def _pages(db_session, upload):
+    return sorted((page.page_number, page.status) for page in db_session.query(Page).filter(Page.upload_id == upload.id))
+
+
+def test_insert_pages_skips_existing_rows(db_session, make_upload):
+    upload = make_upload()
+    assert jobs.insert_pages(db_session, upload.id, [1, 2, 3]) == [1, 2, 3]
+    # A selection change racing the run's claim: only page 4 is new.
+    assert jobs.insert_pages(db_session, upload.id, [2, 3, 4]) == [4]
+    db_session.commit()
+    assert _pages(db_session, upload) == [(number, PageStatus.PENDING) for number in (1, 2, 3, 4)]
+
+
+def test_claim_pages_leaves_ready_pages_alone(db_session, make_upload):
+    upload = make_upload()
+    jobs.insert_pages(db_session, upload.id, [1, 2])
+    db_session.query(Page).filter(Page.page_number == 1).update({Page.status: PageStatus.READY})
+    db_session.commit()
+
+    claimed = jobs._claim_pages(db_session, upload, [1, 2, 3])
+    assert sorted(claimed) == [2, 3]
+    assert _pages(db_session, upload) == [(1, PageStatus.READY), (2, PageStatus.PROCESSING), (3, PageStatus.PROCESSING)]
+    # Claiming again does not duplicate rows.
+    jobs._claim_pages(db_session, upload, [2, 3])
+    assert len(_pages(db_session, upload)) == 3
+
+
+@pytest.fixture
+def worker(db_session, redis_bytes, redis_text, monkeypatch):
+    # process_upload() as a worker runs it, against SQLite, fakeredis and MemoryStorage.
+    storage = MemoryStorage()
+    cost = routing.CostEstimate("small", "uploads", 5.0, 1, 0.03, True)
+    for module in (memory, recovery, events):
+        monkeypatch.setattr(module, "redis_conn", redis_text)
+    monkeypatch.setattr(settings, "node_memory_budget_mb", 0)
+    monkeypatch.setattr(settings, "page_isolation_threshold_mb", 0)
+    monkeypatch.setattr(settings, "page_reuse_enabled", False)
+    monkeypatch.setattr(settings, "page_fanout_batch", 0)
+    monkeypatch.setattr(settings, "fairshare_enabled", True)
+    monkeypatch.setattr(jobs, "SessionLocal", sessionmaker(bind=db_session.get_bind()))
+    monkeypatch.setattr(jobs, "storage_client", storage)
+    monkeypatch.setattr(jobs, "get_current_job", lambda: SimpleNamespace(connection=redis_bytes))
+    monkeypatch.setattr(routing, "estimate_upload", lambda upload, page_numbers: cost)
+    return storage
+
+
+def _png_upload(make_upload, storage):
+    upload = make_upload("image/png", content_sha256="0" * 64, progress={"selectedPages": [1]})
+    sheet = cv2.imencode(".png", synthetic_sheet(200, 150))[1].tobytes()
+    storage.upload_bytes(upload.storage_key_original, sheet, "image/png")
+    return upload
+
+
+def test_upload_is_processed_and_stored(db_session, make_upload, redis_text, worker):
+    upload = _png_upload(make_upload, worker)
+    jobs.process_upload(str(upload.id))
+
+    db_session.expire_all()
+    assert upload.status == UploadStatus.READY
+    (page,) = db_session.query(Page).filter(Page.upload_id == upload.id)
+    assert page.status == PageStatus.READY
+    assert worker.exists(page.storage_key_page_png) and worker.exists(page.storage_key_page_thumb)
+    events_seen = [fields["type"] for _, fields in redis_text.xrange(events.STREAM_KEY.format(upload.id))]
+    assert "page" in events_seen
+
+
+def test_full_memory_budget_defers_the_upload(db_session, make_upload, redis_bytes, redis_text, monkeypatch, worker):
+    upload = _png_upload(make_upload, worker)
+    monkeypatch.setattr(settings, "node_memory_budget_mb", 400)
+    monkeypatch.setattr(settings, "memory_admission_wait_seconds", 0)
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+    # Other workers on the node hold the whole budget.
+    redis_text.zadd(memory.BUDGET_KEY.format(memory.node_name()), {f"busy:{400 * MB}": time.time() + 3600})
+
+    jobs.process_upload(str(upload.id))
+
+    db_session.expire_all()
+    assert upload.status == UploadStatus.UPLOADED
+    assert _pages(db_session, upload) == [(1, PageStatus.PENDING)]
+    delayed = redis_bytes.zrange(fairshare.PREFIX.format("uploads") + ":delayed", 0, -1)
+    assert len(delayed) == 1
+    assert redis_bytes.llen("rq:queue:uploads") == 0
+    assert recovery.acquire(str(upload.id))
+
+
+def _processed(db_session, make_upload, fingerprint, sha="a" * 64):
+    source = make_upload(content_sha256=sha, pipeline_fingerprint=fingerprint, status=UploadStatus.READY)
+    db_session.add(
+        Page(
+            upload_id=source.id,
+            page_number=1,
+            status=PageStatus.READY,
+            storage_key_page_png="source/pages/page_01.png",
+            storage_key_page_thumb="source/thumbs/page_01.jpg",
+        )
+    )
+    db_session.commit()
+    return source
+
+
+def _duplicate(make_upload, storage, sha="a" * 64):
+    upload = make_upload(content_sha256=sha, storage_key_original="fresh/original.pdf")
+    storage.upload_bytes(upload.storage_key_original, b"%PDF", "application/pdf")
+    return upload
+
+
+def test_identical_upload_reuses_the_processed_pages(db_session, make_upload, monkeypatch):
+    storage = MemoryStorage()
+    monkeypatch.setattr(jobs, "storage_client", storage)
+    source = _processed(db_session, make_upload, pipeline_fingerprint(jobs.build_process_options()))
+    upload = _duplicate(make_upload, storage)
+
+    assert jobs._reuse_identical_upload(db_session, upload)
+    assert upload.status == UploadStatus.READY
+    assert upload.storage_key_original == source.storage_key_original
+    assert upload.progress["reusedFromUploadId"] == str(source.id)
+    (page,) = db_session.query(Page).filter(Page.upload_id == upload.id)
+    (source_page,) = db_session.query(Page).filter(Page.upload_id == source.id)
+    assert (page.storage_key_page_png, page.derived_from_page_id) == (source_page.storage_key_page_png, source_page.id)
+    # The duplicate original is not kept.
+    assert not storage.exists("fresh/original.pdf")
+
+
+@pytest.mark.parametrize("fingerprint, sha", [("older-pipeline", "a" * 64), (None, "b" * 64)])
+def test_upload_is_processed_without_an_identical_match(db_session, make_upload, monkeypatch, fingerprint, sha):
+    storage = MemoryStorage()
+    monkeypatch.setattr(jobs, "storage_client", storage)
+    _processed(db_session, make_upload, fingerprint or pipeline_fingerprint(jobs.build_process_options()))
+    upload = _duplicate(make_upload, storage, sha)
+
+    assert not jobs._reuse_identical_upload(db_session, upload)
+    assert upload.status == UploadStatus.UPLOADED
+    assert _pages(db_session, upload) == []
+    assert storage.exists("fresh/original.pdf")
+
+
+def _fingerprinted(db_session, make_upload, fingerprint, pipeline="v2", **fields):
+    source = make_upload(pipeline_fingerprint=pipeline, status=UploadStatus.READY, **fields)
+    db_session.add(Page(upload_id=source.id, page_number=3, status=PageStatus.READY, fingerprint=fingerprint))
+    db_session.commit()
+    return source
+
+
+def test_unchanged_sheet_is_found_in_an_earlier_revision(db_session, make_upload, monkeypatch):
+    monkeypatch.setattr(settings, "page_reuse_max_distance", 2)
+    rev_a = _fingerprinted(db_session, make_upload, "64x64:00ff")
+    upload = make_upload(pipeline_fingerprint="v2", project_id=rev_a.project_id)
+
+    unchanged = jobs._find_unchanged_pages(db_session, upload, {1: "64x64:00fe", 2: "64x64:0f0f"})
+    assert list(unchanged) == [1]
+    assert (unchanged[1].upload_id, unchanged[1].page_number) == (rev_a.id, 3)
+
+
+def test_sheets_of_other_projects_or_pipelines_are_not_reused(db_session, make_upload):
+    _fingerprinted(db_session, make_upload, "64x64:00ff")
+    upload = make_upload(pipeline_fingerprint="v3")
+    _fingerprinted(db_session, make_upload, "64x64:00ff", "v1", project_id=upload.project_id)
+    assert jobs._find_unchanged_pages(db_session, upload, {1: "64x64:00ff"}) == {}
+
+
+def _pages_made(made, fail_at=None, closed=None):
+    # Stands in for iter_process_file(): records which pages were produced, and on which thread.
+    try:
+        for number in range(1, 6):
+            if number == fail_at:
+                raise RuntimeError("page failed")
+            made.append((number, threading.current_thread()))
+            yield SimpleNamespace(page_number=number)
+    finally:
+        if closed is not None:
+            closed.set()
+
+
+def test_pipeline_produces_ahead_of_the_consumer_by_its_depth():
+    made = []
+    pages = jobs._pipelined(_pages_made(made), 1)
+    assert next(pages).page_number == 1
+    time.sleep(0.2)
+    # One page in hand, one in the queue, one waiting to be put.
+    assert [number for number, _ in made] == [1, 2, 3]
+    assert made[0][1] is not threading.current_thread()
+    assert [page.page_number for page in pages] == [2, 3, 4, 5]
+
+
+def test_pipeline_raises_the_producer_error_in_order():
+    pages = jobs._pipelined(_pages_made([], fail_at=3), 2)
+    assert [next(pages).page_number, next(pages).page_number] == [1, 2]
+    with pytest.raises(RuntimeError):
+        next(pages)
+
+
+def test_closing_the_pipeline_stops_the_producer():
+    closed = threading.Event()
+    pages = jobs._pipelined(_pages_made([], closed=closed), 1)
+    next(pages)
+    pages.close()
+    assert closed.is_set()
+
+
+def _fan_out_run(db_session, make_upload, redis_bytes, monkeypatch, worker):
+    # A three page PDF, one page per job, run by an in-process worker.
+    monkeypatch.setattr(settings, "page_fanout_batch", 1)
+    monkeypatch.setattr(jobs, "get_current_job", get_current_job)
+    monkeypatch.setattr(recovery, "reap_due", lambda: False)
+    upload = make_upload(content_sha256="0" * 64, progress={"selectedPages": [1, 2, 3]})
+    worker.upload_bytes(upload.storage_key_original, b"%PDF", "application/pdf")
+    queues = [Queue(name, connection=redis_bytes) for name in (jobs.PAGES_QUEUE, "uploads")]
+    queues[1].enqueue(jobs.process_upload, str(upload.id))
+    PreloadedWorker(queues, connection=redis_bytes, job_class=TimedJob).work(burst=True)
+    db_session.expire_all()
+    return upload
+
+
+def test_fanned_out_pages_are_finalized_together(
+    db_session, make_upload, redis_bytes, monkeypatch, worker, fake_pdf
+):
+    upload = _fan_out_run(db_session, make_upload, redis_bytes, monkeypatch, worker)
+    assert upload.status == UploadStatus.READY
+    assert _pages(db_session, upload) == [(number, PageStatus.READY) for number in (1, 2, 3)]
+    # Each page was rendered by its own job.
+    assert sorted(fake_pdf.rendered) == [(1, 1), (2, 2), (3, 3)]
+    # The finalizer wrote the upload metadata once every page was in.
+    metadata = json.loads(worker.objects[f"projects/{upload.project_id}/uploads/{upload.id}/metadata/upload.json"])
+    assert [page["pageNumber"] for page in metadata["pages"]] == [1, 2, 3]
+    assert recovery.acquire(str(upload.id))
+
+
+def test_failed_page_job_does_not_hold_up_the_others(
+    db_session, make_upload, redis_bytes, monkeypatch, worker, fake_pdf
+):
+    fake_pdf.broken.add(2)
+    upload = _fan_out_run(db_session, make_upload, redis_bytes, monkeypatch, worker)
+    assert upload.status == UploadStatus.READY
+    assert _pages(db_session, upload) == [(1, PageStatus.READY), (2, PageStatus.FAILED), (3, PageStatus.READY)]
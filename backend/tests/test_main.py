@@ -0,0 +1,187 @@
+import asyncio
+import threading
+import pytest
+from fastapi import HTTPException
+from app import main, routing
+from app.config import settings
+from app.models import Page, PageStatus, Upload, UploadStatus
+from app.schemas import PageSelection, UploadFinalizeIn, UploadPresignIn
+from tests.helpers import MemoryStorage
+
+COST = routing.CostEstimate("small", "uploads", 5.0, 1, 0.03, False)
+
+
+def _record_enqueues(monkeypatch, redis_bytes):
+    # Where the estimate ran, and what was queued.
+    calls = []
+    monkeypatch.setattr(main, "redis_conn", redis_bytes)
+    monkeypatch.setattr(
+        routing, "estimate_upload", lambda upload, page_numbers: calls.append(threading.current_thread()) or COST
+    )
+    monkeypatch.setattr(routing, "enqueue", lambda connection, cost, project_id, func, *args, **kw: calls.append(args))
+    return calls
+
+
+def test_select_pages_estimates_off_the_event_loop(db_session, make_upload, redis_bytes, monkeypatch):
+    calls = _record_enqueues(monkeypatch, redis_bytes)
+    upload = make_upload(status=UploadStatus.READY)
+    db_session.add(Page(upload_id=upload.id, page_number=1, status=PageStatus.READY))
+    db_session.commit()
+
+    async def select():
+        loop_thread = threading.current_thread()
+        result = await main.select_pages(upload.id, PageSelection(activePageNumbers=[2, 3]), db=db_session)
+        return loop_thread, result
+
+    loop_thread, result = asyncio.run(select())
+    assert (result.addedPages, result.removedPages) == ([2, 3], [1])
+    estimated_on, queued = calls
+    assert estimated_on is not loop_thread
+    assert queued == (str(upload.id), [2, 3])
+    assert upload.progress["cost"] == COST.as_progress()
+
+
+def test_select_pages_ignores_images(db_session, make_upload, redis_bytes, monkeypatch):
+    calls = _record_enqueues(monkeypatch, redis_bytes)
+    upload = make_upload("image/png", status=UploadStatus.READY)
+    result = asyncio.run(main.select_pages(upload.id, PageSelection(activePageNumbers=[2]), db=db_session))
+    assert result.status == "ignored"
+    assert calls == []
+
+
+def test_thumb_size_picks_the_smallest_that_fits():
+    page = Page(
+        storage_key_page_thumb="thumbs/page_01.jpg",
+        metrics={"thumbnails": {"512": "thumbs/page_01.jpg", "128": "thumbs/page_01_128.jpg"}},
+    )
+    assert main._thumb_key(page, None) == "thumbs/page_01.jpg"
+    assert main._thumb_key(page, 100) == "thumbs/page_01_128.jpg"
+    assert main._thumb_key(page, 300) == "thumbs/page_01.jpg"
+    # Larger than any stored size: the largest there is.
+    assert main._thumb_key(page, 2000) == "thumbs/page_01.jpg"
+    # Pages processed before sizes existed only have the one thumbnail.
+    assert main._thumb_key(Page(storage_key_page_thumb="thumbs/page_01.jpg"), 128) == "thumbs/page_01.jpg"
+
+
+def test_thumb_of_an_unprocessed_page(db_session, make_upload):
+    page = Page(upload_id=make_upload().id, page_number=1, status=PageStatus.PENDING)
+    db_session.add(page)
+    db_session.commit()
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(main.get_page_thumb(page.id, 128, db=db_session))
+    assert raised.value.status_code == 404
+
+
+def _tiled_page(db_session, make_upload, monkeypatch):
+    storage = MemoryStorage()
+    storage.upload_bytes("pages/page_01_files/10/3_2.jpg", b"tile", "image/jpeg")
+    monkeypatch.setattr(main, "storage_client", storage)
+    page = Page(
+        upload_id=make_upload().id,
+        page_number=1,
+        status=PageStatus.READY,
+        width_px=1000,
+        height_px=600,
+        metrics={"tiles": {"tileSize": 256, "format": "jpg", "dziKey": "pages/page_01.dzi"}},
+    )
+    db_session.add(page)
+    db_session.commit()
+    return page
+
+
+def test_tile_is_served_with_long_lived_cache_headers(db_session, make_upload, monkeypatch):
+    page = _tiled_page(db_session, make_upload, monkeypatch)
+    response = asyncio.run(main.get_page_tile(page.id, 10, "3_2.jpg", db=db_session))
+    assert response.media_type == "image/jpeg"
+    assert response.headers["cache-control"] == main.IMMUTABLE_CACHE_HEADERS["Cache-Control"]
+
+
+@pytest.mark.parametrize("level, name", [(10, "4_2.jpg"), (10, "3_3.jpg"), (11, "0_0.jpg"), (10, "3_2.png"), (10, "x")])
+def test_tile_outside_the_pyramid(db_session, make_upload, monkeypatch, level, name):
+    page = _tiled_page(db_session, make_upload, monkeypatch)
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(main.get_page_tile(page.id, level, name, db=db_session))
+    assert raised.value.status_code == 404
+
+
+@pytest.fixture
+def presign(db_session, make_upload, redis_bytes, monkeypatch):
+    # presign(size, content_type) -> UploadPresignOut for a new project.
+    storage = MemoryStorage()
+    monkeypatch.setattr(main, "storage_client", storage)
+    monkeypatch.setattr(main, "redis_conn", redis_bytes)
+    monkeypatch.setattr(settings, "upload_part_size_mb", 1)
+    monkeypatch.setattr(settings, "upload_presign_multipart_mb", 2)
+    project_id = str(make_upload().project_id)
+
+    def request(size, content_type="application/pdf"):
+        payload = UploadPresignIn(filename="Rev B/plans.pdf", contentType=content_type, sizeBytes=size)
+        return asyncio.run(main.presign_upload(project_id, payload, db=db_session))
+
+    request.storage = storage
+    return request
+
+
+def _finalize(db_session, upload_id, parts=()):
+    return asyncio.run(main.finalize_upload(upload_id, UploadFinalizeIn(parts=list(parts)), db=db_session))
+
+
+def test_presigned_put_is_finalized_into_an_upload(db_session, redis_bytes, monkeypatch, presign):
+    calls = _record_enqueues(monkeypatch, redis_bytes)
+    out = presign(1000)
+    assert out.url and out.parts == []
+    assert out.storageKey.endswith(f"/uploads/{out.uploadId}/original/plans.pdf")
+    presign.storage.upload_bytes(out.storageKey, b"x" * 1000, "application/pdf")
+
+    result = _finalize(db_session, out.uploadId)
+    assert result.status == UploadStatus.UPLOADED
+    upload = db_session.query(Upload).filter(Upload.id == out.uploadId).one()
+    assert (upload.storage_key_original, upload.size_bytes) == (out.storageKey, 1000)
+    assert calls[1] == (out.uploadId,)
+    assert not redis_bytes.exists(main._pending_upload_key(out.uploadId))
+    # Finalizing again returns the same upload.
+    assert _finalize(db_session, out.uploadId).uploadId == out.uploadId
+    assert len(calls) == 2
+
+
+def test_large_files_are_presigned_as_multipart(db_session, redis_bytes, monkeypatch, presign):
+    _record_enqueues(monkeypatch, redis_bytes)
+    size = 5 * 1024 * 1024 + 1
+    out = presign(size)
+    assert out.url is None
+    assert (out.partSize, [part.partNumber for part in out.parts]) == (1024 * 1024, [1, 2, 3, 4, 5, 6])
+    multipart_id = next(iter(presign.storage.multiparts))
+    # What the client does with the part urls.
+    etags = []
+    for number in range(1, 7):
+        data = b"x" * min(out.partSize, size - (number - 1) * out.partSize)
+        etag = presign.storage.upload_part(out.storageKey, multipart_id, number, data)
+        etags.append({"partNumber": number, "etag": etag})
+
+    assert _finalize(db_session, out.uploadId, etags).status == UploadStatus.UPLOADED
+    assert len(presign.storage.objects[out.storageKey]) == size
+
+
+@pytest.mark.parametrize("size, content_type, status", [(10, "text/html", 400), (10**12, "application/pdf", 400)])
+def test_presign_rejects_what_upload_would(presign, size, content_type, status):
+    with pytest.raises(HTTPException) as raised:
+        presign(size, content_type)
+    assert raised.value.status_code == status
+
+
+def test_finalize_rejects_a_file_that_does_not_match(db_session, presign):
+    out = presign(1000)
+    with pytest.raises(HTTPException) as raised:
+        _finalize(db_session, out.uploadId)
+    assert raised.value.detail == "File has not been uploaded"
+
+    presign.storage.upload_bytes(out.storageKey, b"x" * 999, "application/pdf")
+    with pytest.raises(HTTPException) as raised:
+        _finalize(db_session, out.uploadId)
+    assert raised.value.detail == "Uploaded file does not match the presigned upload"
+    assert not presign.storage.exists(out.storageKey)
+    # The presigned upload is gone as well.
+    with pytest.raises(HTTPException) as raised:
+        _finalize(db_session, out.uploadId)
+    assert raised.value.status_code == 404
+    assert db_session.query(Upload).filter(Upload.id == out.uploadId).count() == 0
@@ -0,0 +1,70 @@
+import time
+import pytest
+from app import memory
+from app.config import settings
+
+MB = 1024 * 1024
+
+
+@pytest.fixture(autouse=True)
+def budget(redis_text, monkeypatch):
+    monkeypatch.setattr(memory, "redis_conn", redis_text)
+    monkeypatch.setattr(settings, "node_name", "node-a")
+    monkeypatch.setattr(settings, "node_memory_budget_mb", 100)
+    monkeypatch.setattr(settings, "memory_admission_wait_seconds", 0)
+    monkeypatch.setattr(time, "sleep", lambda seconds: None)
+    return redis_text
+
+
+def _reserved(redis_text):
+    members = redis_text.zrange(memory.BUDGET_KEY.format("node-a"), 0, -1)
+    return sum(int(member.rsplit(":", 1)[1]) for member in members)
+
+
+def test_reservations_add_up_and_are_removed(budget):
+    with memory.reserve(60 * MB):
+        with memory.reserve(40 * MB):
+            assert _reserved(budget) == 100 * MB
+        assert _reserved(budget) == 60 * MB
+    assert _reserved(budget) == 0
+
+
+def test_over_budget_waits_then_times_out(budget, monkeypatch):
+    clock = [time.time()]
+    monkeypatch.setattr(time, "time", lambda: clock[0])
+    monkeypatch.setattr(time, "sleep", lambda seconds: clock.__setitem__(0, clock[0] + seconds))
+    monkeypatch.setattr(settings, "memory_admission_wait_seconds", 5)
+    waits = []
+    with memory.reserve(60 * MB):
+        with pytest.raises(memory.MemoryAdmissionTimeout):
+            with memory.reserve(41 * MB, on_wait=lambda: waits.append(1)):
+                pass
+    assert waits == [1]
+    assert _reserved(budget) == 0
+
+
+def test_oversize_request_runs_alone(budget):
+    with memory.reserve(250 * MB):
+        assert _reserved(budget) == 250 * MB
+        with pytest.raises(memory.MemoryAdmissionTimeout):
+            with memory.reserve(1 * MB):
+                pass
+
+
+def test_reservation_is_removed_when_the_work_fails(budget):
+    with pytest.raises(RuntimeError):
+        with memory.reserve(10 * MB):
+            raise RuntimeError("page failed")
+    assert _reserved(budget) == 0
+
+
+def test_lapsed_reservation_does_not_count(budget):
+    budget.zadd(memory.BUDGET_KEY.format("node-a"), {f"dead:{90 * MB}": time.time() - 1})
+    with memory.reserve(50 * MB):
+        assert _reserved(budget) == 50 * MB
+
+
+def test_no_budget_is_a_no_op(budget, monkeypatch):
+    monkeypatch.setattr(settings, "node_memory_budget_mb", 0)
+    with memory.reserve(10_000 * MB):
+        assert _reserved(budget) == 0
@@ -0,0 +1,176 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+from app import processor
+from tests.helpers import legacy_transform
+
+
+def _two_step(image: np.ndarray, angle: float, snapped: int) -> np.ndarray:
+    # The pipeline before the transforms were fused: deskew warp, then cv2.rotate.
+    (h, w) = image.shape[:2]
+    m = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
+    deskewed = cv2.warpAffine(image, m, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+    return cv2.rotate(deskewed, processor._ROTATE_CODES[snapped]) if snapped else deskewed
+
+
+@pytest.mark.parametrize("snapped", [0, 90, 180, 270])
+def test_snap_matrix_is_cv2_rotate(snapped):
+    image = np.random.default_rng(snapped).integers(0, 256, (37, 53, 3), dtype=np.uint8)
+    m, size = processor._snap_matrix(snapped, 53, 37)
+    rotated = cv2.warpAffine(image, m[:2], size, flags=cv2.INTER_NEAREST)
+    expected = cv2.rotate(image, processor._ROTATE_CODES[snapped]) if snapped else image
+    assert np.array_equal(rotated, expected)
+
+
+@pytest.mark.parametrize("angle", [1.3, -2.7])
+@pytest.mark.parametrize("snapped", [0, 90, 180, 270])
+def test_fused_matrix_matches_warp_then_rotate(drawing, angle, snapped):
+    image = drawing(301, 457, seed=1)
+    (h, w) = image.shape[:2]
+    m, size = processor._fused_matrix(angle, snapped, w, h)
+    fused = cv2.warpAffine(image, m, size, flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+    expected = _two_step(image, angle, snapped)
+    assert fused.shape == expected.shape
+    # Both sample the same source points; only OpenCV's fixed-point
+    # coordinates round differently, on a few edge pixels.
+    diff = np.abs(fused.astype(np.int16) - expected)
+    assert np.count_nonzero(diff) <= diff.size * 0.002
+    assert diff.mean() < 0.02
+
+
+def test_orient_page_without_skew_only_rotates(drawing, monkeypatch):
+    image = drawing(120, 200)
+    monkeypatch.setattr(processor, "_estimate_transform", lambda gray, rows=None: (0.0, 90))
+    assert np.array_equal(processor._orient_page(image), cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE))
+
+
+@pytest.mark.parametrize("skew", [-3.0, -0.7, 1.5])
+def test_estimate_transform_matches_full_resolution(drawing, skew):
+    gray = drawing(2100, 3150, skew)
+    legacy_angle, legacy_orientation = legacy_transform(gray)
+    angle, orientation = processor._estimate_transform(gray)
+    assert angle == pytest.approx(legacy_angle, abs=0.05)
+    assert orientation == legacy_orientation
+
+
+def test_estimate_transform_does_not_depend_on_band_rows(drawing):
+    gray = drawing(1500, 1100, 1.5, seed=2)
+    assert processor._estimate_transform(gray, 64) == processor._estimate_transform(gray)
+
+
+def test_pdf_pages_are_rendered_one_window_at_a_time(fake_pdf, tmp_path):
+    options = processor.ProcessOptions(render_window=2)
+    pages = processor.iter_process_file("plans.pdf", "application/pdf", [5, 2, 3, 9], str(tmp_path), options)
+    first = next(pages)
+    # Page 5 is not rendered before page 2 has been handed out.
+    assert (first.page_number, fake_pdf.rendered) == (2, [(2, 3)])
+    assert [page.page_number for page in pages] == [3, 5]
+    assert fake_pdf.rendered == [(2, 3), (5, 5)]
+
+
+def test_pdf_without_selected_pages_in_range(fake_pdf):
+    result = processor.process_file("plans.pdf", "application/pdf", [7, 8])
+    assert result.pages == []
+    assert result.upload_warnings == ["No pages processed"]
+    assert fake_pdf.rendered == []
+
+
+class ThreadPool(ThreadPoolExecutor):
+    # Stands in for the forkserver process pool; the page function is the same.
+    def __init__(self, max_workers, mp_context, initializer, initargs):
+        super().__init__(max_workers, initializer=initializer, initargs=initargs)
+
+
+def test_parallel_pages_come_back_in_page_order(fake_pdf, tmp_path, monkeypatch):
+    process_pdf_page = processor._process_pdf_page
+
+    def slow_first(file_path, page_number, temp_dir, options):
+        # Earlier pages finish last.
+        time.sleep((6 - page_number) * 0.02)
+        return process_pdf_page(file_path, page_number, temp_dir, options)
+
+    monkeypatch.setattr(processor, "ProcessPoolExecutor", ThreadPool)
+    monkeypatch.setattr(processor, "_process_pdf_page", slow_first)
+    options = processor.ProcessOptions(workers=2, cv_threads=1)
+    pages = processor.iter_process_file("plans.pdf", "application/pdf", None, str(tmp_path), options)
+    assert [page.page_number for page in pages] == [1, 2, 3, 4, 5]
+    assert sorted(fake_pdf.rendered) == [(number, number) for number in range(1, 6)]
+
+
+def test_parallel_page_failure_is_raised(fake_pdf, tmp_path, monkeypatch):
+    def fail_on_three(file_path, page_number, temp_dir, options):
+        if page_number == 3:
+            raise RuntimeError("pdftoppm failed")
+        return SimpleNamespace(page_number=page_number)
+
+    monkeypatch.setattr(processor, "ProcessPoolExecutor", ThreadPool)
+    monkeypatch.setattr(processor, "_process_pdf_page", fail_on_three)
+    options = processor.ProcessOptions(workers=2)
+    pages = processor.iter_process_file("plans.pdf", "application/pdf", None, str(tmp_path), options)
+    assert [next(pages).page_number, next(pages).page_number] == [1, 2]
+    with pytest.raises(RuntimeError):
+        next(pages)
+
+
+def _rgb(gray: np.ndarray, markup: bool = False) -> Image.Image:
+    page = np.dstack([gray] * 3)
+    if markup:
+        page[20:140, 20:30] = (255, 0, 0)
+    return Image.fromarray(page)
+
+
+def test_monochrome_sheet_is_processed_single_channel(drawing, tmp_path):
+    page = processor._process_page(_rgb(drawing(240, 180, seed=6)), 1, str(tmp_path), processor.ProcessOptions())
+    assert cv2.imread(page.png_path, cv2.IMREAD_UNCHANGED).ndim == 2
+
+
+def test_colour_sheet_keeps_three_channels(drawing, tmp_path):
+    image = _rgb(drawing(240, 180, seed=6), markup=True)
+    assert processor._load_page(image).shape == (240, 180, 3)
+    page = processor._process_page(image, 1, str(tmp_path), processor.ProcessOptions())
+    assert cv2.imread(page.png_path, cv2.IMREAD_UNCHANGED).ndim == 3
+
+
+@pytest.mark.parametrize("markup", [False, True])
+def test_monochrome_jpeg_is_decoded_from_luma(drawing, tmp_path, markup):
+    path = str(tmp_path / "sheet.jpg")
+    _rgb(drawing(480, 360, seed=6), markup).save(path, quality=95)
+    with processor._open_image(path) as image:
+        assert image.mode == ("RGB" if markup else "L")
+
+
+def test_thumbnails_are_written_per_size(drawing, tmp_path):
+    options = processor.ProcessOptions(thumbnail_sizes=(128, 512))
+    page = processor._process_page(Image.fromarray(drawing(1200, 900, seed=2)), 1, str(tmp_path), options)
+    sides = {size: max(cv2.imread(path).shape[:2]) for size, path in page.thumb_paths.items()}
+    assert sides == {512: 512, 128: 128}
+    assert page.thumb_path == page.thumb_paths[512]
+
+
+def test_thumbnails_are_not_upscaled(drawing, tmp_path):
+    options = processor.ProcessOptions(thumbnail_sizes=(512, 256))
+    page = processor._process_page(Image.fromarray(drawing(300, 200, seed=2)), 1, str(tmp_path), options)
+    assert max(cv2.imread(page.thumb_paths[512]).shape[:2]) == 300
+    assert max(cv2.imread(page.thumb_paths[256]).shape[:2]) == 256
+
+
+def test_fingerprint_survives_rescanning_noise(drawing, tmp_path):
+    sheet = drawing(1400, 1000, seed=8)
+    noisy = cv2.add(sheet, np.random.default_rng(8).integers(0, 6, sheet.shape, dtype=np.uint8))
+    other = drawing(1400, 1000, seed=9)
+    fingerprints = {}
+    for name, image in (("sheet", sheet), ("noisy", noisy), ("other", other)):
+        cv2.imwrite(str(tmp_path / f"{name}.png"), image)
+        fingerprints[name] = processor.fingerprint_pages(str(tmp_path / f"{name}.png"), "image/png")[1]
+    # A few of the 64 x 64 bits flip on near-flat neighbours.
+    assert processor.fingerprint_distance(fingerprints["sheet"], fingerprints["noisy"]) <= 16
+    assert processor.fingerprint_distance(fingerprints["sheet"], fingerprints["other"]) > 200
+
+
+def test_fingerprints_of_other_formats_are_not_compared():
+    assert processor.fingerprint_distance("100x80:00ff", "100x80:0f0f") == 8
+    assert processor.fingerprint_distance("100x80:00ff", "80x100:00ff") is None
@@ -0,0 +1,45 @@
+import cv2
+import numpy as np
+import pytest
+from app import quality
+
+
+def _page(drawing, color: bool) -> np.ndarray:
+    gray = drawing(quality.STRIP_ROWS * 3 + 37, 611, skew=0.8, seed=3)
+    # Gray noise so the page uses more than two levels.
+    gray = cv2.add(gray, np.random.default_rng(3).integers(0, 12, gray.shape, dtype=np.uint8))
+    if not color:
+        return gray
+    return np.dstack([gray, cv2.GaussianBlur(gray, (5, 5), 0), 255 - gray // 4])
+
+
+@pytest.mark.parametrize("color", [False, True])
+def test_streamed_metrics_match_whole_page(drawing, color):
+    image = _page(drawing, color)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if color else image
+    result = quality.analyze_page(image)
+
+    assert result.blur_score == pytest.approx(cv2.Laplacian(gray, cv2.CV_64F).var(), rel=1e-9)
+    assert result.contrast == pytest.approx(gray.std(), rel=1e-9)
+    threshold, _ = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    assert result.ink_coverage == pytest.approx(np.count_nonzero(gray <= threshold) / gray.size)
+
+
+def test_noise_sigma_on_flat_page():
+    noise = np.random.default_rng(0).normal(0, 2, (600, 500))
+    result = quality.analyze_page(np.clip(128 + noise, 0, 255).astype(np.uint8))
+    # Small pages are sampled in full.
+    assert result.sampled_fraction == pytest.approx(1.0)
+    assert result.noise_sigma == pytest.approx(2.0, rel=0.1)
+
+
+def test_oversampled_page_lowers_effective_dpi(drawing):
+    sharp = drawing(800, 600, seed=5)
+    soft = cv2.resize(cv2.resize(sharp, (300, 400), interpolation=cv2.INTER_AREA), (600, 800), interpolation=cv2.INTER_CUBIC)
+    assert quality.analyze_page(sharp, dpi=300).effective_dpi > quality.analyze_page(soft, dpi=300).effective_dpi
+
+
+def test_empty_page():
+    result = quality.analyze_page(np.zeros((0, 0), dtype=np.uint8), dpi=300)
+    assert result.blur_score == 0.0
+    assert result.effective_dpi == 300
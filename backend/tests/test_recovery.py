@@ -0,0 +1,76 @@
+import os
+from types import SimpleNamespace
+import pytest
+from app import db, fairshare, jobs, recovery, routing
+from app.config import settings
+
+
+@pytest.fixture
+def locks(redis_text, monkeypatch):
+    monkeypatch.setattr(recovery, "redis_conn", redis_text)
+    return redis_text
+
+
+def test_upload_lock_belongs_to_one_run(locks):
+    token = recovery.acquire("u1")
+    assert token
+    assert recovery.acquire("u1") is None
+    assert not recovery.refresh("u1", "other-run")
+    recovery.release("u1", "other-run")
+    assert locks.get(recovery.LOCK_KEY.format("u1")) == token
+
+
+def test_refresh_extends_only_the_holders_lock(locks):
+    token = recovery.acquire("u1")
+    assert recovery.refresh("u1", token, ttl=900)
+    assert locks.ttl(recovery.LOCK_KEY.format("u1")) > settings.upload_lock_ttl_seconds
+    recovery.release("u1", token)
+    assert not recovery.refresh("u1", token)
+    assert recovery.acquire("u1")
+
+
+def test_retry_later_needs_a_job(monkeypatch):
+    monkeypatch.setattr(jobs, "get_current_job", lambda: None)
+    with pytest.raises(RuntimeError):
+        jobs._retry_later("u1", None)
+
+
+def test_retry_later_goes_back_through_fair_share(redis_bytes, monkeypatch):
+    class FakeDb:
+        def query(self, model):
+            return self
+
+        def filter(self, *conditions):
+            return self
+
+        def one(self):
+            return SimpleNamespace(project_id="p1")
+
+        def close(self):
+            pass
+
+    cost = routing.CostEstimate("large", "uploads_large", 120.0, 3, 90.0, True)
+    monkeypatch.setattr(settings, "fairshare_enabled", True)
+    monkeypatch.setattr(jobs, "get_current_job", lambda: SimpleNamespace(connection=redis_bytes))
+    monkeypatch.setattr(jobs, "SessionLocal", FakeDb)
+    monkeypatch.setattr(routing, "estimate_upload", lambda upload, page_numbers: cost)
+
+    jobs._retry_later("u1", [2, 3])
+    delayed = redis_bytes.zrange(fairshare.PREFIX.format("uploads_large") + ":delayed", 0, -1, withscores=True)
+    assert len(delayed) == 1
+    assert delayed[0][0].startswith(b"p1|")
+    assert redis_bytes.llen("rq:queue:uploads_large") == 0
+
+
+def test_forked_process_gets_its_own_connection_pool():
+    # The reaper uses the pool in the worker parent; work horses are forked from it.
+    parent_pool = db.engine.pool
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.write(write, b"fresh" if db.engine.pool is not parent_pool else b"shared")
+        os._exit(0)
+    os.close(write)
+    os.waitpid(pid, 0)
+    assert os.read(read, 16) == b"fresh"
+    assert db.engine.pool is parent_pool
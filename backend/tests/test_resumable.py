@@ -0,0 +1,99 @@
+import pytest
+from app import resumable
+from app.config import settings
+
+
+class FakeStorage:
+    def __init__(self):
+        self.parts = {}
+        self.aborted = []
+
+    def create_multipart(self, key, mime_type):
+        return "mp-1"
+
+    def upload_part(self, key, multipart_id, part_number, data):
+        self.parts[part_number] = data
+        return f"etag-{part_number}"
+
+    def abort_multipart(self, key, multipart_id):
+        self.aborted.append(multipart_id)
+
+
+@pytest.fixture
+def storage(redis_text, monkeypatch):
+    fake = FakeStorage()
+    monkeypatch.setattr(resumable, "redis_conn", redis_text)
+    monkeypatch.setattr(resumable, "storage_client", fake)
+    monkeypatch.setattr(settings, "upload_part_size_mb", 1)
+    return fake
+
+
+def _session(size=3 * 1024 * 1024):
+    return resumable.create_session("p1", "u1", "plan.pdf", "application/pdf", size, "originals/u1.pdf")
+
+
+def test_store_part_advances_offset(storage):
+    session = _session()
+    token = resumable.acquire(session.upload_id)
+    part = b"x" * session.part_size
+    resumable.store_part(session, token, part)
+    resumable.store_part(session, token, part)
+
+    stored = resumable.load_session(session.upload_id)
+    assert stored.offset == session.offset == 2 * session.part_size
+    assert stored.completed_parts() == [{"PartNumber": 1, "ETag": "etag-1"}, {"PartNumber": 2, "ETag": "etag-2"}]
+    assert stored.next_part_number() == 3
+    assert sorted(storage.parts) == [1, 2]
+
+
+def test_store_part_renews_the_lock(storage, redis_text):
+    session = _session()
+    token = resumable.acquire(session.upload_id)
+    lock_key = resumable.LOCK_KEY.format(session.upload_id)
+    redis_text.expire(lock_key, 1)
+    resumable.store_part(session, token, b"x" * session.part_size)
+    assert redis_text.ttl(lock_key) > 1
+
+
+def test_lost_lock_rejects_the_part(storage, redis_text):
+    session = _session()
+    token = resumable.acquire(session.upload_id)
+    redis_text.delete(resumable.LOCK_KEY.format(session.upload_id))
+    with pytest.raises(resumable.LockLost):
+        resumable.store_part(session, token, b"x" * session.part_size)
+    assert storage.parts == {}
+    assert resumable.load_session(session.upload_id).offset == 0
+
+
+def test_stale_offset_rejects_the_part(storage):
+    session = _session()
+    token = resumable.acquire(session.upload_id)
+    stale = resumable.load_session(session.upload_id)
+    resumable.store_part(session, token, b"x" * session.part_size)
+    with pytest.raises(resumable.LockLost):
+        resumable.store_part(stale, token, b"y" * session.part_size)
+    assert storage.parts == {1: b"x" * session.part_size}
+    assert resumable.load_session(session.upload_id).offset == session.part_size
+
+
+def test_lock_is_exclusive_and_released_only_by_its_owner(storage):
+    token = resumable.acquire("u1")
+    assert token
+    assert resumable.acquire("u1") is None
+    assert not resumable.refresh("u1", "someone-else")
+    resumable.release("u1", "someone-else")
+    assert resumable.acquire("u1") is None
+    assert resumable.refresh("u1", token)
+    resumable.release("u1", token)
+    assert resumable.acquire("u1")
+
+
+def test_expired_sessions_are_aborted_unless_locked(storage, redis_text):
+    locked = _session()
+    idle = resumable.create_session("p1", "u2", "b.pdf", "application/pdf", 10, "originals/u2.pdf")
+    redis_text.zadd(resumable.SESSIONS_KEY, {locked.upload_id: 0, idle.upload_id: 0})
+    resumable.acquire(locked.upload_id)
+    resumable.collect_expired_sessions()
+    assert storage.aborted == [idle.multipart_id]
+    assert resumable.load_session(idle.upload_id) is None
+    assert resumable.load_session(locked.upload_id) is not None
@@ -0,0 +1,68 @@
+import io
+import pytest
+from PIL import Image
+from app import routing
+from app.models import Upload
+from tests.helpers import MemoryStorage
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    fake = MemoryStorage()
+    monkeypatch.setattr(routing, "storage_client", fake)
+    return fake
+
+
+def _upload(storage, mime_type, data, size_bytes=None, **fields):
+    storage.upload_bytes("originals/plan", data, mime_type)
+    size_bytes = len(data) if size_bytes is None else size_bytes
+    return Upload(mime_type=mime_type, size_bytes=size_bytes, storage_key_original="originals/plan", **fields)
+
+
+def _pdf(pages, box=(0, 0, 2592, 1728), linearized=True):
+    head = b"%PDF-1.7\n"
+    if linearized:
+        head += f"1 0 obj << /Linearized 1 /L 9000000 /N {pages} >> endobj\n".encode()
+    body = b"x" * (routing.PROBE_BYTES * 2)
+    tail = f"3 0 obj << /Type /Pages /Count {pages} /MediaBox [{' '.join(map(str, box))}] >> endobj\n%%EOF".encode()
+    return head + body + tail
+
+
+def test_phone_photo_goes_to_the_small_lane(storage):
+    photo = io.BytesIO()
+    Image.new("RGB", (4032, 3024), "white").save(photo, format="JPEG")
+    cost = routing.estimate_upload(_upload(storage, "image/jpeg", photo.getvalue(), size_bytes=3 * 1024 * 1024))
+    assert (cost.lane, cost.queue, cost.pages, cost.probed) == ("small", "uploads_small", 1, True)
+    assert cost.megapixels == pytest.approx(12.2)
+
+
+def test_large_plan_set_goes_to_the_large_lane(storage):
+    cost = routing.estimate_upload(_upload(storage, "application/pdf", _pdf(200), size_bytes=60 * 1024 * 1024))
+    assert (cost.lane, cost.queue, cost.pages, cost.probed) == ("large", "uploads_large", 200, True)
+
+
+def test_selected_pages_bound_the_estimate(storage):
+    upload = _upload(storage, "application/pdf", _pdf(200, linearized=False), progress={"selectedPages": [1, 2, 500]})
+    cost = routing.estimate_upload(upload)
+    # One ARCH D sheet at PDF_DPI is about 106 megapixels.
+    assert (cost.lane, cost.pages, cost.megapixels) == ("standard", 2, pytest.approx(211.7, abs=0.1))
+    assert routing.estimate_upload(upload, [7]).pages == 1
+
+
+def test_unreadable_original_falls_back_to_its_size(storage, monkeypatch):
+    def unavailable(key, byte_range):
+        raise ConnectionError("storage unavailable")
+
+    monkeypatch.setattr(storage, "read_range", unavailable)
+    cost = routing.estimate_upload(_upload(storage, "application/pdf", b"%PDF", size_bytes=3 * 1024 * 1024))
+    assert (cost.pages, cost.probed) == (10, False)
+    assert cost == routing.estimate("application/pdf", 3 * 1024 * 1024)
+
+
+def test_job_timeout_follows_the_estimate(redis_bytes):
+    cost = routing.estimate("application/pdf", 0, page_count=100)
+    job = routing.enqueue(redis_bytes, cost, "p1", print, "u1")
+    assert job.timeout == int(cost.seconds * routing.JOB_TIMEOUT_FACTOR)
+    assert job.meta["cost"] == cost.as_progress()
+    small = routing.enqueue(redis_bytes, routing.estimate("image/png", 1000, page_pixels=100), "p1", print, "u2")
+    assert small.timeout == routing.MIN_JOB_TIMEOUT_SECONDS
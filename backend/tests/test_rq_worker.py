@@ -0,0 +1,37 @@
+import pytest
+from rq import Queue
+from rq.job import JobStatus
+from app import recovery, rq_worker
+from app.config import settings
+
+
+@pytest.fixture
+def queue(redis_bytes, monkeypatch):
+    monkeypatch.setattr(settings, "fairshare_enabled", False)
+    monkeypatch.setattr(recovery, "reap_due", lambda: False)
+    return Queue("uploads", connection=redis_bytes)
+
+
+def _worker(queue):
+    return rq_worker.PreloadedWorker([queue], connection=queue.connection, job_class=rq_worker.TimedJob)
+
+
+def test_preloaded_worker_runs_jobs_in_process_and_times_setup(queue):
+    jobs = [queue.enqueue(len, "x" * n) for n in (1, 2, 3)]
+    worker = _worker(queue)
+    worker.work(burst=True, max_jobs=2)
+
+    statuses = [job.get_status(refresh=True) for job in jobs]
+    assert statuses == [JobStatus.FINISHED, JobStatus.FINISHED, JobStatus.QUEUED]
+    assert jobs[1].return_value() == 2
+    meta = jobs[0].get_meta(refresh=True)
+    assert meta["runMs"] >= 0 and meta["setupMs"] >= 0
+
+
+def test_worker_over_the_rss_ceiling_stops_after_its_job(queue):
+    jobs = [queue.enqueue(len, "xy") for _ in range(2)]
+    worker = _worker(queue)
+    worker.max_rss_bytes = 1
+    worker.work(burst=True)
+    assert [job.get_status(refresh=True) for job in jobs] == [JobStatus.FINISHED, JobStatus.QUEUED]
+
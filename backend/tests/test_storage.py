@@ -0,0 +1,102 @@
+import threading
+import pytest
+from app import storage
+from app.config import settings
+
+
+class FakeS3:
+    # Records what StorageClient asks of boto3.
+    def __init__(self, barrier=None):
+        self.barrier = barrier
+        self.uploaded = {}
+        self.calls = []
+
+    def upload_file(self, file_path, bucket, key, ExtraArgs, Config):
+        if self.barrier:
+            self.barrier.wait(timeout=5)
+        if key.endswith("broken.png"):
+            raise OSError("connection reset")
+        with open(file_path, "rb") as handle:
+            self.uploaded[key] = (handle.read(), ExtraArgs["ContentType"], Config.multipart_threshold)
+
+    def put_object(self, **kwargs):
+        self.calls.append(("put_object", kwargs["Key"], len(kwargs["Body"])))
+
+    def create_multipart_upload(self, **kwargs):
+        self.calls.append(("create_multipart_upload", kwargs["Key"]))
+        return {"UploadId": "mp-1"}
+
+    def upload_part(self, **kwargs):
+        self.calls.append(("upload_part", kwargs["PartNumber"], len(kwargs["Body"])))
+        return {"ETag": f"etag-{kwargs['PartNumber']}"}
+
+    def complete_multipart_upload(self, **kwargs):
+        self.calls.append(("complete_multipart_upload", kwargs["MultipartUpload"]["Parts"]))
+
+    def abort_multipart_upload(self, **kwargs):
+        self.calls.append(("abort_multipart_upload", kwargs["UploadId"]))
+
+
+def _files(tmp_path, count):
+    items = []
+    for number in range(count):
+        path = tmp_path / f"page_{number}.png"
+        path.write_bytes(b"x" * (number + 1))
+        items.append((f"pages/page_{number}.png", str(path), "image/png"))
+    return items
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(settings, "s3_transfer_threads", 4)
+    monkeypatch.setattr(settings, "s3_multipart_threshold_mb", 16)
+    return storage.StorageClient()
+
+
+def test_upload_many_sends_objects_concurrently(client, tmp_path):
+    # Every transfer waits for the other three: this only finishes if four run at once.
+    client.client = FakeS3(threading.Barrier(4))
+    results = client.upload_many(_files(tmp_path, 4))
+    assert [(result.key, result.size_bytes) for result in results] == [(f"pages/page_{n}.png", n + 1) for n in range(4)]
+    assert client.client.uploaded["pages/page_3.png"] == (b"xxxx", "image/png", 16 * 1024 * 1024)
+
+
+def test_upload_many_finishes_the_batch_before_raising(client, tmp_path):
+    client.client = FakeS3()
+    items = _files(tmp_path, 3)
+    items.insert(1, ("pages/broken.png", items[0][1], "image/png"))
+    with pytest.raises(OSError):
+        client.upload_many(items)
+    assert sorted(client.client.uploaded) == [f"pages/page_{n}.png" for n in range(3)]
+
+
+def test_multipart_writer_sends_full_parts_as_they_fill():
+    s3 = FakeS3()
+    writer = storage.MultipartWriter(s3, "originals/plans.pdf", "application/pdf", 0)
+    part = storage.MIN_PART_BYTES
+    for _ in range(5):
+        writer.write(b"x" * (part // 2 + 1))
+    # Two full parts are sent while writing; at most one part stays buffered.
+    assert len(writer.buffer) < part
+    writer.complete()
+    assert s3.calls == [
+        ("create_multipart_upload", "originals/plans.pdf"),
+        ("upload_part", 1, part),
+        ("upload_part", 2, part),
+        ("upload_part", 3, 5 * (part // 2 + 1) - 2 * part),
+        ("complete_multipart_upload", [{"ETag": f"etag-{n}", "PartNumber": n} for n in (1, 2, 3)]),
+    ]
+
+
+def test_multipart_writer_small_object_and_abort():
+    s3 = FakeS3()
+    small = storage.MultipartWriter(s3, "originals/plan.png", "image/png", 0)
+    small.write(b"png")
+    small.complete()
+    assert s3.calls == [("put_object", "originals/plan.png", 3)]
+
+    s3.calls.clear()
+    large = storage.MultipartWriter(s3, "originals/plans.pdf", "application/pdf", 0)
+    large.write(b"x" * storage.MIN_PART_BYTES)
+    large.abort()
+    assert s3.calls[-1] == ("abort_multipart_upload", "mp-1")
@@ -0,0 +1,29 @@
+import os
+import cv2
+import pytest
+from app import tiles
+
+
+def test_pyramid_matches_the_deepzoom_grid(drawing, tmp_path):
+    pyramid = tiles.build_pyramid(drawing(600, 1000, seed=7), str(tmp_path / "page"), tile_size=256, overlap=1)
+    # 1000 px wide: levels 10 (full size) down to 0 (1x1).
+    assert pyramid.levels == tiles.max_level(1000, 600) + 1 == 11
+    written = dict(tiles.iter_tile_files(pyramid))
+    assert len(written) == pyramid.tile_count
+    for level in range(pyramid.levels):
+        cols, rows = tiles.tile_grid(1000, 600, level, 256)
+        names = {key for key in written if key.startswith(f"{level}/")}
+        assert names == {f"{level}/{col}_{row}.jpg" for col in range(cols) for row in range(rows)}
+    # Inner tiles carry the overlap on both sides, edge tiles only inwards.
+    assert cv2.imread(written["10/0_0.jpg"]).shape[:2] == (257, 257)
+    assert cv2.imread(written["10/1_1.jpg"]).shape[:2] == (258, 258)
+    assert cv2.imread(written["10/3_2.jpg"]).shape[:2] == (600 - 511, 1000 - 767)
+    assert cv2.imread(written["0/0_0.jpg"]).shape[:2] == (1, 1)
+    with open(pyramid.dzi_path, encoding="utf-8") as handle:
+        assert '<Size Width="1000" Height="600"/>' in handle.read()
+
+
+def test_unknown_tile_format(drawing, tmp_path):
+    with pytest.raises(ValueError):
+        tiles.build_pyramid(drawing(64, 64), str(tmp_path / "page"), tile_format="gif")
+    assert not os.path.exists(tmp_path / "page_files")
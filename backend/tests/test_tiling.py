@@ -0,0 +1,108 @@
+import cv2
+import numpy as np
+import pytest
+from app import tiling
+
+
+def _whole_page_hull_rect(image: np.ndarray, matrix: np.ndarray):
+    (h, w) = image.shape[:2]
+    warped = cv2.warpAffine(image, matrix, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+    return cv2.minAreaRect(np.column_stack(np.where(cv2.Canny(warped, 50, 150) > 0)))
+
+
+@pytest.mark.parametrize("skew", [1.5, -0.7])
+@pytest.mark.parametrize("rows", [7, 64, 500, 10_000])
+def test_edge_hull_bands_matches_whole_page_canny(drawing, skew, rows):
+    image = drawing(900, 1300, skew, seed=3)
+    (h, w) = image.shape[:2]
+    matrix = cv2.getRotationMatrix2D((w // 2, h // 2), -skew, 1.0)
+    hull = tiling.edge_hull_bands(image, matrix, (w, h), rows, (50, 150))
+    assert cv2.minAreaRect(hull) == _whole_page_hull_rect(image, matrix)
+
+
+def test_edge_hull_bands_blank_page():
+    blank = np.full((200, 300), 255, np.uint8)
+    assert tiling.edge_hull_bands(blank, np.eye(3)[:2], (300, 200), 64, (50, 150)) is None
+
+
+@pytest.fixture
+def texture():
+    rng = np.random.default_rng(0)
+    return cv2.GaussianBlur(rng.integers(0, 256, (1603, 1201), dtype=np.uint8), (0, 0), 5)
+
+
+def test_warp_bands_matches_whole_page_warp(texture):
+    (h, w) = texture.shape
+    matrix = cv2.getRotationMatrix2D((w // 2, h // 2), 2.5, 1.0)
+    expected = cv2.warpAffine(texture, matrix, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
+    out = tiling.warp_bands(texture, matrix, (w, h), np.empty_like(texture), 100)
+    assert np.array_equal(out, expected)
+
+
+@pytest.mark.parametrize("factor", [2, 3, 7])
+def test_reduce_bands_matches_whole_page_resize(texture, factor):
+    (h, w) = texture.shape
+    h, w = h - h % factor, w - w % factor
+    expected = cv2.resize(texture[:h, :w], (w // factor, h // factor), interpolation=cv2.INTER_AREA)
+    assert np.array_equal(tiling.reduce_bands(texture[:h, :w], factor, 100), expected)
+
+
+@pytest.mark.parametrize("factor", [2, 3, 7])
+def test_reduce_bands_does_not_depend_on_band_rows(texture, factor):
+    expected = tiling.reduce_bands(texture, factor, texture.shape[0])
+    assert expected.shape == (-(-texture.shape[0] // factor), -(-texture.shape[1] // factor))
+    for rows in (factor, 100, 257):
+        assert np.array_equal(tiling.reduce_bands(texture, factor, rows), expected)
+
+
+def test_reduce_bands_averages_partial_edge_blocks():
+    image = np.arange(35, dtype=np.uint8).reshape(5, 7)
+    reduced = tiling.reduce_bands(image, 3, 3)
+    assert reduced[1, 2] == int(image[3:, 6:].mean() + 0.5)
+    assert reduced[0, 2] == int(image[:3, 6:].mean() + 0.5)
+    assert reduced[1, 0] == int(image[3:, :3].mean() + 0.5)
+
+
+class _RowRecorder(np.ndarray):
+    # Records how many rows each read of the page spans.
+    spans = []
+
+    def __getitem__(self, key):
+        rows = key[0] if isinstance(key, tuple) else key
+        if isinstance(rows, slice):
+            _RowRecorder.spans.append(len(range(*rows.indices(self.shape[0]))))
+        elif isinstance(rows, np.ndarray):
+            _RowRecorder.spans.append(len(rows))
+        return np.asarray(self)[key]
+
+
+@pytest.mark.parametrize("rows", [64, 300, 10_000])
+@pytest.mark.parametrize("shape", [(1603, 1201), (1600, 1200), (1600, 1201)])
+def test_clahe_bands_matches_whole_page_clahe(texture, rows, shape):
+    page = np.ascontiguousarray(cv2.resize(texture, shape[::-1]))
+    expected = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(page)
+    assert np.array_equal(tiling.clahe_bands(page, np.empty_like(page), rows), expected)
+
+
+def test_clahe_bands_color_matches_whole_page_clahe(texture):
+    from app.processor import _clahe
+
+    page = np.dstack([texture, 255 - texture, cv2.GaussianBlur(texture, (9, 9), 0)])
+    assert np.array_equal(tiling.clahe_bands(page, np.empty_like(page), 97), _clahe(page))
+
+
+def test_clahe_bands_reads_and_allocates_per_band(texture):
+    import tracemalloc
+
+    rows = 64
+    page = texture.view(_RowRecorder)
+    _RowRecorder.spans = []
+    out = np.empty_like(texture)
+    tracemalloc.start()
+    tiling.clahe_bands(page, out, rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert _RowRecorder.spans and max(_RowRecorder.spans) <= rows
+    # A band and its float32 blending temporaries, nowhere near a tile row
+    # (a page height / 8 = 200 rows) or the page.
+    assert peak < rows * texture.shape[1] * 16